@@ -0,0 +1,129 @@
+"""
+Admin dashboard statistics.
+
+The overview counters (users, products, orders, paid revenue) are loaded
+with one concurrent round of queries and cached for ADMIN_STATS_CACHE_SECONDS.
+Orders and revenue both include archived orders, so archival changes
+neither. Write paths call notify_changed(), which drops the cached counters
+on every worker through the pubsub "admin_stats" channel; the next overview
+reloads them. A load that overlaps a change notification is not cached, as
+it may have missed that change. The TTL bounds staleness from writes made
+elsewhere (scripts, missed notifications).
+
+Recent orders come from a bounded ring buffer fed by order creation on all
+workers and by order status events. It is seeded from the database the
+first time it is read.
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import schemas
+from cache import TTLCache
+from database import db
+from pubsub import broker
+import order_events
+import rollups
+
+CHANNEL = "admin_stats"
+
+ADMIN_STATS_CACHE_SECONDS = float(os.getenv("ADMIN_STATS_CACHE_SECONDS", 60))
+RECENT_ORDERS = 5
+
+counter_cache = TTLCache(ttl=ADMIN_STATS_CACHE_SECONDS, maxsize=1)
+
+# Newest first; entries are OrderOut dicts
+recent_orders: Deque[dict] = deque(maxlen=RECENT_ORDERS)
+_recent_seeded = False
+_lock = asyncio.Lock()
+
+# Bumped by every change notification
+_generation = 0
+
+
+def order_summary(order) -> dict:
+    """OrderOut as JSON-safe data, small enough to fan out through NOTIFY."""
+    return schemas.OrderOut.model_validate(order).model_dump(mode="json")
+
+
+async def _load_counters() -> Dict[str, float]:
+    users, products, orders, archived_orders, revenue = await asyncio.gather(
+        db.user.count(),
+        db.product.count(),
+        db.order.count(),
+        db.orderarchive.count(),
+        rollups.platform_paid_revenue(),
+    )
+    return {
+        "totalUsers": users,
+        "totalProducts": products,
+        "totalOrders": orders + archived_orders,
+        "totalRevenue": revenue,
+    }
+
+
+async def get_counters() -> Dict[str, float]:
+    counters = counter_cache.get("counters")
+    if counters is None:
+        async with _lock:
+            counters = counter_cache.get("counters")
+            if counters is None:
+                generation = _generation
+                counters = await _load_counters()
+                if generation == _generation:
+                    counter_cache.set("counters", counters)
+    return counters
+
+
+async def get_recent_orders() -> List[dict]:
+    global _recent_seeded
+    if not _recent_seeded:
+        orders = await db.order.find_many(
+            take=RECENT_ORDERS,
+            order={"createdAt": "desc"},
+            include={"items": True}
+        )
+        # Orders recorded while the seed query ran are newer than anything it returned
+        seen = {entry["id"] for entry in recent_orders}
+        for order in orders:
+            if order.id not in seen and len(recent_orders) < RECENT_ORDERS:
+                recent_orders.append(order_summary(order))
+        _recent_seeded = True
+    return list(recent_orders)
+
+
+async def overview() -> dict:
+    counters, orders = await asyncio.gather(get_counters(), get_recent_orders())
+    return {**counters, "recentOrders": orders}
+
+
+def invalidate():
+    global _generation
+    _generation += 1
+    counter_cache.clear()
+
+
+async def notify_changed(order: Optional[dict] = None):
+    """
+    Call after a write that changes the counters; pass order_summary() of a
+    new order to add it to the recent orders. Applies on every worker.
+    """
+    await broker.publish(CHANNEL, "admin_stats:changed", {"order": order})
+
+
+async def _on_stats_changed(topic: str, data):
+    invalidate()
+    order = data.get("order")
+    if order and all(entry["id"] != order["id"] for entry in recent_orders):
+        recent_orders.appendleft(order)
+
+
+async def _on_order_status(topic: str, data):
+    for entry in recent_orders:
+        if entry["id"] == data.get("orderId"):
+            entry.update({key: value for key, value in data.items() if key != "orderId"})
+
+
+broker.on(CHANNEL, _on_stats_changed)
+broker.on(order_events.CHANNEL, _on_order_status)
@@ -0,0 +1,176 @@
+"""
+Order archival.
+
+Delivered and cancelled orders older than ORDER_ARCHIVE_AFTER_DAYS (by
+createdAt) are copied into the OrderArchive tables and removed from the hot
+Order/OrderItem/OrderStatusHistory tables. Each batch locks its orders
+(FOR UPDATE) and reads, copies and deletes them in one transaction, so a
+status change can't slip in between the copy and the delete; orders without
+a tracking projection get one first, so tracking keeps working. Batches are
+spaced out by ORDER_ARCHIVE_BATCH_DELAY so the job never holds locks for
+long or saturates the database, and an advisory lock keeps a second worker
+from archiving at the same time.
+
+Read endpoints call find_archived_order() / find_archived_orders() when the
+hot tables come up short, so archived orders stay visible to customers and
+vendors. Aggregates read both: the sales rollups and the admin overview
+count archived orders too.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from database import db, try_advisory_xact_lock
+import tracking
+
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", 365))  # 0 disables archival
+ORDER_ARCHIVE_BATCH_SIZE = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", 200))
+ORDER_ARCHIVE_BATCH_DELAY = float(os.getenv("ORDER_ARCHIVE_BATCH_DELAY", 1.0))
+ORDER_ARCHIVE_INTERVAL_HOURS = float(os.getenv("ORDER_ARCHIVE_INTERVAL_HOURS", 24))
+
+ARCHIVABLE_STATUSES = ["delivered", "cancelled"]
+
+# pg advisory lock held by the worker archiving a batch
+ARCHIVE_LOCK_KEY = 482002
+
+_CLAIM_BATCH_SQL = """
+SELECT "id" FROM "Order"
+WHERE "status" = ANY($1::text[]) AND "createdAt" < $2::timestamp
+ORDER BY "createdAt"
+LIMIT $3
+FOR UPDATE
+"""
+
+ORDER_FIELDS = [
+    "id", "userId", "totalAmount", "status", "createdAt", "updatedAt",
+    "paymentStatus", "paymentProvider", "paymentReference", "estimatedDelivery",
+    "trackingNumber", "shippingCarrier", "shippingAddress", "billingAddress", "notes",
+]
+
+
+def archive_cutoff(days: Optional[int] = None) -> datetime:
+    days = ORDER_ARCHIVE_AFTER_DAYS if days is None else days
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+async def archive_batch(cutoff: datetime, batch_size: int = ORDER_ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Move one batch of finished orders into the archive. Returns orders moved,
+    0 when done or when another worker is archiving.
+    """
+    # Order timestamps are stored as UTC without a zone
+    naive_cutoff = cutoff.astimezone(timezone.utc).replace(tzinfo=None) if cutoff.tzinfo else cutoff
+
+    async with db.tx(timeout=timedelta(seconds=30)) as transaction:
+        if not await try_advisory_xact_lock(transaction, ARCHIVE_LOCK_KEY):
+            return 0
+
+        # Locked orders can't change status or gain history until we commit
+        claimed = await transaction.query_raw(
+            _CLAIM_BATCH_SQL, ARCHIVABLE_STATUSES, naive_cutoff.isoformat(), batch_size
+        )
+        if not claimed:
+            return 0
+        order_ids = [row["id"] for row in claimed]
+        orders = await transaction.order.find_many(
+            where={"id": {"in": order_ids}},
+            include={"items": {"include": {"product": True}}, "statusHistory": True}
+        )
+        # Tracking reads the projection, which outlives the live order rows
+        await tracking.ensure_projections(transaction, orders)
+        items = [item for o in orders for item in o.items]
+        history = [h for o in orders for h in o.statusHistory]
+
+        await transaction.orderarchive.create_many(
+            data=[{field: getattr(o, field) for field in ORDER_FIELDS} for o in orders],
+            skip_duplicates=True
+        )
+        if items:
+            await transaction.orderitemarchive.create_many(
+                data=[
+                    {
+                        "id": item.id,
+                        "orderId": item.orderId,
+                        "productId": item.productId,
+                        "quantity": item.quantity,
+                        "price": item.price
+                    }
+                    for item in items
+                ],
+                skip_duplicates=True
+            )
+        if history:
+            await transaction.orderstatushistoryarchive.create_many(
+                data=[
+                    {
+                        "id": h.id,
+                        "orderId": h.orderId,
+                        "status": h.status,
+                        "changedBy": h.changedBy,
+                        "notes": h.notes,
+                        "createdAt": h.createdAt
+                    }
+                    for h in history
+                ],
+                skip_duplicates=True
+            )
+
+        await transaction.orderstatushistory.delete_many(where={"orderId": {"in": order_ids}})
+        await transaction.orderitem.delete_many(where={"orderId": {"in": order_ids}})
+        await transaction.order.delete_many(where={"id": {"in": order_ids}})
+
+    return len(orders)
+
+
+async def run_archival(days: Optional[int] = None, max_batches: Optional[int] = None) -> int:
+    """Archive everything past the cutoff in throttled batches. Returns orders moved."""
+    cutoff = archive_cutoff(days)
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = await archive_batch(cutoff)
+        total += moved
+        batches += 1
+        if moved < ORDER_ARCHIVE_BATCH_SIZE:
+            break
+        await asyncio.sleep(ORDER_ARCHIVE_BATCH_DELAY)
+    return total
+
+
+async def archive_loop():
+    """Background task: run archival every ORDER_ARCHIVE_INTERVAL_HOURS."""
+    while True:
+        try:
+            moved = await run_archival()
+            if moved:
+                print(f"[SUCCESS] Archived {moved} orders")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARNING] Order archival failed: {e}")
+        await asyncio.sleep(ORDER_ARCHIVE_INTERVAL_HOURS * 3600)
+
+
+async def find_archived_order(order_id: str):
+    return await db.orderarchive.find_unique(
+        where={"id": order_id},
+        include={"items": True}
+    )
+
+
+async def find_archived_orders(where: dict, take: int, skip: int = 0) -> List:
+    return await db.orderarchive.find_many(
+        where=where,
+        include={"items": True},
+        order={"createdAt": "desc"},
+        take=take,
+        skip=skip
+    )
+
+
+async def find_archived_history(order_id: str) -> List:
+    return await db.orderstatushistoryarchive.find_many(
+        where={"orderId": order_id},
+        order={"createdAt": "desc"}
+    )
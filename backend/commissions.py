@@ -0,0 +1,130 @@
+"""
+Commission rules engine.
+
+Active Commission rows are compiled into an in-memory lookup table the
+first time a rate is needed. The table is kept until an admin changes a
+commission (notify_changed() drops it on every worker through the pubsub
+"commissions" channel) or RULES_MAX_AGE_SECONDS pass. Evaluating an order
+is one pass over its items with no database access.
+
+A rule is an active commission limited to a store, a category or both,
+optionally within a startsAt/endsAt window. For an item, the most specific
+rule in effect wins:
+
+    store + category  >  store  >  category  >  default
+
+with a rule's priority breaking ties at the same level. The default is the
+isDefault commission (active or not, as before rules existed), or
+DEFAULT_COMMISSION_RATE if none is set. Other commissions without a scope
+are informational and never apply.
+"""
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from database import db
+from pubsub import broker
+
+DEFAULT_COMMISSION_RATE = 0.10
+
+CHANNEL = "commissions"
+
+# Safety net if a change notification is missed
+RULES_MAX_AGE_SECONDS = 300
+
+
+class Rule(NamedTuple):
+    id: str
+    rate: float
+    priority: int
+    startsAt: Optional[datetime]
+    endsAt: Optional[datetime]
+
+    def applies(self, at: datetime) -> bool:
+        return (self.startsAt is None or self.startsAt <= at) and (self.endsAt is None or at < self.endsAt)
+
+
+class CompiledRules:
+    def __init__(self, commissions):
+        self.default_rate = DEFAULT_COMMISSION_RATE
+        # (storeId, categoryId) -> rules, highest priority first; None = any (not both)
+        self.rules: Dict[Tuple[Optional[str], Optional[str]], List[Rule]] = {}
+
+        for commission in commissions:
+            if commission.isDefault:
+                self.default_rate = commission.rate
+                continue
+            if not commission.isActive or (commission.storeId is None and commission.categoryId is None):
+                continue
+            key = (commission.storeId, commission.categoryId)
+            self.rules.setdefault(key, []).append(Rule(
+                id=commission.id,
+                rate=commission.rate,
+                priority=commission.priority,
+                startsAt=commission.startsAt,
+                endsAt=commission.endsAt,
+            ))
+        for rules in self.rules.values():
+            rules.sort(key=lambda rule: rule.priority, reverse=True)
+
+    def rate_for(self, store_id: Optional[str], category_id: Optional[str], at: datetime) -> float:
+        for key in ((store_id, category_id), (store_id, None), (None, category_id)):
+            for rule in self.rules.get(key, ()):
+                if rule.applies(at):
+                    return rule.rate
+        return self.default_rate
+
+
+_compiled: Optional[CompiledRules] = None
+_compiled_at: float = 0.0
+_lock = asyncio.Lock()
+
+
+async def get_rules() -> CompiledRules:
+    global _compiled, _compiled_at
+    loop = asyncio.get_event_loop()
+    if _compiled is not None and loop.time() - _compiled_at < RULES_MAX_AGE_SECONDS:
+        return _compiled
+    async with _lock:
+        if _compiled is None or loop.time() - _compiled_at >= RULES_MAX_AGE_SECONDS:
+            commissions = await db.commission.find_many(where={"OR": [{"isActive": True}, {"isDefault": True}]})
+            _compiled = CompiledRules(commissions)
+            _compiled_at = loop.time()
+    return _compiled
+
+
+async def default_rate() -> float:
+    return (await get_rules()).default_rate
+
+
+async def commission_by_store(items, at: Optional[datetime] = None) -> Dict[str, Tuple[float, float]]:
+    """
+    Gross and commission per store for order items (loaded with product).
+    Returns {storeId: (orderAmount, commissionAmount)}.
+    """
+    rules = await get_rules()
+    at = at or datetime.now(timezone.utc)
+    totals: Dict[str, Tuple[float, float]] = {}
+    for item in items:
+        amount = item.price * item.quantity
+        rate = rules.rate_for(item.product.storeId, item.product.categoryId, at)
+        gross, commission = totals.get(item.product.storeId, (0.0, 0.0))
+        totals[item.product.storeId] = (gross + amount, commission + amount * rate)
+    return totals
+
+
+def invalidate():
+    global _compiled
+    _compiled = None
+
+
+async def notify_changed():
+    """Call after any commission write; rebuilds the rules on every worker."""
+    await broker.publish(CHANNEL, "commissions:changed", {})
+
+
+async def _on_commissions_changed(topic: str, data):
+    invalidate()
+
+
+broker.on(CHANNEL, _on_commissions_changed)
@@ -14,3 +14,12 @@ async def get_db_connection():
         except Exception as e:
             print(f"Database connection error: {e}")
     return db
+
+async def try_advisory_xact_lock(client, key: int) -> bool:
+    """
+    Take a Postgres advisory lock for the rest of the transaction `client`
+    belongs to. Returns False at once if another session holds it; used so
+    only one worker runs a periodic job at a time.
+    """
+    row = await client.query_first("SELECT pg_try_advisory_xact_lock($1::bigint) AS locked", key)
+    return bool(row and row["locked"])
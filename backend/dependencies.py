@@ -1,3 +1,4 @@
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 import auth
@@ -5,6 +6,7 @@ import schemas
 from database import db, get_db_connection
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> schemas.UserOut:
     try:
@@ -24,6 +26,25 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> schemas.UserO
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+async def get_optional_user(token: Optional[str] = Depends(oauth2_scheme_optional)) -> Optional[schemas.UserOut]:
+    """The signed-in user, or None for an anonymous request."""
+    if not token:
+        return None
+    return await get_current_user(token)
+
+async def get_current_user_for_stream(
+    token: Optional[str] = Depends(oauth2_scheme_optional),
+    access_token: Optional[str] = None
+) -> schemas.UserOut:
+    """
+    Same as get_current_user, but also accepts the token as an `access_token`
+    query parameter because browser EventSource cannot send headers.
+    """
+    token = token or access_token
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return await get_current_user(token)
+
 async def require_admin(current_user: schemas.UserOut = Depends(get_current_user)) -> schemas.UserOut:
     if current_user.role != "admin":
         raise HTTPException(
@@ -0,0 +1,175 @@
+"""
+Flash sale purchase limits and soldCount.
+
+create_order() calls claim_customer_quota() for each flash sale line inside
+its transaction, for the signed-in customer. That upserts the customer's
+FlashSaleCustomerTally row with a conditional ON CONFLICT update, so the
+per-customer maxQuantity holds even for concurrent orders, and only that
+customer's row is locked - never a row shared by everyone buying the
+product. Overall quota is the product stock, which create_order() already
+claims with a conditional decrement. Cancelling an order gives its flash
+sale quantities back (release_customer_quota()), found through
+OrderItem.flashSaleProductId.
+
+soldCount is not incremented per order. Each worker records which flash
+sale products it sold in memory and, every SOLD_COUNT_FLUSH_SECONDS,
+recomputes soldCount for just those products from the tallies in one
+statement. The recompute is idempotent, so it is correct with any number of
+workers and after a crash; reconcile_sold_counts() at startup repairs
+anything left unflushed.
+"""
+import asyncio
+import os
+from typing import Dict, Iterable, List, Optional, Set
+
+from fastapi import HTTPException
+
+from database import db
+
+SOLD_COUNT_FLUSH_SECONDS = float(os.getenv("SOLD_COUNT_FLUSH_SECONDS", 2))
+
+_CLAIM_SQL = """
+INSERT INTO "FlashSaleCustomerTally" ("flashSaleProductId", "userId", "quantity", "updatedAt")
+VALUES ($1, $2, $3, NOW())
+ON CONFLICT ("flashSaleProductId", "userId") DO UPDATE
+SET "quantity" = "FlashSaleCustomerTally"."quantity" + EXCLUDED."quantity", "updatedAt" = NOW()
+WHERE $4::int IS NULL OR "FlashSaleCustomerTally"."quantity" + EXCLUDED."quantity" <= $4::int
+"""
+
+# Tallies of the order's customer ($2) for the flash sale lines of order $1
+_RELEASE_SQL = """
+UPDATE "FlashSaleCustomerTally" t
+SET "quantity" = GREATEST(t."quantity" - i."quantity", 0), "updatedAt" = NOW()
+FROM (
+    SELECT "flashSaleProductId", SUM("quantity")::int AS "quantity"
+    FROM "OrderItem"
+    WHERE "orderId" = $1 AND "flashSaleProductId" IS NOT NULL
+    GROUP BY "flashSaleProductId"
+) i
+WHERE t."flashSaleProductId" = i."flashSaleProductId" AND t."userId" = $2
+RETURNING t."flashSaleProductId", i."quantity"
+"""
+
+_RECOMPUTE_SQL = """
+UPDATE "FlashSaleProduct" fp
+SET "soldCount" = COALESCE((
+    SELECT SUM(t."quantity") FROM "FlashSaleCustomerTally" t
+    WHERE t."flashSaleProductId" = fp."id"
+), 0)::int
+WHERE fp."id" = ANY($1::text[])
+RETURNING fp."id", fp."soldCount"
+"""
+
+_DRIFTED_SQL = """
+SELECT fp."id"
+FROM "FlashSaleProduct" fp
+LEFT JOIN (
+    SELECT "flashSaleProductId", SUM("quantity")::int AS "sold"
+    FROM "FlashSaleCustomerTally"
+    GROUP BY "flashSaleProductId"
+) t ON t."flashSaleProductId" = fp."id"
+WHERE fp."soldCount" <> COALESCE(t."sold", 0)
+"""
+
+
+async def claim_customer_quota(client, line: dict, user_id: str):
+    """
+    Add a quote line's quantity to the customer's tally for its flash sale
+    product. Pass the transaction client; raises 400 if it would exceed
+    maxQuantity, which rolls the order back.
+    """
+    claimed = await client.execute_raw(
+        _CLAIM_SQL,
+        line["flashSaleProductId"],
+        user_id,
+        line["quantity"],
+        line["maxQuantity"]
+    )
+    if not claimed:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Flash sale limit for {line['name']} is {line['maxQuantity']} per customer"
+        )
+
+
+async def release_customer_quota(client, order_id: str, user_id: str) -> List[dict]:
+    """
+    Give a cancelled order's flash sale quantities back to the customer's
+    tallies. Pass the transaction client; returns the released
+    {flashSaleProductId, quantity} rows for sold_counts.record() after commit.
+    """
+    return await client.query_raw(_RELEASE_SQL, order_id, user_id)
+
+
+class SoldCountBuffer:
+    def __init__(self):
+        self._dirty: Set[str] = set()
+        self._sold: Dict[str, int] = {}  # Latest recomputed soldCount per product
+        self._pending: Dict[str, int] = {}  # Units sold here since that recompute
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, flash_sale_product_id: str, quantity: int):
+        """Call after the order transaction commits; negative for released quantities."""
+        self._dirty.add(flash_sale_product_id)
+        self._pending[flash_sale_product_id] = self._pending.get(flash_sale_product_id, 0) + quantity
+
+    def sold_count(self, flash_sale_product) -> int:
+        """Best known soldCount for a FlashSaleProduct row, which may be stale."""
+        stored = self._sold.get(flash_sale_product.id, flash_sale_product.soldCount)
+        return stored + self._pending.get(flash_sale_product.id, 0)
+
+    async def recompute(self, ids: Iterable[str]) -> int:
+        ids: List[str] = list(ids)
+        if not ids:
+            return 0
+        rows = await db.query_raw(_RECOMPUTE_SQL, ids)
+        for row in rows:
+            self._sold[row["id"]] = row["soldCount"]
+        return len(rows)
+
+    async def flush(self) -> int:
+        """Recompute soldCount for products sold since the last flush."""
+        if not self._dirty:
+            return 0
+        batch, self._dirty = self._dirty, set()
+        pending = {fp_id: self._pending.pop(fp_id, 0) for fp_id in batch}
+        try:
+            return await self.recompute(batch)
+        except Exception:
+            self._dirty |= batch
+            for fp_id, count in pending.items():
+                self._pending[fp_id] = self._pending.get(fp_id, 0) + count
+            raise
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SOLD_COUNT_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WARNING] Flash sale soldCount flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"[WARNING] Final soldCount flush failed: {e}")
+
+
+sold_counts = SoldCountBuffer()
+
+
+async def reconcile_sold_counts() -> int:
+    """Repair every soldCount that disagrees with its tallies. Returns the number fixed."""
+    rows = await db.query_raw(_DRIFTED_SQL)
+    return await sold_counts.recompute(row["id"] for row in rows)
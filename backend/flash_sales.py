@@ -0,0 +1,277 @@
+"""
+Flash sale read paths.
+
+The sale list is cached in-process and invalidated by notify_changed()
+after admin create, update and delete. Product counts for every sale come
+from one group_by, so the list costs at most two queries however many sales
+exist, and none at all while the cache is warm. Time-dependent fields (isActive,
+timeRemaining) are computed per request from the cached rows, so sales
+start and end on time without waiting for the cache to expire.
+
+FlashSaleScheduler keeps enabled sales that are running or start within
+SCHEDULE_HORIZON_HOURS in memory, with their products. asyncio timers swap
+the active set at the exact start and end times, and the active sale and
+per-product flash prices are served from dicts instead of time-window
+queries. Admin writes call notify_changed(), which reloads the schedule on
+every worker through the pubsub "flash_sales" channel.
+
+Each scheduled sale is also rendered to JSON bytes once per load, so the
+active-sale endpoint serves a prebuilt body and only splices in
+timeRemaining per request.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from cache import TTLCache
+from database import db
+import schemas
+from pubsub import broker
+
+LIST_CACHE_SECONDS = 30
+
+CHANNEL = "flash_sales"
+SCHEDULE_HORIZON_HOURS = 24
+# Full reload interval: picks up sales entering the horizon, and is a safety
+# net if a change notification is missed
+SCHEDULE_RELOAD_SECONDS = 300
+
+# "current": enabled sales that have not ended yet; "all": every sale
+list_cache = TTLCache(ttl=LIST_CACHE_SECONDS, maxsize=4)
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _now_like(moment: datetime) -> datetime:
+    """Current time, naive or aware to match the value it is compared with."""
+    return datetime.now(moment.tzinfo) if moment.tzinfo else datetime.now()
+
+
+def calculate_time_remaining(end_time: datetime) -> Optional[int]:
+    """Calculate seconds remaining until flash sale ends."""
+    now = _now_like(end_time)
+    if now >= end_time:
+        return None
+    return int((end_time - now).total_seconds())
+
+
+def is_flash_sale_active(start_time: datetime, end_time: datetime) -> bool:
+    """Check if flash sale is currently active."""
+    now = _now_like(end_time)
+    return start_time <= now < end_time
+
+
+def flash_sale_out(sale, is_active: Optional[bool] = None, time_remaining: Optional[int] = None) -> schemas.FlashSaleOut:
+    """FlashSaleOut for a sale loaded with products -> product."""
+    if is_active is None:
+        is_active = sale.isActive
+    return schemas.FlashSaleOut(
+        id=sale.id,
+        name=sale.name,
+        description=sale.description,
+        startTime=sale.startTime,
+        endTime=sale.endTime,
+        isActive=is_active,
+        products=[schemas.FlashSaleProductOut.model_validate(fp) for fp in sale.products],
+        createdAt=sale.createdAt,
+        updatedAt=sale.updatedAt,
+        timeRemaining=time_remaining
+    )
+
+
+def render_sale(sale) -> bytes:
+    """JSON body for a running sale, without timeRemaining (spliced in per request)."""
+    return flash_sale_out(sale, is_active=True).model_dump_json(exclude={"timeRemaining"}).encode("utf-8")
+
+
+def invalidate_list_cache():
+    list_cache.clear()
+
+
+async def _load_sales(scope: str) -> List[tuple]:
+    where = {"isActive": True, "endTime": {"gt": utcnow()}} if scope == "current" else {}
+    sales = await db.flashsale.find_many(where=where, order={"startTime": "desc"})
+    if not sales:
+        return []
+
+    groups = await db.flashsaleproduct.group_by(
+        ["flashSaleId"],
+        count=True,
+        where={"flashSaleId": {"in": [sale.id for sale in sales]}}
+    )
+    counts = {group["flashSaleId"]: group["_count"]["_all"] for group in groups}
+    return [(sale, counts.get(sale.id, 0)) for sale in sales]
+
+
+async def list_flash_sales(active_only: bool = True) -> List[dict]:
+    scope = "current" if active_only else "all"
+    rows = list_cache.get(scope)
+    if rows is None:
+        rows = await _load_sales(scope)
+        list_cache.set(scope, rows)
+
+    result = []
+    for sale, product_count in rows:
+        is_active = sale.isActive and is_flash_sale_active(sale.startTime, sale.endTime)
+        if active_only and not is_active:
+            continue
+        result.append({
+            "id": sale.id,
+            "name": sale.name,
+            "startTime": sale.startTime,
+            "endTime": sale.endTime,
+            "isActive": is_active,
+            "productCount": product_count,
+            "timeRemaining": calculate_time_remaining(sale.endTime),
+        })
+    return result
+
+
+class FlashSaleScheduler:
+    def __init__(self):
+        self._sales: List = []  # Enabled sales in the horizon, with products
+        self._active: List = []  # Currently running, most recently started first
+        self._prices: Dict[str, Tuple] = {}  # productId -> (FlashSaleProduct, FlashSale)
+        self._next_change: Optional[datetime] = None  # First start/end after the last swap
+        self._payloads: Dict[str, bytes] = {}  # saleId -> render_sale() output
+        self._timers: List[asyncio.TimerHandle] = []
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._reload_task: Optional[asyncio.Task] = None
+
+    async def refresh(self):
+        """Reload the schedule from the database and re-arm the timers."""
+        async with self._lock:
+            now = utcnow()
+            sales = await db.flashsale.find_many(
+                where={
+                    "isActive": True,
+                    "endTime": {"gt": now},
+                    "startTime": {"lte": now + timedelta(hours=SCHEDULE_HORIZON_HOURS)}
+                },
+                include={"products": {"include": {"product": True}}},
+                order={"startTime": "desc"}
+            )
+            self._sales = sales
+            self._payloads = {sale.id: render_sale(sale) for sale in sales}
+            self._loaded = True
+            self._swap()
+            self._arm_timers()
+
+    def _swap(self):
+        """Recompute the active set for the current instant. No I/O."""
+        now = utcnow()
+        active = [sale for sale in self._sales if sale.startTime <= now < sale.endTime]
+
+        prices: Dict[str, Tuple] = {}
+        for sale in active:
+            for fp in sale.products:
+                current = prices.get(fp.productId)
+                # Overlapping sales: the lowest price wins
+                if current is None or fp.salePrice < current[0].salePrice:
+                    prices[fp.productId] = (fp, sale)
+
+        self._active = active
+        self._prices = prices
+        upcoming = [moment for sale in self._sales for moment in (sale.startTime, sale.endTime) if moment > now]
+        self._next_change = min(upcoming) if upcoming else None
+
+    def _current(self):
+        """
+        Swap now if a start or end has passed since the last swap. Timers can
+        fire early or late (clock skew, a blocked loop); lookups never trust
+        them alone.
+        """
+        if self._next_change is not None and utcnow() >= self._next_change:
+            self._swap()
+
+    def _arm_timers(self):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+
+        loop = asyncio.get_event_loop()
+        now = utcnow()
+        for sale in self._sales:
+            for moment in (sale.startTime, sale.endTime):
+                delay = (moment - now).total_seconds()
+                if delay > 0:
+                    self._timers.append(loop.call_later(delay, self._swap))
+
+    async def ensure_loaded(self):
+        if not self._loaded:
+            await self.refresh()
+
+    async def active_sale(self):
+        """The running sale that started most recently, or None."""
+        await self.ensure_loaded()
+        self._current()
+        now = utcnow()
+        for sale in self._active:
+            if sale.startTime <= now < sale.endTime:
+                return sale
+        return None
+
+    async def active_payload(self) -> Optional[bytes]:
+        """Prebuilt FlashSaleOut JSON for active_sale() with a fresh timeRemaining."""
+        sale = await self.active_sale()
+        if sale is None:
+            return None
+        remaining = calculate_time_remaining(sale.endTime)
+        head = b'{"timeRemaining":' + (b"null" if remaining is None else str(remaining).encode("ascii"))
+        body = self._payloads[sale.id]
+        return head + b"," + body[1:]
+
+    async def flash_price(self, product_id: str) -> Optional[Tuple]:
+        """(FlashSaleProduct, FlashSale) if the product is in a running sale."""
+        await self.ensure_loaded()
+        self._current()
+        entry = self._prices.get(product_id)
+        if entry is None or not (entry[1].startTime <= utcnow() < entry[1].endTime):
+            return None
+        return entry
+
+    async def _reload_loop(self):
+        while True:
+            await asyncio.sleep(SCHEDULE_RELOAD_SECONDS)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WARNING] Flash sale schedule reload failed: {e}")
+
+    async def start(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            print(f"[WARNING] Could not load flash sale schedule: {e}")
+        if self._reload_task is None:
+            self._reload_task = asyncio.get_event_loop().create_task(self._reload_loop())
+
+    async def stop(self):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            await asyncio.gather(self._reload_task, return_exceptions=True)
+            self._reload_task = None
+
+
+scheduler = FlashSaleScheduler()
+
+
+async def notify_changed():
+    """Call after any flash sale write; reloads the schedule on every worker."""
+    await broker.publish(CHANNEL, "flash_sales:changed", {})
+
+
+async def _on_flash_sales_changed(topic: str, data):
+    invalidate_list_cache()
+    await scheduler.refresh()
+
+
+broker.on(CHANNEL, _on_flash_sales_changed)
@@ -0,0 +1,391 @@
+"""
+Double-entry ledger for vendor balances.
+
+Every movement of vendor money is a VendorLedgerEntry that moves an amount
+from one account to another. A store's accounts are:
+
+    pending    earned on paid orders, not yet delivered
+    available  delivered and free to withdraw
+    reserved   held by a payout request awaiting an admin
+    paid       paid out to the vendor
+
+and money enters from / leaves to "external" (the platform). Each entry is
+posted in the same transaction as the change that causes it, together with
+a single-row UPDATE of the store's VendorBalance, so reading a balance is one
+row. A move out of an account is conditional on the account holding enough,
+which makes a payout reservation one atomic, row-locked statement: two
+concurrent requests cannot both spend the same balance.
+
+A payout request allocates the oldest available earnings that cover it,
+recording each share in PayoutAllocation. An earning only partly needed
+keeps the rest available (VendorEarning.allocatedAmount) and is marked paid
+once fully allocated, so the earning statuses always add up to the ledger.
+Rejection returns exactly the allocated shares in one statement; payouts
+requested before the ledger get their allocations backfilled first.
+
+snapshot_loop() copies every VendorBalance into VendorBalanceSnapshot
+periodically; balance_at() replays entries since the nearest snapshot to
+give the balance at any moment.
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+from database import db
+
+ACCOUNTS = ("pending", "available", "reserved", "paid")
+EXTERNAL = "external"
+
+EARNING_CREDITED = "earning_credited"
+EARNING_RELEASED = "earning_released"
+PAYOUT_RESERVED = "payout_reserved"
+PAYOUT_PAID = "payout_paid"
+PAYOUT_REVERSED = "payout_reversed"
+OPENING_BALANCE = "opening_balance"
+
+# kind -> (from account, to account)
+MOVEMENTS = {
+    EARNING_CREDITED: (EXTERNAL, "pending"),
+    EARNING_RELEASED: ("pending", "available"),
+    PAYOUT_RESERVED: ("available", "reserved"),
+    PAYOUT_PAID: ("reserved", "paid"),
+    PAYOUT_REVERSED: ("reserved", "available"),
+}
+
+LEDGER_SNAPSHOT_INTERVAL_HOURS = float(os.getenv("LEDGER_SNAPSHOT_INTERVAL_HOURS", 24))
+
+# Float amounts: allow for rounding when checking an account covers a move
+EPSILON = 0.005
+
+_SNAPSHOT_SQL = """
+INSERT INTO "VendorBalanceSnapshot" ("id", "storeId", "pending", "available", "reserved", "paid", "takenAt")
+SELECT gen_random_uuid()::text, "storeId", "pending", "available", "reserved", "paid", NOW()
+FROM "VendorBalance"
+"""
+
+
+# $1 earning ids, $2 shares; fails (count mismatch) if a share is no longer free
+_ALLOCATE_SQL = f"""
+UPDATE "VendorEarning" e
+SET "allocatedAmount" = e."allocatedAmount" + a."amount",
+    "status" = CASE WHEN e."allocatedAmount" + a."amount" >= e."vendorAmount" - {EPSILON} THEN 'paid' ELSE e."status" END,
+    "updatedAt" = NOW()
+FROM unnest($1::text[], $2::float8[]) AS a("id", "amount")
+WHERE e."id" = a."id" AND e."status" = 'available'
+  AND e."allocatedAmount" + a."amount" <= e."vendorAmount" + {EPSILON}
+"""
+
+_RELEASE_ALLOCATIONS_SQL = """
+UPDATE "VendorEarning" e
+SET "allocatedAmount" = GREATEST(e."allocatedAmount" - a."amount", 0), "status" = 'available', "updatedAt" = NOW()
+FROM (
+    SELECT "earningId", SUM("amount") AS "amount"
+    FROM "PayoutAllocation"
+    WHERE "payoutId" = ANY($1::text[])
+    GROUP BY "earningId"
+) a
+WHERE e."id" = a."earningId" AND e."status" IN ('available', 'paid')
+"""
+
+# Earnings marked paid by payout requests made before allocations were
+# recorded: whole earnings, newest first (a request took the oldest free ones)
+_LEGACY_PAID_SQL = """
+SELECT "id", "vendorAmount" FROM "VendorEarning"
+WHERE "storeId" = $1 AND "status" = 'paid' AND "allocatedAmount" = 0
+ORDER BY "createdAt" DESC
+"""
+
+
+def _move_sql(source: str, target: str) -> str:
+    if source == EXTERNAL:
+        return f'UPDATE "VendorBalance" SET "{target}" = "{target}" + $2, "updatedAt" = NOW() WHERE "storeId" = $1'
+    return (
+        f'UPDATE "VendorBalance" SET "{source}" = "{source}" - $2, "{target}" = "{target}" + $2, '
+        f'"updatedAt" = NOW() WHERE "storeId" = $1 AND "{source}" >= $2 - {EPSILON}'
+    )
+
+
+_MOVE_SQL = {kind: _move_sql(source, target) for kind, (source, target) in MOVEMENTS.items()}
+
+
+async def ensure_balance(store_id: str):
+    """
+    Create the store's VendorBalance if it has none, opening it from the
+    earnings and payouts recorded before the ledger existed. Call before
+    the transaction that posts to the store.
+    """
+    if await db.vendorbalance.find_unique(where={"storeId": store_id}):
+        return
+
+    earnings, payouts = await asyncio.gather(
+        db.vendorearning.group_by(["status"], where={"storeId": store_id}, sum={"vendorAmount": True}),
+        db.vendorpayout.group_by(["status"], where={"storeId": store_id}, sum={"amount": True}),
+    )
+    earned = {g["status"]: g["_sum"]["vendorAmount"] or 0 for g in earnings}
+    requested = {g["status"]: g["_sum"]["amount"] or 0 for g in payouts}
+    opening = {
+        "pending": earned.get("pending", 0),
+        "available": earned.get("available", 0),
+        "reserved": requested.get("pending", 0),
+        "paid": requested.get("completed", 0),
+    }
+
+    async with db.tx() as transaction:
+        created = await transaction.execute_raw(
+            'INSERT INTO "VendorBalance" ("storeId", "pending", "available", "reserved", "paid", "updatedAt") '
+            'VALUES ($1, $2, $3, $4, $5, NOW()) ON CONFLICT ("storeId") DO NOTHING',
+            store_id, *(opening[account] for account in ACCOUNTS)
+        )
+        opening_entries = [
+            {
+                "storeId": store_id,
+                "kind": OPENING_BALANCE,
+                "fromAccount": EXTERNAL,
+                "toAccount": account,
+                "amount": amount,
+            }
+            for account, amount in opening.items() if amount
+        ]
+        if created and opening_entries:
+            await transaction.vendorledgerentry.create_many(data=opening_entries)
+
+
+async def post(
+    client,
+    store_id: str,
+    kind: str,
+    amount: float,
+    earning_id: Optional[str] = None,
+    payout_id: Optional[str] = None
+) -> bool:
+    """
+    Post one entry with the transaction client. Returns False, posting
+    nothing, if the source account doesn't hold `amount`.
+    """
+    if amount <= 0:
+        return True
+    source, target = MOVEMENTS[kind]
+    moved = await client.execute_raw(_MOVE_SQL[kind], store_id, amount)
+    if not moved:
+        if source == EXTERNAL:
+            raise HTTPException(status_code=500, detail="Vendor balance missing; call ensure_balance() first")
+        return False
+    await client.vendorledgerentry.create(
+        data={
+            "storeId": store_id,
+            "kind": kind,
+            "fromAccount": source,
+            "toAccount": target,
+            "amount": amount,
+            "earningId": earning_id,
+            "payoutId": payout_id,
+        }
+    )
+    return True
+
+
+async def reserve_payout(client, store_id: str, amount: float, payout_id: str):
+    """Move `amount` from available to reserved, or raise 400 if it isn't there."""
+    if not await post(client, store_id, PAYOUT_RESERVED, amount, payout_id=payout_id):
+        balance = await client.vendorbalance.find_unique(where={"storeId": store_id})
+        available = balance.available if balance else 0
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient balance. Available: Rs. {available:,.2f}"
+        )
+
+
+def plan_allocations(earnings, payout_id: str, amount: float) -> List[dict]:
+    """
+    Shares of `earnings` (oldest first) covering `amount`: each earning gives
+    what is still unallocated, the last one only what is needed.
+    """
+    allocations = []
+    remaining = amount
+    for earning in earnings:
+        if remaining <= EPSILON:
+            break
+        share = min(earning.vendorAmount - earning.allocatedAmount, remaining)
+        if share <= EPSILON:
+            continue
+        allocations.append({"payoutId": payout_id, "earningId": earning.id, "amount": share})
+        remaining -= share
+    if remaining > EPSILON:
+        raise HTTPException(
+            status_code=409,
+            detail="Available earnings do not cover the reserved balance; please contact support"
+        )
+    return allocations
+
+
+async def allocate_earnings(client, store_id: str, payout_id: str, amount: float) -> int:
+    """
+    Allocate the oldest available earnings covering `amount` to the payout.
+    Call after reserve_payout() in the same transaction: the balance row lock
+    it takes keeps concurrent requests from picking the same earnings.
+    """
+    earnings = await client.vendorearning.find_many(
+        where={"storeId": store_id, "status": "available"},
+        order={"createdAt": "asc"}
+    )
+    allocations = plan_allocations(earnings, payout_id, amount)
+    if not allocations:
+        return 0
+
+    await client.payoutallocation.create_many(data=allocations)
+    allocated = await client.execute_raw(
+        _ALLOCATE_SQL,
+        [a["earningId"] for a in allocations],
+        [a["amount"] for a in allocations]
+    )
+    if allocated != len(allocations):
+        raise HTTPException(status_code=409, detail="Earnings changed while the payout was being requested; please retry")
+    return allocated
+
+
+async def backfill_allocations(client, payouts) -> int:
+    """
+    Record allocations for payouts requested before the ledger, which marked
+    whole earnings paid without saying which. The newest such earnings are
+    assigned to the payout so that releasing it returns its amount.
+    """
+    allocated_ids = {
+        a.payoutId for a in await client.payoutallocation.find_many(
+            where={"payoutId": {"in": [payout.id for payout in payouts]}}
+        )
+    }
+    backfilled = 0
+    for payout in payouts:
+        if payout.id in allocated_ids:
+            continue
+        earnings = await client.query_raw(_LEGACY_PAID_SQL, payout.storeId)
+        allocations = []
+        remaining = payout.amount
+        for earning in earnings:
+            if remaining <= EPSILON:
+                break
+            share = min(earning["vendorAmount"], remaining)
+            allocations.append({"payoutId": payout.id, "earningId": earning["id"], "amount": share})
+            remaining -= share
+        if not allocations:
+            print(f"[WARNING] No legacy earnings found to release for payout {payout.id}")
+            continue
+        await client.payoutallocation.create_many(data=allocations)
+        # Wholly paid until released, so the release leaves the unused part allocated
+        await client.execute_raw(
+            'UPDATE "VendorEarning" SET "allocatedAmount" = "vendorAmount" WHERE "id" = ANY($1::text[])',
+            [a["earningId"] for a in allocations]
+        )
+        backfilled += 1
+    return backfilled
+
+
+async def release_allocations(client, payout_ids: List[str]) -> int:
+    """Return the shares allocated to these payouts to their earnings, in one statement."""
+    return await client.execute_raw(_RELEASE_ALLOCATIONS_SQL, payout_ids)
+
+
+async def settle_payouts(client, payouts, status: str):
+    """
+    Ledger side of processing payouts (already claimed by the caller):
+    "completed" moves reserved to paid; "rejected"/"failed" returns it to
+    available and releases the allocated earnings. One balance UPDATE per
+    store and one insert for all entries, however many payouts.
+    """
+    if status == "completed":
+        kind = PAYOUT_PAID
+    elif status in ("rejected", "failed"):
+        kind = PAYOUT_REVERSED
+    else:
+        return
+
+    per_store: Dict[str, float] = {}
+    for payout in payouts:
+        per_store[payout.storeId] = per_store.get(payout.storeId, 0) + payout.amount
+    for store_id, amount in per_store.items():
+        if not await client.execute_raw(_MOVE_SQL[kind], store_id, amount):
+            raise HTTPException(status_code=409, detail=f"Reserved balance for store {store_id} does not cover its payouts")
+
+    source, target = MOVEMENTS[kind]
+    await client.vendorledgerentry.create_many(
+        data=[
+            {
+                "storeId": payout.storeId,
+                "kind": kind,
+                "fromAccount": source,
+                "toAccount": target,
+                "amount": payout.amount,
+                "payoutId": payout.id,
+            }
+            for payout in payouts
+        ]
+    )
+    if kind == PAYOUT_REVERSED:
+        await backfill_allocations(client, payouts)
+        await release_allocations(client, [payout.id for payout in payouts])
+
+
+async def release_order_earnings(client, order_id: str) -> int:
+    """
+    Mark the order's pending earnings available and move them in the ledger.
+    Raises 409 if the ledger disagrees, rolling back the caller's transaction;
+    call ensure_balance() for the order's stores first.
+    """
+    earnings = await client.vendorearning.find_many(where={"orderId": order_id, "status": "pending"})
+    if not earnings:
+        return 0
+    released = await client.vendorearning.update_many(
+        where={"id": {"in": [e.id for e in earnings]}, "status": "pending"},
+        data={"status": "available"}
+    )
+    if released != len(earnings):
+        raise HTTPException(status_code=409, detail="Order earnings changed concurrently; please retry")
+    for earning in earnings:
+        if not await post(client, earning.storeId, EARNING_RELEASED, earning.vendorAmount, earning_id=earning.id):
+            print(f"[WARNING] Pending balance of store {earning.storeId} does not cover earning {earning.id}")
+            raise HTTPException(
+                status_code=409,
+                detail=f"Vendor balance for store {earning.storeId} does not match its earnings"
+            )
+    return len(earnings)
+
+
+async def get_balance(store_id: str) -> Dict[str, float]:
+    await ensure_balance(store_id)
+    balance = await db.vendorbalance.find_unique(where={"storeId": store_id})
+    return {account: getattr(balance, account) for account in ACCOUNTS}
+
+
+async def balance_at(store_id: str, moment: datetime) -> Dict[str, float]:
+    """The store's balance at `moment`: nearest earlier snapshot plus later entries."""
+    snapshot = await db.vendorbalancesnapshot.find_first(
+        where={"storeId": store_id, "takenAt": {"lte": moment}},
+        order={"takenAt": "desc"}
+    )
+    balance = {account: getattr(snapshot, account) if snapshot else 0.0 for account in ACCOUNTS}
+
+    where = {"storeId": store_id, "createdAt": {"lte": moment}}
+    if snapshot:
+        where["createdAt"]["gt"] = snapshot.takenAt
+    entries = await db.vendorledgerentry.find_many(where=where)
+    for entry in entries:
+        if entry.fromAccount != EXTERNAL:
+            balance[entry.fromAccount] -= entry.amount
+        if entry.toAccount != EXTERNAL:
+            balance[entry.toAccount] += entry.amount
+    return balance
+
+
+async def snapshot_loop():
+    """Background task: snapshot every store balance every LEDGER_SNAPSHOT_INTERVAL_HOURS."""
+    while True:
+        await asyncio.sleep(LEDGER_SNAPSHOT_INTERVAL_HOURS * 3600)
+        try:
+            await db.execute_raw(_SNAPSHOT_SQL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARNING] Vendor balance snapshot failed: {e}")
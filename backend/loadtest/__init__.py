@@ -0,0 +1,12 @@
+"""
+Load-test scenarios that run in-process against the ASGI app.
+
+Requests go through httpx's ASGITransport straight into main.app, so no
+server is needed - only the database in DATABASE_URL (use a local Postgres,
+never production). Scenarios seed their own data and delete it afterwards.
+
+Run from the backend directory, e.g.:
+
+    pip install httpx
+    python -m loadtest.flash_sale --products 20 --stock 50 --clients 2000
+"""
@@ -0,0 +1,304 @@
+"""
+Flash sale launch: thousands of clients arriving at the exact start time.
+
+Seeds a vendor, a category, N products and a flash sale that starts a few
+seconds after the app has started, plus a pool of customers (fewer than
+clients, so some customers order more than once and hit the per-customer
+limit). At the start time every client loads the active sale, checks one
+product's flash price and places an order for it, signed in as its customer.
+
+The report covers latency and errors per endpoint, database round trips
+per checkout, and the invariants a launch must keep: no product sold past
+its stock, no customer past maxQuantity, and soldCount equal to the units
+actually ordered.
+
+    python -m loadtest.flash_sale --products 20 --stock 50 --clients 2000
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+try:
+    import httpx
+except ImportError:  # Dev-only dependency
+    httpx = None
+
+import auth
+from database import db, get_db_connection
+from flash_sale_quota import sold_counts
+import flash_sales
+import rollups
+from loadtest.metrics import (
+    Recorder,
+    counting_round_trips,
+    install_round_trip_counter,
+    uninstall_round_trip_counter,
+)
+
+
+class Scenario:
+    def __init__(self, products: int, stock: int, clients: int, customers: int,
+                 max_quantity: int, lead_seconds: float, spread_seconds: float):
+        self.run_id = uuid.uuid4().hex[:8]
+        self.product_count = products
+        self.stock = stock
+        self.client_count = clients
+        self.customer_count = min(customers, clients)
+        self.max_quantity = max_quantity
+        self.lead_seconds = lead_seconds
+        self.spread_seconds = spread_seconds
+
+        self.vendor = None
+        self.store = None
+        self.category = None
+        self.sale = None
+        self.products: List = []
+        self.customers: List = []
+        self.tokens: Dict[str, str] = {}
+        self.start_time: datetime = None
+
+    # ------------------------------------------------------------------
+    # Seed / cleanup
+    # ------------------------------------------------------------------
+
+    def _email(self, name: str) -> str:
+        return f"loadtest-{self.run_id}-{name}@example.com"
+
+    async def seed(self):
+        # One hash for everyone: bcrypt per user would dominate seeding
+        password = auth.get_password_hash(uuid.uuid4().hex)
+
+        self.vendor = await db.user.create(
+            data={"email": self._email("vendor"), "name": "Load Test Vendor", "password": password, "role": "vendor"}
+        )
+        self.store = await db.store.create(
+            data={"name": f"Load Test Store {self.run_id}", "vendorId": self.vendor.id}
+        )
+        self.category = await db.category.create(
+            data={"name": f"Load Test {self.run_id}", "slug": f"load-test-{self.run_id}"}
+        )
+
+        await db.user.create_many(
+            data=[
+                {"email": self._email(f"c{i}"), "name": f"Customer {i}", "password": password}
+                for i in range(self.customer_count)
+            ]
+        )
+        self.customers = await db.user.find_many(
+            where={"email": {"startswith": f"loadtest-{self.run_id}-c"}}
+        )
+        self.tokens = {
+            customer.id: auth.create_access_token({"sub": customer.email}, timedelta(hours=1))
+            for customer in self.customers
+        }
+
+        await db.product.create_many(
+            data=[
+                {
+                    "name": f"Load Test Product {i}",
+                    "description": "Seeded by loadtest.flash_sale",
+                    "price": 100.0,
+                    "stock": self.stock,
+                    "images": [],
+                    "categoryId": self.category.id,
+                    "storeId": self.store.id,
+                }
+                for i in range(self.product_count)
+            ]
+        )
+        self.products = await db.product.find_many(where={"storeId": self.store.id})
+
+        self.start_time = datetime.now(timezone.utc) + timedelta(seconds=self.lead_seconds)
+        self.sale = await db.flashsale.create(
+            data={
+                "name": f"Load Test Sale {self.run_id}",
+                "startTime": self.start_time,
+                "endTime": self.start_time + timedelta(hours=1),
+                "isActive": True,
+                "products": {
+                    "create": [
+                        {
+                            "productId": product.id,
+                            "salePrice": 50.0,
+                            "discountPercent": 50,
+                            "maxQuantity": self.max_quantity,
+                        }
+                        for product in self.products
+                    ]
+                },
+            }
+        )
+
+    async def cleanup(self):
+        product_ids = [product.id for product in self.products]
+        customer_ids = [customer.id for customer in self.customers]
+        orders = await db.order.find_many(where={"userId": {"in": customer_ids}})
+        order_ids = [order.id for order in orders]
+        await db.outboxevent.delete_many(where={"aggregateId": {"in": order_ids}})
+        await db.ordertrackingprojection.delete_many(where={"orderId": {"in": order_ids}})
+        await db.orderstatushistory.delete_many(where={"orderId": {"in": order_ids}})
+        await db.orderitem.delete_many(where={"productId": {"in": product_ids}})
+        await db.order.delete_many(where={"id": {"in": order_ids}})
+        if self.sale:
+            await db.flashsale.delete(where={"id": self.sale.id})  # Cascades to products and tallies
+        await db.product.delete_many(where={"storeId": self.store.id})
+        await db.store.delete(where={"id": self.store.id})
+        await db.category.delete(where={"id": self.category.id})
+        await db.user.delete_many(where={"id": {"in": customer_ids + [self.vendor.id]}})
+
+        # Rollups exist only once a refresh has run; rebuild the days this
+        # run's orders may have been counted in
+        if orders and await rollups.get_watermark() is not None:
+            await rollups.mark_stale(db, [order.createdAt for order in orders])
+            await rollups.refresh()
+
+    # ------------------------------------------------------------------
+    # Load
+    # ------------------------------------------------------------------
+
+    async def _timed(self, client, recorder: Recorder, endpoint: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        with counting_round_trips() as trips:
+            try:
+                response = await client.request(method, url, **kwargs)
+                status = response.status_code
+            except Exception:
+                status = 0
+        recorder.record(endpoint, status, (time.perf_counter() - started) * 1000, trips[0])
+        return status
+
+    async def _client(self, client, recorder: Recorder, index: int, start_at: float):
+        customer = self.customers[index % len(self.customers)]
+        product = random.choice(self.products)
+        headers = {"Authorization": f"Bearer {self.tokens[customer.id]}"}
+
+        delay = start_at - time.monotonic() + random.uniform(0, self.spread_seconds)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        await self._timed(client, recorder, "GET /flash-sales/active", "GET",
+                          "/api/v1/flash-sales/active", headers=headers)
+        await self._timed(client, recorder, "GET /products/{id}/flash-price", "GET",
+                          f"/api/v1/products/{product.id}/flash-price", headers=headers)
+        await self._timed(client, recorder, "POST /orders", "POST", "/api/v1/orders", headers=headers, json={
+            "userId": customer.id,
+            "items": [{"productId": product.id, "quantity": 1}],
+        })
+
+    async def run(self, app) -> Recorder:
+        recorder = Recorder()
+        start_at = time.monotonic() + (self.start_time - datetime.now(timezone.utc)).total_seconds()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+            await asyncio.gather(*(
+                self._client(client, recorder, index, start_at) for index in range(self.client_count)
+            ))
+        return recorder
+
+    # ------------------------------------------------------------------
+    # Invariants
+    # ------------------------------------------------------------------
+
+    async def verify(self) -> List[str]:
+        await sold_counts.flush()
+
+        product_ids = [product.id for product in self.products]
+        items, products, flash_products, tallies = await asyncio.gather(
+            db.orderitem.find_many(where={"productId": {"in": product_ids}}, include={"order": True}),
+            db.product.find_many(where={"id": {"in": product_ids}}),
+            db.flashsaleproduct.find_many(where={"flashSaleId": self.sale.id}),
+            db.flashsalecustomertally.find_many(
+                where={"flashSaleProduct": {"is": {"flashSaleId": self.sale.id}}}
+            ),
+        )
+
+        ordered: Dict[str, int] = {}
+        per_customer: Dict[tuple, int] = {}
+        for item in items:
+            ordered[item.productId] = ordered.get(item.productId, 0) + item.quantity
+            key = (item.order.userId, item.productId)
+            per_customer[key] = per_customer.get(key, 0) + item.quantity
+
+        oversold = sum(max(0, units - self.stock) for units in ordered.values())
+        negative_stock = sum(1 for product in products if product.stock < 0)
+        stock_mismatch = sum(1 for product in products if product.stock != self.stock - ordered.get(product.id, 0))
+        over_limit = sum(1 for units in per_customer.values() if units > self.max_quantity)
+        sold_mismatch = sum(1 for fp in flash_products if fp.soldCount != ordered.get(fp.productId, 0))
+        product_of = {fp.id: fp.productId for fp in flash_products}
+        tally_mismatch = sum(
+            1 for tally in tallies
+            if tally.quantity != per_customer.get((tally.userId, product_of[tally.flashSaleProductId]), 0)
+        )
+
+        return [
+            f"units ordered:            {sum(ordered.values())} of {self.stock * self.product_count} in stock",
+            f"oversold units:           {oversold}",
+            f"products with stock < 0:  {negative_stock}",
+            f"stock != seed - ordered:  {stock_mismatch}",
+            f"customers over limit:     {over_limit}",
+            f"soldCount mismatches:     {sold_mismatch}",
+            f"tally mismatches:         {tally_mismatch}",
+        ]
+
+
+async def main(args):
+    if httpx is None:
+        raise SystemExit("httpx is required: pip install httpx")
+
+    import main as app_module
+
+    await get_db_connection()
+    scenario = Scenario(
+        products=args.products,
+        stock=args.stock,
+        clients=args.clients,
+        customers=args.customers,
+        max_quantity=args.max_quantity,
+        lead_seconds=args.lead,
+        spread_seconds=args.spread,
+    )
+    print(f"Seeding run {scenario.run_id}: {args.products} products x {args.stock} stock, "
+          f"{scenario.customer_count} customers, {args.clients} clients")
+    await scenario.seed()
+
+    # Lifespan events do not run under ASGITransport. Start only what the
+    # checkout path needs - not the archive, rollup or reconcile loops,
+    # which would work on the whole database
+    await flash_sales.scheduler.start()
+    sold_counts.start()
+    install_round_trip_counter()
+    try:
+        recorder = await scenario.run(app_module.app)
+        print()
+        print(recorder.report())
+        print()
+        for line in await scenario.verify():
+            print(line)
+    finally:
+        uninstall_round_trip_counter()
+        await flash_sales.scheduler.stop()
+        await sold_counts.stop()
+        if not args.keep:
+            await scenario.cleanup()
+        await db.disconnect()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--stock", type=int, default=50, help="Units of stock per product")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--customers", type=int, default=500, help="Distinct customers the clients share")
+    parser.add_argument("--max-quantity", type=int, default=2, help="Per-customer flash sale limit")
+    parser.add_argument("--lead", type=float, default=5.0, help="Seconds between app start and sale start")
+    parser.add_argument("--spread", type=float, default=0.2, help="Arrivals are spread over this many seconds")
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded data for inspection")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
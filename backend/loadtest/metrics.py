@@ -0,0 +1,101 @@
+"""
+Latency, error and database round-trip accounting for load tests.
+"""
+import contextvars
+import statistics
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from prisma import Prisma
+
+# Round-trip counter for the request currently being made. httpx's
+# ASGITransport runs the app in the caller's task, so a value set around
+# a request is visible to every query that request makes.
+_round_trips: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("round_trips", default=None)
+
+_original_execute = None
+
+
+def install_round_trip_counter():
+    """
+    Count every Prisma query, including raw SQL and queries made inside
+    transactions. Transaction begin/commit are engine calls and are not
+    counted; add two per transaction when comparing with database logs.
+    """
+    global _original_execute
+    if _original_execute is not None:
+        return
+    _original_execute = Prisma._execute
+
+    async def _counting_execute(self, *args, **kwargs):
+        counter = _round_trips.get()
+        if counter is not None:
+            counter[0] += 1
+        return await _original_execute(self, *args, **kwargs)
+
+    Prisma._execute = _counting_execute
+
+
+def uninstall_round_trip_counter():
+    global _original_execute
+    if _original_execute is not None:
+        Prisma._execute = _original_execute
+        _original_execute = None
+
+
+class counting_round_trips:
+    """Context manager: `with counting_round_trips() as trips: ...; trips[0]`."""
+
+    def __enter__(self) -> List[int]:
+        self._counter = [0]
+        self._token = _round_trips.set(self._counter)
+        return self._counter
+
+    def __exit__(self, *exc):
+        _round_trips.reset(self._token)
+        return False
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)  # endpoint -> ms
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.round_trips: Dict[str, List[int]] = defaultdict(list)
+
+    def record(self, endpoint: str, status: int, elapsed_ms: float, round_trips: Optional[int] = None):
+        self.latencies[endpoint].append(elapsed_ms)
+        self.statuses[endpoint][status] += 1
+        if round_trips is not None:
+            self.round_trips[endpoint].append(round_trips)
+
+    def report(self) -> str:
+        lines = [
+            f"{'endpoint':<28}{'requests':>9}{'errors':>8}{'err %':>7}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'db/req':>8}"
+        ]
+        for endpoint, latencies in self.latencies.items():
+            statuses = self.statuses[endpoint]
+            total = sum(statuses.values())
+            # 4xx from business rules (sold out, limit reached) are expected
+            # outcomes, not errors; they are broken down below
+            errors = sum(count for status, count in statuses.items() if status >= 500 or status == 0)
+            trips = self.round_trips.get(endpoint)
+            lines.append(
+                f"{endpoint:<28}{total:>9}{errors:>8}{100 * errors / total:>6.1f}%"
+                f"{percentile(latencies, 50):>9.1f}{percentile(latencies, 95):>9.1f}"
+                f"{percentile(latencies, 99):>9.1f}{max(latencies):>9.1f}"
+                f"{statistics.mean(trips) if trips else 0:>8.1f}"
+            )
+        lines.append("")
+        for endpoint, statuses in self.statuses.items():
+            breakdown = ", ".join(f"{status or 'exception'}: {count}" for status, count in sorted(statuses.items()))
+            lines.append(f"{endpoint}: {breakdown}")
+        return "\n".join(lines)
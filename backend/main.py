@@ -1,16 +1,40 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Response, Request
+from fastapi import FastAPI, Depends, HTTPException, status, Response, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from prisma import Prisma
-from datetime import datetime, timedelta
+from prisma.errors import UniqueViolationError, ForeignKeyViolationError
+from datetime import datetime, timedelta, timezone
 import auth
 import schemas
 import os
+import asyncio
 import traceback
 from typing import List, Optional
 from database import db, get_db_connection
 import dependencies
 from dependencies import get_current_user
+import order_events
+import outbox
+import archive
+import tracking
+import pricing
+import ratings
+import reviews
+import review_votes
+from review_votes import vote_buffer
+import purchases
+import ledger
+import commissions
+import exports
+import vendor_reports
+import rollups
+import admin_stats
+import flash_sales
+from flash_sales import calculate_time_remaining, is_flash_sale_active
+import flash_sale_quota
+from flash_sale_quota import sold_counts
+from pubsub import broker
 
 # ============================================================================
 # Environment Configuration
@@ -95,6 +119,9 @@ async def log_requests(request: Request, call_next):
 # Database connection - use a singleton pattern
 # Database connection imported from database.py
 
+# Long-running background tasks, cancelled on shutdown
+background_tasks: List[asyncio.Task] = []
+
 @app.on_event("startup")
 async def startup():
     """Startup event - connect to database and ensure super admin exists"""
@@ -136,9 +163,56 @@ async def startup():
         # Don't fail startup if super admin check fails
         # The database might not be ready yet
 
+    # Cross-worker fan-out for order status events, flash sale and commission changes,
+    # admin dashboard stats and verified purchases (no-op without asyncpg)
+    await broker.start(channels=[
+        order_events.CHANNEL, flash_sales.CHANNEL, commissions.CHANNEL, admin_stats.CHANNEL, purchases.CHANNEL
+    ])
+
+    # In-memory flash sale schedule
+    await flash_sales.scheduler.start()
+
+    # Drain post-payment side effects in the background
+    outbox.worker.start()
+
+    # Periodically move old finished orders to the archive tables
+    if archive.ORDER_ARCHIVE_AFTER_DAYS > 0:
+        background_tasks.append(asyncio.create_task(archive.archive_loop()))
+
+    # Keep the daily sales rollups current (the first run backfills history)
+    background_tasks.append(asyncio.create_task(rollups.rollup_loop()))
+
+    # Periodic vendor balance snapshots
+    background_tasks.append(asyncio.create_task(ledger.snapshot_loop()))
+
+    # Repair any drift in the incremental product rating counters
+    background_tasks.append(asyncio.create_task(ratings.reconcile_loop()))
+
+    # Write buffered helpful-vote counts, and repair any a crash left unflushed
+    vote_buffer.start()
+    background_tasks.append(asyncio.create_task(review_votes.reconcile_loop()))
+
+    # Flash sale soldCount: repair anything a crash left unflushed, then
+    # keep it in step with the customer tallies
+    try:
+        await flash_sale_quota.reconcile_sold_counts()
+    except Exception as e:
+        print(f"[WARNING] Could not reconcile flash sale soldCount: {e}")
+    sold_counts.start()
+
 @app.on_event("shutdown")
 async def shutdown():
     """Shutdown event - disconnect from database"""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+    await flash_sales.scheduler.stop()
+    await vote_buffer.stop()
+    await sold_counts.stop()
+    await outbox.worker.stop()
+    await broker.stop()
     if db.is_connected():
         await db.disconnect()
 
@@ -187,6 +261,7 @@ async def register(user: schemas.UserCreate):
             "role": user.role
         }
     )
+    await admin_stats.notify_changed()
     return new_user
 
 @app.post("/login", response_model=schemas.Token)
@@ -520,7 +595,9 @@ async def search(
 
 @app.post("/api/v1/products", response_model=schemas.ProductOut)
 async def create_product(product: schemas.ProductCreate, current_user: schemas.UserOut = Depends(dependencies.require_vendor)):
-    return await db.product.create(data=product.dict())
+    new_product = await db.product.create(data=product.dict())
+    await admin_stats.notify_changed()
+    return new_product
 
 @app.get("/api/v1/products", response_model=List[schemas.ProductOut])
 async def get_products(
@@ -641,65 +718,93 @@ async def get_product(product_id: str, response: Response):
 @app.patch("/api/v1/products/{product_id}", response_model=schemas.ProductOut)
 async def update_product(product_id: str, product_data: schemas.ProductUpdate, current_user: schemas.UserOut = Depends(dependencies.require_vendor)):
     update_data = product_data.dict(exclude_unset=True)
-    return await db.product.update(where={"id": product_id}, data=update_data)
+    product = await db.product.update(where={"id": product_id}, data=update_data)
+    pricing.invalidate([product_id])
+    return product
 
 @app.delete("/api/v1/products/{product_id}")
 async def delete_product(product_id: str, current_user: schemas.UserOut = Depends(dependencies.require_vendor)):
     await db.product.delete(where={"id": product_id})
+    await admin_stats.notify_changed()
     return {"message": "Product deleted successfully"}
 
 
 # Order Endpoints
+@app.post("/api/v1/checkout/quote", response_model=schemas.QuoteOut)
+async def get_checkout_quote(quote_request: schemas.QuoteRequest):
+    """
+    Price a cart with the same engine create_order() uses:
+    base or flash sale prices, stock and flash sale limits, and the total.
+    """
+    return await pricing.quote_items(quote_request.items)
+
 @app.post("/api/v1/orders", response_model=schemas.OrderOut)
-async def create_order(order_data: schemas.OrderCreate):
+async def create_order(
+    order_data: schemas.OrderCreate,
+    current_user: Optional[schemas.UserOut] = Depends(dependencies.get_optional_user)
+):
     # Use a transaction to ensure data integrity
     try:
-        # 1. Validate stock and items
-        total_calculated = 0
-        update_tasks = []
-        
-        for item in order_data.items:
-            product = await db.product.find_unique(where={"id": item.productId})
-            if not product:
-                raise HTTPException(status_code=404, detail=f"Product {item.productId} not found")
-            if product.stock < item.quantity:
-                raise HTTPException(status_code=400, detail=f"Insufficient stock for {product.name}")
-            
-            total_calculated += product.price * item.quantity
-            # Preparation for decrementing stock
-            update_tasks.append(
-                db.product.update(
-                    where={"id": item.productId},
-                    data={"stock": {"decrement": item.quantity}}
+        # 1. Price every line server-side; client prices and totals are ignored
+        quote = await pricing.quote_items(order_data.items)
+
+        # Flash sale limits are per customer, so the customer must be signed in
+        # as the user the order is for
+        if any(line["flashSaleProductId"] for line in quote["items"]):
+            if current_user is None:
+                raise HTTPException(status_code=401, detail="Sign in to buy flash sale items")
+            if current_user.id != order_data.userId:
+                raise HTTPException(status_code=403, detail="Orders with flash sale items must be for the signed-in user")
+
+        async with db.tx() as transaction:
+            # 2. Reserve stock; the conditional decrement fails if another
+            # order took the last units since the quote was computed
+            for line in quote["items"]:
+                reserved = await transaction.product.update_many(
+                    where={"id": line["productId"], "stock": {"gte": line["quantity"]}},
+                    data={"stock": {"decrement": line["quantity"]}}
                 )
+                if not reserved:
+                    raise HTTPException(status_code=400, detail=f"Insufficient stock for {line['name']}")
+                # Per-customer flash sale limit, counted across all of the customer's orders
+                if line["flashSaleProductId"]:
+                    await flash_sale_quota.claim_customer_quota(transaction, line, current_user.id)
+
+            # 3. Save Order and Items
+            order = await transaction.order.create(
+                data={
+                    "userId": order_data.userId,
+                    "totalAmount": quote["total"],
+                    "status": order_data.status or "pending",
+                    "paymentStatus": order_data.paymentStatus or "pending",
+                    "paymentProvider": order_data.paymentProvider,
+                    "paymentReference": order_data.paymentReference,
+                    "shippingAddress": order_data.shippingAddress,
+                    "billingAddress": order_data.billingAddress,
+                    "notes": order_data.notes,
+                    "items": {
+                        "create": [
+                            {
+                                "productId": line["productId"],
+                                "quantity": line["quantity"],
+                                "price": line["unitPrice"],
+                                "flashSaleProductId": line["flashSaleProductId"]
+                            }
+                            for line in quote["items"]
+                        ]
+                    }
+                },
+                include={"items": True}
             )
 
-        # 2. Save Order and Items
-        order = await db.order.create(
-            data={
-                "userId": order_data.userId,
-                "totalAmount": order_data.totalAmount, # Could also use total_calculated
-                "status": order_data.status or "pending",
-                "paymentStatus": order_data.paymentStatus or "pending",
-                "paymentProvider": order_data.paymentProvider,
-                "paymentReference": order_data.paymentReference,
-                "items": {
-                    "create": [
-                        {
-                            "productId": item.productId,
-                            "quantity": item.quantity,
-                            "price": item.price
-                        }
-                        for item in order_data.items
-                    ]
-                }
-            },
-            include={"items": True}
-        )
+        # Cached quotes for these products carry the old stock
+        pricing.invalidate(line["productId"] for line in quote["items"])
+        for line in quote["items"]:
+            if line["flashSaleProductId"]:
+                sold_counts.record(line["flashSaleProductId"], line["quantity"])
 
-        # 3. Execute inventory updates
-        for task in update_tasks:
-            await task
+        # Dashboard counters and recent orders, on every worker
+        await admin_stats.notify_changed(order=admin_stats.order_summary(order))
 
         return order
     except Exception as e:
@@ -725,30 +830,63 @@ async def get_order(order_id: str):
         where={"id": order_id},
         include={"items": True}
     )
+    if not order:
+        # Old finished orders live in the archive tables
+        order = await archive.find_archived_order(order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     return order
 
 @app.get("/api/v1/vendor/orders", response_model=List[schemas.OrderOut])
-async def get_vendor_orders(current_user: schemas.UserOut = Depends(get_current_user)):
+async def get_vendor_orders(
+    current_user: schemas.UserOut = Depends(get_current_user),
+    limit: int = 50,
+    skip: int = 0,
+    include_archived: bool = False
+):
+    """
+    Orders containing the vendor's products, newest first, one page at a time.
+    Archived orders follow the hot ones only when include_archived is set.
+    """
     store = await db.store.find_first(where={"vendorId": current_user.id})
     if not store:
         return []
+    limit = max(1, min(limit, 100))
     
-    # Get all orders that have items from this store
-    orders = await db.order.find_many(
-        where={
-            "items": {
-                "some": {
-                    "product": {
-                        "storeId": store.id
-                    }
+    # Get orders that have items from this store
+    where_clause = {
+        "items": {
+            "some": {
+                "product": {
+                    "storeId": store.id
                 }
             }
-        },
+        }
+    }
+    orders = await db.order.find_many(
+        where=where_clause,
         include={"items": True},
-        order={"createdAt": "desc"}
+        order={"createdAt": "desc"},
+        take=limit,
+        skip=skip
     )
+
+    # Archived orders are older than anything still hot, so they simply
+    # follow on. Archived items have no product relation, so match them on
+    # the store's product ids.
+    if include_archived and len(orders) < limit:
+        if orders:
+            hot_total = skip + len(orders)
+        else:
+            hot_total = await db.order.count(where=where_clause)
+        product_ids = [p.id for p in await db.product.find_many(where={"storeId": store.id})]
+        if product_ids:
+            archived = await archive.find_archived_orders(
+                where={"items": {"some": {"productId": {"in": product_ids}}}},
+                take=limit - len(orders),
+                skip=max(0, skip - hot_total)
+            )
+            orders = list(orders) + list(archived)
     return orders
 
 @app.patch("/api/v1/orders/{order_id}/status", response_model=schemas.OrderOut)
@@ -800,44 +938,60 @@ async def update_order_status(
     if status_update.estimatedDelivery:
         update_data["estimatedDelivery"] = status_update.estimatedDelivery
 
-    # Update order
-    updated_order = await db.order.update(
-        where={"id": order_id},
-        data=update_data,
-        include={"items": {"include": {"product": {"include": {"store": True}}}}}
-    )
+    # Stores that predate the ledger need their opening balance before a release
+    if status_update.status == "delivered":
+        await asyncio.gather(*(
+            ledger.ensure_balance(store_id) for store_id in {item.product.storeId for item in order.items}
+        ))
 
-    # Create status history entry
-    await db.orderstatushistory.create(
-        data={
-            "orderId": order_id,
-            "status": status_update.status,
-            "changedBy": current_user.id,
-            "notes": status_update.notes
-        }
-    )
+    # Status change, history entry and outbox event commit together
+    released_quota = []
+    async with db.tx() as transaction:
+        updated_order = await transaction.order.update(
+            where={"id": order_id},
+            data=update_data,
+            include={"items": {"include": {"product": {"include": {"store": True}}}}}
+        )
 
-    # Create vendor earnings when order is marked as paid
-    if status_update.status == "paid":
-        # Group items by store and create earnings for each store
-        store_earnings = {}
-        for item in updated_order.items:
-            store_id = item.product.storeId
-            if store_id not in store_earnings:
-                store_earnings[store_id] = 0
-            store_earnings[store_id] += item.price * item.quantity
-
-        # Create earning records for each store
-        for store_id, amount in store_earnings.items():
-            await create_vendor_earning(order_id, amount, store_id)
-
-    # Update vendor earnings status to "available" when order is delivered
-    elif status_update.status == "delivered":
-        await db.vendorearning.update_many(
-            where={"orderId": order_id},
-            data={"status": "available"}
+        await transaction.orderstatushistory.create(
+            data={
+                "orderId": order_id,
+                "status": status_update.status,
+                "changedBy": current_user.id,
+                "notes": status_update.notes
+            }
         )
 
+        # Vendor earnings are created by the outbox worker, off the request path
+        if status_update.status == "paid":
+            # Commission rules are evaluated as of the payment, not when the handler runs
+            await outbox.enqueue(
+                transaction, "order.paid", order_id,
+                {"paidAt": datetime.now(timezone.utc).isoformat()}
+            )
+
+        # Vendor earnings become available when the order is delivered
+        elif status_update.status == "delivered":
+            await ledger.release_order_earnings(transaction, order_id)
+
+        # A cancelled order no longer counts against flash sale limits
+        elif status_update.status == "cancelled" and order.status != "cancelled":
+            released_quota = await flash_sale_quota.release_customer_quota(transaction, order_id, order.userId)
+
+        tracking_entry = await tracking.refresh_projection(updated_order, transaction)
+
+    # The event is only visible to the workers once committed
+    if status_update.status == "paid":
+        outbox.worker.wake()
+    for row in released_quota:
+        sold_counts.record(row["flashSaleProductId"], -row["quantity"])
+
+    # Verified-purchase results for this customer may have changed
+    await purchases.notify_changed(updated_order.userId)
+
+    tracking.remember(tracking_entry)
+    await order_events.publish_order_status(updated_order)
+
     return updated_order
 
 
@@ -848,58 +1002,73 @@ async def update_order_status(
 @app.get("/api/v1/orders/{order_id}/tracking", response_model=schemas.OrderTrackingOut)
 async def get_order_tracking(
     order_id: str,
+    request: Request,
     current_user: schemas.UserOut = Depends(get_current_user)
 ):
     """
     Get detailed order tracking information including status history.
     Accessible by the order owner, admin, and relevant vendors.
+    Served from the precomputed tracking projection; supports If-None-Match.
     """
-    # Get order with full details
-    order = await db.order.find_unique(
-        where={"id": order_id},
-        include={"items": {"include": {"product": {"include": {"store": True}}}}}
-    )
+    entry = await tracking.get_tracking(order_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    # Check permissions against the cached owner/store set
+    is_owner = entry.userId == current_user.id
+    is_admin = current_user.role == "admin"
+
+    is_vendor = False
+    if current_user.role == "vendor":
+        store_id = await tracking.vendor_store_id(current_user.id)
+        is_vendor = store_id is not None and store_id in entry.storeIds
+
+    if not (is_owner or is_admin or is_vendor):
+        raise HTTPException(status_code=403, detail="You don't have permission to view this order")
+
+    headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+    if tracking.etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/v1/orders/{order_id}/events")
+async def stream_order_events(
+    order_id: str,
+    request: Request,
+    current_user: schemas.UserOut = Depends(dependencies.get_current_user_for_stream)
+):
+    """
+    Server-Sent Events stream of status changes for an order.
+    Sends the current status once, then pushes every change as it happens.
+    """
+    order = await db.order.find_unique(where={"id": order_id})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    # Check permissions
+    # Same access rules as the tracking endpoint
     is_owner = order.userId == current_user.id
     is_admin = current_user.role == "admin"
 
-    # Check if vendor (has products in this order)
     is_vendor = False
     if current_user.role == "vendor":
         store = await db.store.find_first(where={"vendorId": current_user.id})
         if store:
-            is_vendor = any(item.product.storeId == store.id for item in order.items)
+            is_vendor = await db.orderitem.count(
+                where={"orderId": order_id, "product": {"storeId": store.id}}
+            ) > 0
 
     if not (is_owner or is_admin or is_vendor):
         raise HTTPException(status_code=403, detail="You don't have permission to view this order")
 
-    # Get status history
-    status_history = await db.orderstatushistory.find_many(
-        where={"orderId": order_id},
-        order={"createdAt": "desc"}
-    )
-
-    # Calculate current step based on status
-    status_steps = {
-        "pending": 0,
-        "paid": 1,
-        "processing": 2,
-        "shipped": 3,
-        "delivered": 4,
-        "cancelled": -1  # Special case
-    }
-    current_step = status_steps.get(order.status, 0)
-
-    return schemas.OrderTrackingOut(
-        order=order,
-        statusHistory=status_history,
-        currentStep=current_step,
-        estimatedDelivery=order.estimatedDelivery,
-        trackingNumber=order.trackingNumber,
-        shippingCarrier=order.shippingCarrier
+    return StreamingResponse(
+        order_events.stream_order_events(request, order),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Disable proxy buffering (nginx)
+        }
     )
 
 
@@ -911,6 +1080,10 @@ async def get_order_status_history(
     """Get status history for an order."""
     # Verify order exists and user has access
     order = await db.order.find_unique(where={"id": order_id})
+    is_archived = False
+    if not order:
+        order = await db.orderarchive.find_unique(where={"id": order_id})
+        is_archived = order is not None
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
@@ -921,6 +1094,9 @@ async def get_order_status_history(
     if not (is_owner or is_admin):
         raise HTTPException(status_code=403, detail="You don't have permission to view this order's history")
 
+    if is_archived:
+        return await archive.find_archived_history(order_id)
+
     # Get status history
     history = await db.orderstatushistory.find_many(
         where={"orderId": order_id},
@@ -954,6 +1130,20 @@ async def get_user_orders(
         skip=skip
     )
 
+    # Continue into the archive once the hot table runs out. Archived orders
+    # are older than anything still hot, so they simply follow on.
+    if len(orders) < limit:
+        if orders:
+            hot_total = skip + len(orders)
+        else:
+            hot_total = await db.order.count(where=where_clause)
+        archived = await archive.find_archived_orders(
+            where=where_clause,
+            take=limit - len(orders),
+            skip=max(0, skip - hot_total)
+        )
+        orders = list(orders) + list(archived)
+
     return orders
 
 
@@ -1009,53 +1199,51 @@ async def mark_order_paid(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    updated_order = await db.order.update(
-        where={"id": order_id},
-        data={
-            "paymentStatus": "paid",
-            "paymentProvider": payment_data.paymentProvider,
-            "paymentReference": payment_data.paymentReference,
-            # If the payment was successful, we might want to update the main status too? 
-            # The prompt doesn't say so, but it's often implied. 
-            # However, "processing" or "shipped" usually comes later. 
-            # I'll stick to just paymentStatus for now unless logic dictates otherwise.
-        },
-        include={"items": True}
-    )
+    async with db.tx() as transaction:
+        updated_order = await transaction.order.update(
+            where={"id": order_id},
+            data={
+                "paymentStatus": "paid",
+                "paymentProvider": payment_data.paymentProvider,
+                "paymentReference": payment_data.paymentReference,
+                # If the payment was successful, we might want to update the main status too? 
+                # The prompt doesn't say so, but it's often implied. 
+                # However, "processing" or "shipped" usually comes later. 
+                # I'll stick to just paymentStatus for now unless logic dictates otherwise.
+            },
+            include={"items": {"include": {"product": True}}}
+        )
+
+        tracking_entry = await tracking.refresh_projection(updated_order, transaction)
+
+    tracking.remember(tracking_entry)
+    await order_events.publish_order_status(updated_order)
+    if order.paymentStatus != "paid":
+        await admin_stats.notify_changed()
+
     return updated_order
 
 @app.get("/api/v1/admin/overview", response_model=schemas.AdminOverview)
 async def get_admin_overview(current_user: schemas.UserOut = Depends(dependencies.require_admin)):
     # Admin check removed (handled by dependency)
 
-    total_users = await db.user.count()
-    total_products = await db.product.count()
-    total_orders = await db.order.count()
-    
-    # Revenue from paid orders only
-    revenue_agg = await db.order.aggregate(
-        sum={"totalAmount": True},
-        where={"paymentStatus": "paid"}
-    )
-    
-    # helper to safely extract total
-    total_revenue = 0.0
-    if revenue_agg and hasattr(revenue_agg, 'sum') and revenue_agg.sum:
-         total_revenue = revenue_agg.sum.totalAmount or 0.0
+    # Cached counters (paid revenue from the daily rollups) and the
+    # in-memory recent orders, fetched concurrently
+    return await admin_stats.overview()
 
-    recent_orders = await db.order.find_many(
-        take=5,
-        order={"createdAt": "desc"},
-        include={"items": True}
-    )
+@app.post("/api/v1/admin/orders/archive")
+async def archive_orders(
+    older_than_days: Optional[int] = None,
+    max_batches: Optional[int] = None,
+    current_user: schemas.UserOut = Depends(dependencies.require_admin)
+):
+    """Archive delivered/cancelled orders now instead of waiting for the nightly run."""
+    days = older_than_days if older_than_days is not None else archive.ORDER_ARCHIVE_AFTER_DAYS
+    if days < 1:
+        raise HTTPException(status_code=400, detail="older_than_days must be at least 1")
 
-    return {
-        "totalUsers": total_users,
-        "totalOrders": total_orders,
-        "totalRevenue": total_revenue,
-        "totalProducts": total_products,
-        "recentOrders": recent_orders
-    }
+    moved = await archive.run_archival(days=days, max_batches=max_batches)
+    return {"message": f"Archived {moved} orders", "archived": moved}
 
 @app.get("/api/v1/admin/users", response_model=List[schemas.UserOut])
 async def get_all_users(current_user: schemas.UserOut = Depends(dependencies.require_admin)):
@@ -1076,6 +1264,7 @@ async def delete_user(user_id: str, current_user: schemas.UserOut = Depends(depe
         raise HTTPException(status_code=400, detail="Cannot delete your own account")
         
     await db.user.delete(where={"id": user_id})
+    await admin_stats.notify_changed()
     return {"message": "User deleted successfully"}
 
 @app.patch("/api/v1/admin/users/{user_id}", response_model=schemas.UserOut)
@@ -1120,7 +1309,19 @@ async def delete_category(category_id: str, current_user: schemas.UserOut = Depe
 
 # Reports & Messaging Endpoints
 @app.get("/api/v1/vendor/reports", response_model=schemas.SalesReport)
-async def get_vendor_reports(current_user: schemas.UserOut = Depends(get_current_user)):
+async def get_vendor_reports(
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    bucket: str = "day",
+    current_user: schemas.UserOut = Depends(get_current_user)
+):
+    """
+    Sales report for the vendor's store over a period.
+    - from / to: period bounds (default: all time up to now)
+    - bucket: day, week or month for the revenue series
+    """
+    start, end = vendor_reports.report_period(from_date, to_date, bucket)
+
     store = await db.store.find_first(where={"vendorId": current_user.id})
     if not store:
         return {
@@ -1128,50 +1329,13 @@ async def get_vendor_reports(current_user: schemas.UserOut = Depends(get_current
             "totalOrders": 0,
             "totalProductsSold": 0,
             "recentOrders": [],
-            "topProducts": []
+            "topProducts": [],
+            "periodStart": start,
+            "periodEnd": end,
+            "bucket": bucket
         }
-    
-    # Get all order items for products in this store
-    order_items = await db.orderitem.find_many(
-        where={"product": {"storeId": store.id}},
-        include={"order": True, "product": True}
-    )
-    
-    total_revenue = sum(item.price * item.quantity for item in order_items)
-    unique_orders = {item.orderId for item in order_items}
-    total_products_sold = sum(item.quantity for item in order_items)
-    
-    # Recent orders (simplified)
-    recent_orders = []
-    seen_orders = set()
-    for item in sorted(order_items, key=lambda x: x.order.createdAt, reverse=True):
-        if item.orderId not in seen_orders and len(recent_orders) < 5:
-            recent_orders.append({
-                "id": item.orderId,
-                "amount": item.order.totalAmount,
-                "status": item.order.status,
-                "date": str(item.order.createdAt)
-            })
-            seen_orders.add(item.orderId)
-            
-    # Top products
-    product_stats = {}
-    for item in order_items:
-        pid = item.productId
-        if pid not in product_stats:
-            product_stats[pid] = {"name": item.product.name, "sold": 0, "revenue": 0.0}
-        product_stats[pid]["sold"] += item.quantity
-        product_stats[pid]["revenue"] += item.price * item.quantity
-    
-    top_products = sorted(product_stats.values(), key=lambda x: x["sold"], reverse=True)[:5]
-    
-    return {
-        "totalRevenue": total_revenue,
-        "totalOrders": len(unique_orders),
-        "totalProductsSold": total_products_sold,
-        "recentOrders": recent_orders,
-        "topProducts": top_products
-    }
+
+    return await vendor_reports.store_report(store.id, start, end, bucket)
 
 @app.post("/api/v1/messages", response_model=schemas.MessageOut)
 async def send_message(msg_data: schemas.MessageCreate, current_user: schemas.UserOut = Depends(dependencies.get_current_user)):
@@ -1231,18 +1395,6 @@ async def mark_message_read(msg_id: str, current_user: schemas.UserOut = Depends
 # FLASH SALE API ENDPOINTS
 # ============================================================================
 
-def calculate_time_remaining(end_time: datetime) -> Optional[int]:
-    """Calculate seconds remaining until flash sale ends."""
-    now = datetime.now()
-    if now >= end_time:
-        return None
-    return int((end_time - now).total_seconds())
-
-def is_flash_sale_active(start_time: datetime, end_time: datetime) -> bool:
-    """Check if flash sale is currently active."""
-    now = datetime.now()
-    return start_time <= now < end_time
-
 @app.get("/api/v1/flash-sales", response_model=List[schemas.FlashSaleListOut])
 async def get_flash_sales(
     active_only: bool = True,
@@ -1252,58 +1404,42 @@ async def get_flash_sales(
     """
     Get all flash sales.
     - active_only: Only return currently active sales
-    - include_products: Include full product details (for detailed view)
+    - include_products: Accepted for compatibility; the list view only carries product counts
     """
-    now = datetime.now()
-
-    # Build where clause
-    where_clause = {}
-    if active_only:
-        where_clause["isActive"] = True
-        where_clause["startTime"] = {"lte": now}
-        where_clause["endTime"] = {"gt": now}
+    return await flash_sales.list_flash_sales(active_only)
 
-    sales = await db.flashsale.find_many(
-        where=where_clause,
-        order={"startTime": "desc"},
-        include={"products": include_products} if include_products else None
-    )
-
-    result = []
-    for sale in sales:
-        time_remaining = calculate_time_remaining(sale.endTime)
-
-        if include_products:
-            # Full details with products
-            products_with_time = []
-            for fp in sale.products:
-                product_dict = {
-                    **fp.__dict__,
-                    "timeRemaining": time_remaining
-                }
-                products_with_time.append(product_dict)
-
-            result.append({
-                **sale.__dict__,
-                "timeRemaining": time_remaining
-            })
-        else:
-            # List view without products
-            product_count = await db.flashsaleproduct.count(
-                where={"flashSaleId": sale.id}
-            )
+@app.get("/api/v1/flash-sales/prices", response_model=List[schemas.FlashPriceOut])
+async def get_flash_prices(
+    ids: str,
+    response: Response
+):
+    """
+    Flash prices for many products in one call, for product grids. Public,
+    so storefront pages can be cached at the CDN.
+    - ids: comma-separated product IDs (at most 200); unknown IDs are left out
+    """
+    product_ids = [product_id for product_id in (part.strip() for part in ids.split(",")) if product_id]
+    if not product_ids:
+        raise HTTPException(status_code=400, detail="No product IDs given")
+    if len(product_ids) > 200:
+        raise HTTPException(status_code=400, detail="At most 200 product IDs per request")
 
-            result.append(schemas.FlashSaleListOut(
-                id=sale.id,
-                name=sale.name,
-                startTime=sale.startTime,
-                endTime=sale.endTime,
-                isActive=sale.isActive and is_flash_sale_active(sale.startTime, sale.endTime),
-                productCount=product_count,
-                timeRemaining=time_remaining
-            ))
+    # Short max-age: prices switch at sale start/end and stock changes with orders
+    response.headers["Cache-Control"] = "public, max-age=5"
+    return await pricing.flash_prices(product_ids)
 
-    return result
+@app.get("/api/v1/flash-sales/active", response_model=schemas.FlashSaleOut)
+async def get_active_flash_sale(
+    current_user: schemas.UserOut = Depends(get_current_user)
+):
+    """
+    Get the currently active flash sale (if any). Served as a body prebuilt
+    when the sale was loaded; only timeRemaining is computed per request.
+    """
+    payload = await flash_sales.scheduler.active_payload()
+    if payload is None:
+        raise HTTPException(status_code=404, detail="No active flash sale")
+    return Response(content=payload, media_type="application/json")
 
 @app.get("/api/v1/flash-sales/{sale_id}", response_model=schemas.FlashSaleOut)
 async def get_flash_sale(
@@ -1323,104 +1459,7 @@ async def get_flash_sale(
     if not is_flash_sale_active(sale.startTime, sale.endTime):
         raise HTTPException(status_code=400, detail="Flash sale has ended")
 
-    time_remaining = calculate_time_remaining(sale.endTime)
-
-    # Build response with product details
-    products_out = []
-    for fp in sale.products:
-        products_out.append(schemas.FlashSaleProductOut(
-            id=fp.id,
-            flashSaleId=fp.flashSaleId,
-            productId=fp.productId,
-            salePrice=fp.salePrice,
-            discountPercent=fp.discountPercent,
-            maxQuantity=fp.maxQuantity,
-            soldCount=fp.soldCount,
-            product=schemas.ProductOut(
-                id=fp.product.id,
-                name=fp.product.name,
-                description=fp.product.description,
-                price=fp.product.price,
-                stock=fp.product.stock,
-                images=fp.product.images,
-                categoryId=fp.product.categoryId,
-                storeId=fp.product.storeId,
-                createdAt=fp.product.createdAt,
-                updatedAt=fp.product.updatedAt
-            )
-        ))
-
-    return schemas.FlashSaleOut(
-        id=sale.id,
-        name=sale.name,
-        description=sale.description,
-        startTime=sale.startTime,
-        endTime=sale.endTime,
-        isActive=sale.isActive and is_flash_sale_active(sale.startTime, sale.endTime),
-        products=products_out,
-        createdAt=sale.createdAt,
-        updatedAt=sale.updatedAt,
-        timeRemaining=time_remaining
-    )
-
-@app.get("/api/v1/flash-sales/active", response_model=schemas.FlashSaleOut)
-async def get_active_flash_sale(
-    current_user: schemas.UserOut = Depends(get_current_user)
-):
-    """Get the currently active flash sale (if any)."""
-    now = datetime.now()
-
-    sale = await db.flashsale.find_first(
-        where={
-            "isActive": True,
-            "startTime": {"lte": now},
-            "endTime": {"gt": now}
-        },
-        include={"products": {"include": {"product": True}}}
-    )
-
-    if not sale:
-        raise HTTPException(status_code=404, detail="No active flash sale")
-
-    time_remaining = calculate_time_remaining(sale.endTime)
-
-    # Build response with product details
-    products_out = []
-    for fp in sale.products:
-        products_out.append(schemas.FlashSaleProductOut(
-            id=fp.id,
-            flashSaleId=fp.flashSaleId,
-            productId=fp.productId,
-            salePrice=fp.salePrice,
-            discountPercent=fp.discountPercent,
-            maxQuantity=fp.maxQuantity,
-            soldCount=fp.soldCount,
-            product=schemas.ProductOut(
-                id=fp.product.id,
-                name=fp.product.name,
-                description=fp.product.description,
-                price=fp.product.price,
-                stock=fp.product.stock,
-                images=fp.product.images,
-                categoryId=fp.product.categoryId,
-                storeId=fp.product.storeId,
-                createdAt=fp.product.createdAt,
-                updatedAt=fp.product.updatedAt
-            )
-        ))
-
-    return schemas.FlashSaleOut(
-        id=sale.id,
-        name=sale.name,
-        description=sale.description,
-        startTime=sale.startTime,
-        endTime=sale.endTime,
-        isActive=True,
-        products=products_out,
-        createdAt=sale.createdAt,
-        updatedAt=sale.updatedAt,
-        timeRemaining=time_remaining
-    )
+    return flash_sales.flash_sale_out(sale, time_remaining=calculate_time_remaining(sale.endTime))
 
 @app.get("/api/v1/products/{product_id}/flash-price", response_model=dict)
 async def get_product_flash_price(
@@ -1431,22 +1470,9 @@ async def get_product_flash_price(
     Get the flash sale price for a product if it's in an active flash sale.
     Returns the sale price, discount percentage, and time remaining.
     """
-    now = datetime.now()
-
-    # Find active flash sale containing this product
-    flash_sale_product = await db.flashsaleproduct.find_first(
-        where={
-            "productId": product_id,
-            "flashSale": {
-                "isActive": True,
-                "startTime": {"lte": now},
-                "endTime": {"gt": now}
-            }
-        },
-        include={"flashSale": True}
-    )
+    match = await flash_sales.scheduler.flash_price(product_id)
 
-    if not flash_sale_product:
+    if not match:
         return {
             "inFlashSale": False,
             "salePrice": None,
@@ -1454,7 +1480,8 @@ async def get_product_flash_price(
             "timeRemaining": None
         }
 
-    time_remaining = calculate_time_remaining(flash_sale_product.flashSale.endTime)
+    flash_sale_product, sale = match
+    time_remaining = calculate_time_remaining(sale.endTime)
 
     return {
         "inFlashSale": True,
@@ -1463,7 +1490,7 @@ async def get_product_flash_price(
         "discountPercent": flash_sale_product.discountPercent,
         "timeRemaining": time_remaining,
         "maxQuantity": flash_sale_product.maxQuantity,
-        "soldCount": flash_sale_product.soldCount
+        "soldCount": sold_counts.sold_count(flash_sale_product)
     }
 
 # ADMIN ONLY: Flash Sale Management
@@ -1500,43 +1527,9 @@ async def create_flash_sale(
         },
         include={"products": {"include": {"product": True}}}
     )
+    await flash_sales.notify_changed()
 
-    # Build response
-    products_out = []
-    for fp in sale.products:
-        products_out.append(schemas.FlashSaleProductOut(
-            id=fp.id,
-            flashSaleId=fp.flashSaleId,
-            productId=fp.productId,
-            salePrice=fp.salePrice,
-            discountPercent=fp.discountPercent,
-            maxQuantity=fp.maxQuantity,
-            soldCount=fp.soldCount,
-            product=schemas.ProductOut(
-                id=fp.product.id,
-                name=fp.product.name,
-                description=fp.product.description,
-                price=fp.product.price,
-                stock=fp.product.stock,
-                images=fp.product.images,
-                categoryId=fp.product.categoryId,
-                storeId=fp.product.storeId,
-                createdAt=fp.product.createdAt,
-                updatedAt=fp.product.updatedAt
-            )
-        ))
-
-    return schemas.FlashSaleOut(
-        id=sale.id,
-        name=sale.name,
-        description=sale.description,
-        startTime=sale.startTime,
-        endTime=sale.endTime,
-        isActive=sale.isActive,
-        products=products_out,
-        createdAt=sale.createdAt,
-        updatedAt=sale.updatedAt
-    )
+    return flash_sales.flash_sale_out(sale)
 
 @app.patch("/api/v1/admin/flash-sales/{sale_id}", response_model=schemas.FlashSaleOut)
 async def update_flash_sale(
@@ -1556,43 +1549,9 @@ async def update_flash_sale(
         data=update_data,
         include={"products": {"include": {"product": True}}}
     )
+    await flash_sales.notify_changed()
 
-    # Build response
-    products_out = []
-    for fp in updated_sale.products:
-        products_out.append(schemas.FlashSaleProductOut(
-            id=fp.id,
-            flashSaleId=fp.flashSaleId,
-            productId=fp.productId,
-            salePrice=fp.salePrice,
-            discountPercent=fp.discountPercent,
-            maxQuantity=fp.maxQuantity,
-            soldCount=fp.soldCount,
-            product=schemas.ProductOut(
-                id=fp.product.id,
-                name=fp.product.name,
-                description=fp.product.description,
-                price=fp.product.price,
-                stock=fp.product.stock,
-                images=fp.product.images,
-                categoryId=fp.product.categoryId,
-                storeId=fp.product.storeId,
-                createdAt=fp.product.createdAt,
-                updatedAt=fp.product.updatedAt
-            )
-        ))
-
-    return schemas.FlashSaleOut(
-        id=updated_sale.id,
-        name=updated_sale.name,
-        description=updated_sale.description,
-        startTime=updated_sale.startTime,
-        endTime=updated_sale.endTime,
-        isActive=updated_sale.isActive,
-        products=products_out,
-        createdAt=updated_sale.createdAt,
-        updatedAt=updated_sale.updatedAt
-    )
+    return flash_sales.flash_sale_out(updated_sale)
 
 @app.delete("/api/v1/admin/flash-sales/{sale_id}")
 async def delete_flash_sale(
@@ -1605,113 +1564,42 @@ async def delete_flash_sale(
         raise HTTPException(status_code=404, detail="Flash sale not found")
 
     await db.flashsale.delete(where={"id": sale_id})
+    await flash_sales.notify_changed()
     return {"message": "Flash sale deleted successfully"}
 
 # ============================================================================
 # PRODUCT REVIEWS & RATINGS ENDPOINTS
 # ============================================================================
 
-@app.get("/api/v1/products/{product_id}/reviews", response_model=schemas.ReviewSummary)
+@app.get("/api/v1/products/{product_id}/reviews", response_model=schemas.ReviewPage)
 async def get_product_reviews(
     product_id: str,
     response: Response,
-    page: int = 1,
+    cursor: Optional[str] = None,
     limit: int = 10,
     sort: str = "recent"
 ):
     """
     Get reviews for a product with summary statistics.
-    Returns average rating, total count, and rating distribution.
+    Returns average rating, total count, rating distribution and one page of
+    reviews. Keyset-paginated: pass the returned nextCursor to get the following page.
     """
-    response.headers["Cache-Control"] = "public, max-age=300"  # 5 minutes cache
+    response.headers["Cache-Control"] = "public, max-age=60"  # 1 minute cache
 
-    # Verify product exists
-    product = await db.product.find_unique(where={"id": product_id})
+    # Summary comes straight from the product's rating counters
+    product, (page, next_cursor) = await asyncio.gather(
+        db.product.find_unique(where={"id": product_id}),
+        reviews.fetch_reviews(product_id, sort=sort, limit=limit, cursor=cursor)
+    )
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    # Calculate rating distribution
-    reviews = await db.review.find_many(
-        where={"productId": product_id}
+    return schemas.ReviewPage(
+        summary=schemas.ReviewSummary(**ratings.rating_summary(product)),
+        reviews=page,
+        nextCursor=next_cursor
     )
 
-    total_reviews = len(reviews)
-    rating_distribution = {"5": 0, "4": 0, "3": 0, "2": 0, "1": 0}
-
-    total_rating = 0
-    for review in reviews:
-        rating_distribution[str(review.rating)] += 1
-        total_rating += review.rating
-
-    average_rating = total_rating / total_reviews if total_reviews > 0 else 0
-
-    # Get paginated reviews with user info
-    skip = (page - 1) * limit
-
-    order_by = {"createdAt": "desc"} if sort == "recent" else {"helpful": "desc"}
-
-    paginated_reviews = await db.review.find_many(
-        where={"productId": product_id},
-        order=order_by,
-        skip=skip,
-        take=limit,
-        include={"user": True}
-    )
-
-    return schemas.ReviewSummary(
-        productId=product_id,
-        averageRating=round(average_rating, 1),
-        totalReviews=total_reviews,
-        ratingDistribution=rating_distribution
-    )
-
-
-@app.get("/api/v1/products/{product_id}/reviews/list", response_model=List[schemas.ReviewWithUser])
-async def get_product_reviews_list(
-    product_id: str,
-    response: Response,
-    page: int = 1,
-    limit: int = 10,
-    sort: str = "recent"
-):
-    """Get paginated list of reviews for a product."""
-    response.headers["Cache-Control"] = "public, max-age=60"  # 1 minute cache
-
-    skip = (page - 1) * limit
-    order_by = {"createdAt": "desc"} if sort == "recent" else {"helpful": "desc"}
-
-    reviews = await db.review.find_many(
-        where={"productId": product_id},
-        order=order_by,
-        skip=skip,
-        take=limit,
-        include={"user": True}
-    )
-
-    # Format response with minimal user info
-    result = []
-    for review in reviews:
-        result.append({
-            "id": review.id,
-            "userId": review.userId,
-            "productId": review.productId,
-            "rating": review.rating,
-            "title": review.title,
-            "comment": review.comment,
-            "isVerified": review.isVerified,
-            "helpful": review.helpful,
-            "images": review.images,
-            "createdAt": review.createdAt,
-            "updatedAt": review.updatedAt,
-            "user": {
-                "id": review.user.id,
-                "name": review.user.name,
-                "email": review.user.email
-            }
-        })
-
-    return result
-
 
 @app.post("/api/v1/products/{product_id}/reviews", response_model=schemas.ReviewOut)
 async def create_review(
@@ -1745,37 +1633,21 @@ async def create_review(
         raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
 
     # Check if user has purchased this product (verified review)
-    is_verified = False
-    user_orders = await db.order.find_many(
-        where={
-            "userId": current_user.id,
-            "status": {"in": ["delivered", "shipped", "processing"]}  # Consider these as valid for review
-        },
-        include={"items": True}
-    )
-
-    for order in user_orders:
-        for item in order.items:
-            if item.productId == product_id:
-                is_verified = True
-                break
-        if is_verified:
-            break
-
-    # Create review
-    review = await db.review.create(
-        data={
-            "userId": current_user.id,
-            "productId": product_id,
-            "rating": review_data.rating,
-            "title": review_data.title,
-            "comment": review_data.comment,
-            "isVerified": is_verified
-        }
-    )
+    is_verified = await purchases.has_purchased(current_user.id, product_id)
 
-    # Update product rating summary
-    await update_product_rating(product_id)
+    # Create review and update the product's rating counters together
+    async with db.tx() as transaction:
+        review = await transaction.review.create(
+            data={
+                "userId": current_user.id,
+                "productId": product_id,
+                "rating": review_data.rating,
+                "title": review_data.title,
+                "comment": review_data.comment,
+                "isVerified": is_verified
+            }
+        )
+        await ratings.apply_rating_delta(transaction, product_id, None, review.rating)
 
     return review
 
@@ -1807,13 +1679,19 @@ async def update_review(
     if review_data.comment is not None:
         update_data["comment"] = review_data.comment
 
-    updated_review = await db.review.update(
-        where={"id": review_id},
-        data=update_data
-    )
-
-    # Update product rating summary
-    await update_product_rating(review.productId)
+    async with db.tx() as transaction:
+        # The delta starts from the locked row, not the read above
+        current = await ratings.lock_review(transaction, review_id)
+        if not current:
+            raise HTTPException(status_code=404, detail="Review not found")
+        updated_review = await transaction.review.update(
+            where={"id": review_id},
+            data=update_data
+        )
+        if current["status"] == "approved":
+            await ratings.apply_rating_delta(
+                transaction, current["productId"], current["rating"], updated_review.rating
+            )
 
     return updated_review
 
@@ -1832,11 +1710,13 @@ async def delete_review(
     if review.userId != current_user.id and current_user.role != "admin":
         raise HTTPException(status_code=403, detail="You can only delete your own reviews")
 
-    product_id = review.productId
-    await db.review.delete(where={"id": review_id})
-
-    # Update product rating summary
-    await update_product_rating(product_id)
+    async with db.tx() as transaction:
+        current = await ratings.lock_review(transaction, review_id)
+        if not current:
+            raise HTTPException(status_code=404, detail="Review not found")
+        await transaction.review.delete(where={"id": review_id})
+        if current["status"] == "approved":
+            await ratings.apply_rating_delta(transaction, current["productId"], current["rating"], None)
 
     return {"message": "Review deleted successfully"}
 
@@ -1846,38 +1726,69 @@ async def mark_review_helpful(
     review_id: str,
     current_user: schemas.UserOut = Depends(get_current_user)
 ):
-    """Mark a review as helpful (increments helpful count)."""
-    review = await db.review.find_unique(where={"id": review_id})
-    if not review:
+    """
+    Mark a review as helpful, once per user.
+    The vote row is written immediately; the review's stored count is
+    recomputed in batches. The response counts the votes directly.
+    """
+    try:
+        await db.reviewvote.create(data={"userId": current_user.id, "reviewId": review_id})
+    except UniqueViolationError:
+        raise HTTPException(status_code=400, detail="You have already marked this review as helpful")
+    except ForeignKeyViolationError:
         raise HTTPException(status_code=404, detail="Review not found")
 
-    # Increment helpful count
-    updated_review = await db.review.update(
-        where={"id": review_id},
-        data={"helpful": review.helpful + 1}
-    )
+    vote_buffer.add(review_id)
 
-    return {"helpful": updated_review.helpful}
+    return {"helpful": await db.reviewvote.count(where={"reviewId": review_id})}
 
 
-async def update_product_rating(product_id: str):
+@app.get("/api/v1/admin/reviews", response_model=List[schemas.ReviewOut])
+async def get_reviews_for_moderation(
+    status: str = "pending",
+    limit: int = 50,
+    skip: int = 0,
+    current_user: schemas.UserOut = Depends(dependencies.require_admin)
+):
+    """List reviews by moderation status (admin only)."""
+    return await db.review.find_many(
+        where={"status": status},
+        order={"createdAt": "desc"},
+        take=limit,
+        skip=skip
+    )
+
+
+@app.post("/api/v1/admin/reviews/import", response_model=schemas.ReviewImportResult)
+async def import_reviews(
+    import_data: schemas.ReviewImport,
+    current_user: schemas.UserOut = Depends(dependencies.require_admin)
+):
     """
-    Helper function to update product's average rating and review count.
-    Called after review creation, update, or deletion.
+    Bulk import reviews (e.g. from the old platform).
+    Rating aggregates are recomputed once per affected product.
     """
-    reviews = await db.review.find_many(where={"productId": product_id})
+    return await reviews.import_reviews(import_data.reviews)
 
-    total_reviews = len(reviews)
-    total_rating = sum(r.rating for r in reviews)
-    average_rating = total_rating / total_reviews if total_reviews > 0 else 0
 
-    await db.product.update(
-        where={"id": product_id},
-        data={
-            "averageRating": average_rating,
-            "reviewCount": total_reviews
-        }
-    )
+@app.post("/api/v1/admin/reviews/moderate")
+async def moderate_reviews(
+    moderation: schemas.ReviewModeration,
+    current_user: schemas.UserOut = Depends(dependencies.require_admin)
+):
+    """Approve and/or delete many reviews at once (admin only)."""
+    result = await reviews.moderate_reviews(moderation.approve, moderation.delete)
+    return {"message": "Reviews moderated successfully", **result}
+
+
+@app.post("/api/v1/admin/reviews/reconcile")
+async def reconcile_review_ratings(
+    product_id: Optional[str] = None,
+    current_user: schemas.UserOut = Depends(dependencies.require_admin)
+):
+    """Recompute product rating counters from the reviews table (repairs drift)."""
+    fixed = await ratings.reconcile_product_ratings([product_id] if product_id else None)
+    return {"message": f"Reconciled ratings for {fixed} products", "fixed": fixed}
 
 
 # ============================================================
@@ -1886,32 +1797,82 @@ async def update_product_rating(product_id: str):
 
 async def get_default_commission_rate() -> float:
     """Get the default commission rate (0.10 = 10% if not set)."""
-    default_commission = await db.commission.find_first(where={"isDefault": True})
-    if default_commission:
-        return default_commission.rate
-    return 0.10  # Default to 10%
+    return await commissions.default_rate()
 
 
-async def create_vendor_earning(order_id: str, order_amount: float, store_id: str):
+async def create_vendor_earning(
+    order_id: str,
+    order_amount: float,
+    store_id: str,
+    commission_rate: Optional[float] = None,
+    commission_amount: Optional[float] = None
+):
     """
     Create a vendor earning record when an order is paid.
     Called automatically when order payment status is updated to 'paid'.
+    Pass commission_amount when items carry different rates; the stored
+    rate is then the effective rate for the order.
+    If the order has already been delivered, the earning is created
+    available, since the delivery found no earning to release.
     """
-    commission_rate = await get_default_commission_rate()
-    commission_amount = order_amount * commission_rate
+    if commission_amount is None:
+        if commission_rate is None:
+            commission_rate = await get_default_commission_rate()
+        commission_amount = order_amount * commission_rate
+    elif commission_rate is None:
+        commission_rate = commission_amount / order_amount if order_amount else 0
     vendor_amount = order_amount - commission_amount
 
-    await db.vendorearning.create(
-        data={
-            "storeId": store_id,
-            "orderId": order_id,
-            "orderAmount": order_amount,
-            "commissionRate": commission_rate,
-            "commissionAmount": commission_amount,
-            "vendorAmount": vendor_amount,
-            "status": "pending"  # Will become available after order is delivered
-        }
+    await ledger.ensure_balance(store_id)
+    async with db.tx() as transaction:
+        # Lock the order so a concurrent "delivered" update either commits
+        # first (seen here) or waits and then releases this earning
+        order = await transaction.query_first(
+            'SELECT "status" FROM "Order" WHERE "id" = $1 FOR UPDATE', order_id
+        )
+        delivered = order is not None and order["status"] == "delivered"
+
+        earning = await transaction.vendorearning.create(
+            data={
+                "storeId": store_id,
+                "orderId": order_id,
+                "orderAmount": order_amount,
+                "commissionRate": commission_rate,
+                "commissionAmount": commission_amount,
+                "vendorAmount": vendor_amount,
+                # Otherwise becomes available when the order is delivered
+                "status": "available" if delivered else "pending"
+            }
+        )
+        await ledger.post(transaction, store_id, ledger.EARNING_CREDITED, vendor_amount, earning_id=earning.id)
+        if delivered:
+            await ledger.post(transaction, store_id, ledger.EARNING_RELEASED, vendor_amount, earning_id=earning.id)
+
+
+@outbox.handler("order.paid")
+async def handle_order_paid(payload: dict):
+    """
+    Outbox handler: create one earning per store in a paid order.
+    Idempotent - stores that already have an earning for the order are skipped.
+    """
+    order_id = payload["aggregateId"]
+    order = await db.order.find_unique(
+        where={"id": order_id},
+        include={"items": {"include": {"product": True}}}
     )
+    if not order:
+        return
+
+    # Per-item commission rules in effect when the order was paid, summed per store
+    paid_at = datetime.fromisoformat(payload["paidAt"]) if payload.get("paidAt") else None
+    store_earnings = await commissions.commission_by_store(order.items, at=paid_at)
+
+    existing = await db.vendorearning.find_many(where={"orderId": order_id})
+    already_created = {e.storeId for e in existing}
+
+    for store_id, (amount, commission_amount) in store_earnings.items():
+        if store_id not in already_created:
+            await create_vendor_earning(order_id, amount, store_id, commission_amount=commission_amount)
 
 
 @app.get("/api/v1/vendor/earnings", response_model=schemas.VendorEarningSummary)
@@ -1920,32 +1881,29 @@ async def get_vendor_earnings(
 ):
     """
     Get vendor's earnings summary including available balance and history.
+    Balances are one VendorBalance row read, so the cost doesn't grow with history.
     """
-    store = await db.store.find_first(
-        where={"vendorId": current_user.id},
-        include={"earnings": True, "payouts": True}
-    )
-
+    store = await db.store.find_unique(where={"vendorId": current_user.id})
     if not store:
         raise HTTPException(status_code=404, detail="Store not found")
 
-    earnings = store.earnings or []
-
-    # Calculate totals
-    total_earnings = sum(e.vendorAmount for e in earnings)
-    available_balance = sum(e.vendorAmount for e in earnings if e.status == "available")
-    pending_earnings = sum(e.vendorAmount for e in earnings if e.status == "pending")
-    paid_amount = sum(p.amount for p in store.payouts if p.status == "completed")
-
-    # Get recent earnings
-    recent_earnings = sorted(earnings, key=lambda e: e.createdAt, reverse=True)[:10]
+    balance, total_orders, recent_earnings = await asyncio.gather(
+        ledger.get_balance(store.id),
+        db.vendorearning.count(where={"storeId": store.id}),
+        db.vendorearning.find_many(
+            where={"storeId": store.id},
+            order={"createdAt": "desc"},
+            take=10
+        )
+    )
 
     return schemas.VendorEarningSummary(
-        totalEarnings=total_earnings,
-        availableBalance=available_balance,
-        pendingEarnings=pending_earnings,
-        paidAmount=paid_amount,
-        totalOrders=len(earnings),
+        totalEarnings=sum(balance.values()),
+        availableBalance=balance["available"],
+        pendingEarnings=balance["pending"],
+        reservedBalance=balance["reserved"],
+        paidAmount=balance["paid"],
+        totalOrders=total_orders,
         recentEarnings=recent_earnings
     )
 
@@ -1978,6 +1936,83 @@ async def get_vendor_earnings_history(
     return earnings
 
 
+EARNING_EXPORT_COLUMNS = [
+    "id", "orderId", "orderTotal", "orderStatus", "orderPaymentStatus", "orderAmount",
+    "commissionRate", "commissionAmount", "vendorAmount", "status", "createdAt",
+]
+
+
+@app.get("/api/v1/vendor/earnings/export")
+async def export_vendor_earnings(
+    format: str = "csv",
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    status: Optional[str] = None,
+    current_user: schemas.UserOut = Depends(dependencies.require_vendor)
+):
+    """
+    Stream the vendor's earnings, oldest first, with their orders' totals.
+    - format: csv or ndjson
+    - from / to: createdAt range [from, to) (default: all history)
+    - status: only earnings with this status
+    Pages follow the (storeId, createdAt) index by keyset, and each page's
+    orders are loaded in one query, so any range costs the same per row.
+    """
+    exports.check_format(format)
+    if from_date and to_date and to_date <= from_date:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+
+    store = await db.store.find_unique(where={"vendorId": current_user.id})
+    if not store:
+        raise HTTPException(status_code=404, detail="Store not found")
+
+    where_clause = {"storeId": store.id}
+    if from_date or to_date:
+        where_clause["createdAt"] = {}
+        if from_date:
+            where_clause["createdAt"]["gte"] = from_date
+        if to_date:
+            where_clause["createdAt"]["lt"] = to_date
+    if status:
+        where_clause["status"] = status
+
+    async def fetch_page(after, take):
+        """One page of (earning, order) pairs; the page's orders are one query."""
+        earnings = await db.vendorearning.find_many(
+            where=where_clause,
+            order=[{"createdAt": "asc"}, {"id": "asc"}],
+            take=take,
+            **({"cursor": {"id": after[0].id}, "skip": 1} if after else {})
+        )
+        order_ids = list({e.orderId for e in earnings})
+        orders = {}
+        if order_ids:
+            orders = {o.id: o for o in await db.order.find_many(where={"id": {"in": order_ids}})}
+            archived_ids = [order_id for order_id in order_ids if order_id not in orders]
+            if archived_ids:
+                orders.update({o.id: o for o in await db.orderarchive.find_many(where={"id": {"in": archived_ids}})})
+        return [(earning, orders.get(earning.orderId)) for earning in earnings]
+
+    async def rows():
+        async for earning, order in exports.paginate(fetch_page):
+            yield {
+                "id": earning.id,
+                "orderId": earning.orderId,
+                "orderTotal": order.totalAmount if order else None,
+                "orderStatus": order.status if order else None,
+                "orderPaymentStatus": order.paymentStatus if order else None,
+                "orderAmount": earning.orderAmount,
+                "commissionRate": earning.commissionRate,
+                "commissionAmount": earning.commissionAmount,
+                "vendorAmount": earning.vendorAmount,
+                "status": earning.status,
+                "createdAt": earning.createdAt,
+            }
+
+    filename = f"earnings-{datetime.now().strftime('%Y%m%d')}"
+    return exports.export_response(rows(), EARNING_EXPORT_COLUMNS, format, filename)
+
+
 @app.post("/api/v1/vendor/payouts", response_model=schemas.VendorPayoutOut)
 async def request_payout(
     payout_data: schemas.VendorPayoutCreate,
@@ -1985,53 +2020,36 @@ async def request_payout(
 ):
     """
     Request a payout from available earnings balance.
+    The amount is reserved in the vendor ledger in the same transaction as the
+    payout, so concurrent requests cannot spend the same balance twice.
     """
-    store = await db.store.find_first(
-        where={"vendorId": current_user.id},
-        include={"earnings": True}
-    )
-
+    store = await db.store.find_unique(where={"vendorId": current_user.id})
     if not store:
         raise HTTPException(status_code=404, detail="Store not found")
 
-    # Calculate available balance
-    available_balance = sum(e.vendorAmount for e in store.earnings if e.status == "available")
+    if payout_data.amount <= 0:
+        raise HTTPException(status_code=400, detail="Payout amount must be positive")
 
-    if payout_data.amount > available_balance:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Insufficient balance. Available: Rs. {available_balance:,.2f}"
+    await ledger.ensure_balance(store.id)
+    async with db.tx() as transaction:
+        # Create payout request
+        payout = await transaction.vendorpayout.create(
+            data={
+                "storeId": store.id,
+                "amount": payout_data.amount,
+                "paymentMethod": payout_data.paymentMethod,
+                "paymentDetails": payout_data.paymentDetails,
+                "notes": payout_data.notes,
+                "requestedBy": current_user.id,
+                "status": "pending"
+            }
         )
 
-    # Create payout request
-    payout = await db.vendorpayout.create(
-        data={
-            "storeId": store.id,
-            "amount": payout_data.amount,
-            "paymentMethod": payout_data.paymentMethod,
-            "paymentDetails": payout_data.paymentDetails,
-            "notes": payout_data.notes,
-            "requestedBy": current_user.id,
-            "status": "pending"
-        }
-    )
-
-    # Mark the used earnings as "paid" (in processing)
-    # We'll update them when payout is completed
-    pending_earnings = await db.vendorearning.find_many(
-        where={"storeId": store.id, "status": "available"},
-        order={"createdAt": "asc"}
-    )
+        # Raises 400 (rolling back the payout) if the balance doesn't cover it
+        await ledger.reserve_payout(transaction, store.id, payout_data.amount, payout.id)
 
-    amount_to_mark = payout_data.amount
-    for earning in pending_earnings:
-        if amount_to_mark <= 0:
-            break
-        await db.vendorearning.update(
-            where={"id": earning.id},
-            data={"status": "paid"}
-        )
-        amount_to_mark -= earning.vendorAmount
+        # Mark the oldest earnings covering the amount as "paid" (in processing)
+        await ledger.allocate_earnings(transaction, store.id, payout.id, payout_data.amount)
 
     return payout
 
@@ -2076,7 +2094,6 @@ async def get_all_payouts(
 
     payouts = await db.vendorpayout.find_many(
         where=where_clause,
-        include={"store": {"include": {"vendor": True}}},
         order={"requestedAt": "desc"},
         take=limit,
         skip=skip
@@ -2085,6 +2102,107 @@ async def get_all_payouts(
     return payouts
 
 
+PAYOUT_EXPORT_COLUMNS = [
+    "id", "storeId", "storeName", "vendorName", "vendorEmail", "amount", "status",
+    "paymentMethod", "paymentDetails", "transactionId", "requestedAt", "processedAt",
+]
+
+
+@app.get("/api/v1/admin/payouts/export")
+async def export_payouts(
+    format: str = "csv",
+    status: Optional[str] = None,
+    current_user: schemas.UserOut = Depends(dependencies.require_admin)
+):
+    """
+    Stream payouts with vendor payment details for bank upload (admin only).
+    - format: csv or ndjson
+    - status: only payouts with this status, e.g. pending
+    """
+    exports.check_format(format)
+    where_clause = {"status": status} if status else {}
+
+    async def fetch_page(after, take):
+        return await db.vendorpayout.find_many(
+            where=where_clause,
+            include={"store": {"include": {"vendor": True}}},
+            order=[{"requestedAt": "asc"}, {"id": "asc"}],
+            take=take,
+            **({"cursor": {"id": after.id}, "skip": 1} if after else {})
+        )
+
+    async def rows():
+        async for payout in exports.paginate(fetch_page):
+            yield {
+                "id": payout.id,
+                "storeId": payout.storeId,
+                "storeName": payout.store.name,
+                "vendorName": payout.store.vendor.name,
+                "vendorEmail": payout.store.vendor.email,
+                "amount": payout.amount,
+                "status": payout.status,
+                "paymentMethod": payout.paymentMethod,
+                "paymentDetails": payout.paymentDetails,
+                "transactionId": payout.transactionId,
+                "requestedAt": payout.requestedAt,
+                "processedAt": payout.processedAt,
+            }
+
+    filename = f"payouts-{status or 'all'}-{datetime.now().strftime('%Y%m%d')}"
+    return exports.export_response(rows(), PAYOUT_EXPORT_COLUMNS, format, filename)
+
+
+@app.post("/api/v1/admin/payouts/batch", response_model=schemas.PayoutBatchResult)
+async def process_payouts_batch(
+    batch: schemas.PayoutBatchProcess,
+    current_user: schemas.UserOut = Depends(dependencies.require_admin)
+):
+    """
+    Approve or reject many pending payouts in one transaction (admin only).
+    Payouts that are no longer pending are skipped and listed in the result.
+    """
+    if batch.status not in ("completed", "rejected", "failed"):
+        raise HTTPException(status_code=400, detail="Status must be one of: completed, rejected, failed")
+
+    payout_ids = list(dict.fromkeys(batch.payoutIds))
+    if not payout_ids:
+        raise HTTPException(status_code=400, detail="No payouts given")
+    if len(payout_ids) > 500:
+        raise HTTPException(status_code=400, detail="At most 500 payouts per batch")
+
+    update_data = {
+        "status": batch.status,
+        "processedBy": current_user.id,
+        "processedAt": datetime.now()
+    }
+    if batch.status == "rejected" and batch.rejectionReason:
+        update_data["rejectionReason"] = batch.rejectionReason
+
+    # Stores that predate the ledger need their opening balance first
+    pending = await db.vendorpayout.find_many(where={"id": {"in": payout_ids}, "status": "pending"})
+    await asyncio.gather(*(ledger.ensure_balance(store_id) for store_id in {p.storeId for p in pending}))
+
+    async with db.tx(timeout=timedelta(seconds=30)) as transaction:
+        payouts = await transaction.vendorpayout.find_many(
+            where={"id": {"in": payout_ids}, "status": "pending"}
+        )
+        claimed_ids = [payout.id for payout in payouts]
+        if claimed_ids:
+            claimed = await transaction.vendorpayout.update_many(
+                where={"id": {"in": claimed_ids}, "status": "pending"},
+                data=update_data
+            )
+            if claimed != len(claimed_ids):
+                raise HTTPException(status_code=409, detail="Some payouts were processed concurrently; please retry")
+            await ledger.settle_payouts(transaction, payouts, batch.status)
+
+    claimed_set = set(claimed_ids)
+    return schemas.PayoutBatchResult(
+        processed=len(claimed_ids),
+        skipped=[payout_id for payout_id in payout_ids if payout_id not in claimed_set]
+    )
+
+
 @app.patch("/api/v1/admin/payouts/{payout_id}", response_model=schemas.VendorPayoutOut)
 async def process_payout(
     payout_id: str,
@@ -2113,16 +2231,21 @@ async def process_payout(
 
     if payout_update.status == "rejected" and payout_update.rejectionReason:
         update_data["rejectionReason"] = payout_update.rejectionReason
-        # Return earnings to available status
-        await db.vendorearning.update_many(
-            where={"orderId": {"in": [payout.id]}},  # Simplified - would need proper tracking
-            data={"status": "available"}
+
+    await ledger.ensure_balance(payout.storeId)
+    async with db.tx() as transaction:
+        # Conditional on "pending" so two admins can't process the same payout
+        claimed = await transaction.vendorpayout.update_many(
+            where={"id": payout_id, "status": "pending"},
+            data=update_data
         )
+        if not claimed:
+            raise HTTPException(status_code=400, detail="Payout has already been processed")
 
-    updated_payout = await db.vendorpayout.update(
-        where={"id": payout_id},
-        data=update_data
-    )
+        # Completed: reserved -> paid. Rejected/failed: back to available
+        await ledger.settle_payouts(transaction, [payout], payout_update.status)
+
+        updated_payout = await transaction.vendorpayout.find_unique(where={"id": payout_id})
 
     return updated_payout
 
@@ -2150,7 +2273,10 @@ async def create_commission(
     commission_data: schemas.CommissionCreate,
     current_user: schemas.UserOut = Depends(dependencies.require_admin)
 ):
-    """Create a new commission rate."""
+    """Create a new commission rate, optionally scoped to a store, category and time window."""
+    if commission_data.startsAt and commission_data.endsAt and commission_data.endsAt <= commission_data.startsAt:
+        raise HTTPException(status_code=400, detail="End time must be after start time")
+
     # If this is set as default, remove default flag from others
     if commission_data.isDefault:
         await db.commission.update_many(
@@ -2160,6 +2286,7 @@ async def create_commission(
     commission = await db.commission.create(
         data=commission_data.model_dump()
     )
+    await commissions.notify_changed()
 
     return commission
 
@@ -2181,12 +2308,19 @@ async def update_commission(
             data={"isDefault": False}
         )
 
-    update_data = {k: v for k, v in commission_data.model_dump().items() if v is not None}
+    # Only fields sent are changed; scope, window and description can be cleared with null
+    update_data = {
+        k: v for k, v in commission_data.model_dump(exclude_unset=True).items()
+        if v is not None or k in ("description", "storeId", "categoryId", "startsAt", "endsAt")
+    }
+    if update_data.get("startsAt") and update_data.get("endsAt") and update_data["endsAt"] <= update_data["startsAt"]:
+        raise HTTPException(status_code=400, detail="End time must be after start time")
 
     updated_commission = await db.commission.update(
         where={"id": commission_id},
         data=update_data
     )
+    await commissions.notify_changed()
 
     return updated_commission
 
@@ -2205,6 +2339,7 @@ async def delete_commission(
         raise HTTPException(status_code=400, detail="Cannot delete default commission rate")
 
     await db.commission.delete(where={"id": commission_id})
+    await commissions.notify_changed()
     return {"message": "Commission deleted successfully"}
 
 
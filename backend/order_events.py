@@ -0,0 +1,66 @@
+"""
+Order status events and the Server-Sent Events stream that pushes them.
+
+update_order_status() and mark_order_paid() publish a compact status event
+through the pubsub broker; every open tracking page subscribed to that order
+receives it once instead of polling the tracking endpoint.
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict
+
+from fastapi import Request
+
+from pubsub import broker
+
+CHANNEL = "order_events"
+
+# Comment line sent when idle so proxies keep the connection open
+HEARTBEAT_SECONDS = 15
+
+
+def order_topic(order_id: str) -> str:
+    return f"order:{order_id}"
+
+
+def status_event(order) -> Dict[str, Any]:
+    """Build the event payload from an Order row (no relations needed)."""
+    return {
+        "orderId": order.id,
+        "status": order.status,
+        "paymentStatus": order.paymentStatus,
+        "trackingNumber": order.trackingNumber,
+        "shippingCarrier": order.shippingCarrier,
+        "estimatedDelivery": order.estimatedDelivery.isoformat() if order.estimatedDelivery else None,
+        "updatedAt": order.updatedAt.isoformat() if order.updatedAt else None,
+    }
+
+
+async def publish_order_status(order):
+    """Push the order's current status to all subscribers, on every worker."""
+    await broker.publish(CHANNEL, order_topic(order.id), status_event(order))
+
+
+def format_sse(data: Any, event: str = "status") -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream_order_events(request: Request, order) -> AsyncIterator[str]:
+    """
+    Yield the current status first, then every published change until the
+    client disconnects.
+    """
+    topic = order_topic(order.id)
+    queue = broker.subscribe(topic)
+    try:
+        yield "retry: 5000\n\n"
+        yield format_sse(status_event(order))
+        while not await request.is_disconnected():
+            try:
+                data = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(data)
+    finally:
+        broker.unsubscribe(topic, queue)
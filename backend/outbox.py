@@ -0,0 +1,185 @@
+"""
+Transactional outbox for side effects that should not run inside a request.
+
+Write paths call enqueue() with their transaction client, so the event is
+committed atomically with the state change that caused it. A small pool of
+asyncio workers claims pending events in batches (FOR UPDATE SKIP LOCKED, so
+several app workers can drain the same table), runs the registered handler
+and retries failures with exponential backoff.
+
+Handlers must be idempotent: an event can run more than once if a worker dies
+after the side effect but before the event is marked done.
+"""
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from prisma import Json
+
+from database import db
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 2))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 20))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", 2))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", 7))
+
+# Events stuck in "processing" longer than this are assumed orphaned and reclaimed
+OUTBOX_LOCK_TIMEOUT_SECONDS = 300
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_handlers: Dict[str, Handler] = {}
+
+
+def handler(event_type: str):
+    """Decorator registering the coroutine that processes one event type."""
+    def register(func: Handler) -> Handler:
+        _handlers[event_type] = func
+        return func
+    return register
+
+
+async def enqueue(client, event_type: str, aggregate_id: str, payload: Optional[Dict[str, Any]] = None):
+    """
+    Add an event to the outbox. Pass the transaction client so the event
+    commits (or rolls back) together with the caller's writes, and call
+    worker.wake() once the transaction has committed.
+    """
+    await client.outboxevent.create(
+        data={
+            "type": event_type,
+            "aggregateId": aggregate_id,
+            "payload": Json(payload or {}),
+        }
+    )
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(2 ** attempts, 300))
+
+
+class OutboxWorker:
+    def __init__(self):
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._last_purge: Optional[datetime] = None
+
+    def wake(self):
+        """Skip the poll interval; call after committing a transaction that enqueued events."""
+        self._wakeup.set()
+
+    async def claim_batch(self) -> List[Dict[str, Any]]:
+        return await db.query_raw(
+            """
+            UPDATE "OutboxEvent"
+            SET "status" = 'processing', "attempts" = "attempts" + 1, "lockedAt" = NOW()
+            WHERE "id" IN (
+                SELECT "id" FROM "OutboxEvent"
+                WHERE ("status" = 'pending' AND "availableAt" <= NOW())
+                   OR ("status" = 'processing' AND "lockedAt" < NOW() - make_interval(secs => $2))
+                ORDER BY "createdAt"
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING "id", "type", "aggregateId", "payload", "attempts"
+            """,
+            OUTBOX_BATCH_SIZE,
+            OUTBOX_LOCK_TIMEOUT_SECONDS,
+        )
+
+    async def process_event(self, event: Dict[str, Any]) -> Optional[str]:
+        """Run one event's handler. Returns an error message on failure."""
+        func = _handlers.get(event["type"])
+        if func is None:
+            return f"No handler registered for {event['type']}"
+
+        payload = event.get("payload") or {}
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        payload.setdefault("aggregateId", event["aggregateId"])
+
+        try:
+            await func(payload)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        return None
+
+    async def drain_once(self) -> int:
+        """Claim and process one batch. Returns the number of events claimed."""
+        events = await self.claim_batch()
+        if not events:
+            return 0
+
+        results = await asyncio.gather(*(self.process_event(e) for e in events))
+
+        now = datetime.now(timezone.utc)
+        done_ids = [e["id"] for e, error in zip(events, results) if error is None]
+        if done_ids:
+            await db.outboxevent.update_many(
+                where={"id": {"in": done_ids}},
+                data={"status": "done", "processedAt": now, "lastError": None}
+            )
+
+        for event, error in zip(events, results):
+            if error is None:
+                continue
+            print(f"[WARNING] Outbox event {event['id']} ({event['type']}) failed: {error}")
+            if event["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                data = {"status": "failed", "lastError": error}
+            else:
+                data = {
+                    "status": "pending",
+                    "lastError": error,
+                    "availableAt": now + _backoff(event["attempts"]),
+                }
+            await db.outboxevent.update(where={"id": event["id"]}, data=data)
+
+        return len(events)
+
+    async def purge_processed(self):
+        """Delete events that finished more than OUTBOX_RETENTION_DAYS ago."""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=OUTBOX_RETENTION_DAYS)
+        await db.outboxevent.delete_many(
+            where={"status": "done", "processedAt": {"lt": cutoff}}
+        )
+
+    async def _run(self):
+        while True:
+            try:
+                claimed = await self.drain_once()
+                now = datetime.now(timezone.utc)
+                if self._last_purge is None or now - self._last_purge > timedelta(hours=1):
+                    self._last_purge = now
+                    await self.purge_processed()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WARNING] Outbox worker error: {e}")
+                claimed = 0
+
+            # A full batch means there is probably more waiting
+            if claimed >= OUTBOX_BATCH_SIZE:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, concurrency: int = OUTBOX_WORKERS):
+        if self._tasks:
+            return
+        loop = asyncio.get_event_loop()
+        self._tasks = [loop.create_task(self._run()) for _ in range(concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+worker = OutboxWorker()
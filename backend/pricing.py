@@ -0,0 +1,174 @@
+"""
+Server-side checkout pricing.
+
+Line prices come from the product's base price or, when the product is in an
+active flash sale, the sale price. Product rows for a cart are loaded in one
+batched query and cached per product for a few seconds; flash sale prices
+come from the in-memory flash sale schedule, so they switch exactly at the
+sale's start and end. The cart page, the quote endpoint and create_order()
+share the same computation.
+
+Stock shown in a quote can be a few seconds stale; create_order() enforces
+stock with a conditional decrement inside its transaction.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from fastapi import HTTPException
+
+from cache import TTLCache
+from database import db
+from flash_sales import scheduler
+
+PRICE_CACHE_SECONDS = 10
+
+
+class PriceEntry(NamedTuple):
+    productId: str
+    name: str
+    basePrice: float
+    stock: int
+    salePrice: Optional[float] = None
+    discountPercent: Optional[int] = None
+    maxQuantity: Optional[int] = None
+    flashSaleId: Optional[str] = None
+    flashSaleProductId: Optional[str] = None
+    saleEndsAt: Optional[datetime] = None
+
+    @property
+    def unitPrice(self) -> float:
+        return self.salePrice if self.salePrice is not None else self.basePrice
+
+
+price_cache = TTLCache(ttl=PRICE_CACHE_SECONDS, maxsize=20000)
+
+
+def invalidate(product_ids: Iterable[str]):
+    for product_id in product_ids:
+        price_cache.delete(product_id)
+
+
+async def load_price_book(product_ids: Iterable[str]) -> Dict[str, PriceEntry]:
+    """Price entries for the given products; unknown IDs are simply absent."""
+    ids = list(dict.fromkeys(product_ids))
+    book: Dict[str, PriceEntry] = {}
+    missing = []
+    for product_id in ids:
+        entry = price_cache.get(product_id)
+        if entry is None:
+            missing.append(product_id)
+        else:
+            book[product_id] = entry
+
+    if missing:
+        products = await db.product.find_many(where={"id": {"in": missing}})
+        for product in products:
+            entry = PriceEntry(
+                productId=product.id,
+                name=product.name,
+                basePrice=product.price,
+                stock=product.stock,
+            )
+            price_cache.set(product.id, entry)
+            book[product.id] = entry
+
+    # Overlay flash sale prices from the schedule (no I/O once it is loaded)
+    for product_id, entry in book.items():
+        match = await scheduler.flash_price(product_id)
+        if match:
+            fp, sale = match
+            book[product_id] = entry._replace(
+                salePrice=fp.salePrice,
+                discountPercent=fp.discountPercent,
+                maxQuantity=fp.maxQuantity,
+                flashSaleId=fp.flashSaleId,
+                flashSaleProductId=fp.id,
+                saleEndsAt=sale.endTime,
+            )
+
+    return book
+
+
+async def flash_prices(product_ids: Iterable[str]) -> List[dict]:
+    """FlashPriceOut fields for each known product, in request order."""
+    ids = list(dict.fromkeys(product_ids))
+    book = await load_price_book(ids)
+    now = datetime.now(timezone.utc)
+    result = []
+    for entry in (book[product_id] for product_id in ids if product_id in book):
+        time_remaining = None
+        if entry.saleEndsAt is not None:
+            time_remaining = max(0, int((entry.saleEndsAt - now).total_seconds()))
+        result.append({
+            "productId": entry.productId,
+            "inFlashSale": entry.flashSaleProductId is not None,
+            "basePrice": entry.basePrice,
+            "salePrice": entry.salePrice,
+            "discountPercent": entry.discountPercent,
+            "maxQuantity": entry.maxQuantity,
+            "remainingQuantity": entry.stock,
+            "timeRemaining": time_remaining,
+        })
+    return result
+
+
+def merge_quantities(items) -> Dict[str, int]:
+    """Sum quantities per product, keeping the order products first appear in."""
+    quantities: Dict[str, int] = {}
+    for item in items:
+        if item.quantity < 1:
+            raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+        quantities[item.productId] = quantities.get(item.productId, 0) + item.quantity
+    return quantities
+
+
+async def quote_items(items) -> dict:
+    """
+    Price a cart. `items` are objects with productId and quantity.
+    Raises HTTPException for unknown products, stock or flash sale limits.
+    """
+    quantities = merge_quantities(items)
+    if not quantities:
+        raise HTTPException(status_code=400, detail="No items to price")
+
+    book = await load_price_book(quantities.keys())
+
+    lines: List[dict] = []
+    subtotal = 0.0
+    total = 0.0
+    for product_id, quantity in quantities.items():
+        entry = book.get(product_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
+        if entry.stock < quantity:
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for {entry.name}")
+        if entry.maxQuantity is not None and quantity > entry.maxQuantity:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Flash sale limit for {entry.name} is {entry.maxQuantity} per customer"
+            )
+
+        line_total = round(entry.unitPrice * quantity, 2)
+        subtotal += entry.basePrice * quantity
+        total += line_total
+        lines.append({
+            "productId": product_id,
+            "name": entry.name,
+            "quantity": quantity,
+            "basePrice": entry.basePrice,
+            "unitPrice": entry.unitPrice,
+            "lineTotal": line_total,
+            "inFlashSale": entry.flashSaleProductId is not None,
+            "discountPercent": entry.discountPercent,
+            "maxQuantity": entry.maxQuantity,
+            "flashSaleProductId": entry.flashSaleProductId,
+        })
+
+    subtotal = round(subtotal, 2)
+    total = round(total, 2)
+    return {
+        "items": lines,
+        "subtotal": subtotal,
+        "discount": round(subtotal - total, 2),
+        "total": total,
+    }
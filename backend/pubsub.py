@@ -0,0 +1,159 @@
+"""
+In-process publish/subscribe with Postgres LISTEN/NOTIFY fan-out.
+
+Each worker keeps its subscribers in memory. publish() delivers to local
+subscribers straight away and sends a NOTIFY so the listener in every other
+worker re-delivers to its own subscribers. Messages carry the id of the worker
+that sent them, so a worker never delivers its own NOTIFY twice.
+
+LISTEN needs a dedicated session connection (asyncpg). If asyncpg is not
+installed or the database sits behind a transaction-mode pooler, the broker
+still works for a single worker and simply skips the fan-out.
+"""
+import asyncio
+import json
+import os
+import uuid
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from database import db
+
+try:
+    import asyncpg
+except ImportError:  # Fan-out across workers is optional
+    asyncpg = None
+
+WORKER_ID = uuid.uuid4().hex
+PUBSUB_DATABASE_URL = os.getenv("PUBSUB_DATABASE_URL", os.getenv("DATABASE_URL", ""))
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+# Query parameters understood by Prisma but not by libpq/asyncpg
+PRISMA_ONLY_PARAMS = {"schema", "connection_limit", "pool_timeout", "pgbouncer", "socket_timeout", "statement_cache_size"}
+
+Handler = Callable[[str, Any], Awaitable[None]]
+
+
+def _asyncpg_dsn(url: str) -> str:
+    """Strip Prisma-specific query parameters so asyncpg accepts the URL."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k not in PRISMA_ONLY_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class Broker:
+    """Topic-based broker. Subscribers get an asyncio.Queue per topic."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self._channels: Set[str] = set()
+        self._listening: Set[str] = set()
+        self._connection = None
+        # The event loop only keeps weak references to tasks
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def fanout_enabled(self) -> bool:
+        return self._connection is not None and not self._connection.is_closed()
+
+    def subscribe(self, topic: str, maxsize: int = 100) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._subscribers[topic].add(queue)
+        return queue
+
+    def unsubscribe(self, topic: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(topic)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[topic]
+
+    def on(self, channel: str, handler: Handler):
+        """
+        Register a coroutine called with (topic, data) for every message on a channel.
+        Register before start(), or call listen() afterwards.
+        """
+        self._handlers[channel].append(handler)
+        self._channels.add(channel)
+
+    def _deliver(self, topic: str, data: Any):
+        for queue in list(self._subscribers.get(topic, ())):
+            if queue.full():
+                # Slow consumer: drop its oldest message rather than block publishers
+                queue.get_nowait()
+            queue.put_nowait(data)
+
+    async def _dispatch(self, channel: str, topic: str, data: Any):
+        self._deliver(topic, data)
+        for handler in self._handlers.get(channel, ()):
+            try:
+                await handler(topic, data)
+            except Exception as e:
+                print(f"[WARNING] pubsub handler for {channel} failed: {e}")
+
+    async def publish(self, channel: str, topic: str, data: Any):
+        """Deliver locally, then NOTIFY the other workers."""
+        await self._dispatch(channel, topic, data)
+
+        if not self.fanout_enabled:
+            return
+
+        payload = json.dumps({"origin": WORKER_ID, "topic": topic, "data": data}, default=str)
+        if len(payload.encode("utf-8")) > NOTIFY_PAYLOAD_LIMIT:
+            print(f"[WARNING] pubsub payload for {topic} too large for NOTIFY, not fanned out")
+            return
+        try:
+            await db.execute_raw("SELECT pg_notify($1, $2)", channel, payload)
+        except Exception as e:
+            print(f"[WARNING] pubsub NOTIFY on {channel} failed: {e}")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("origin") == WORKER_ID:
+            return
+        task = asyncio.get_event_loop().create_task(
+            self._dispatch(channel, message.get("topic", ""), message.get("data"))
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def start(self, channels: Optional[List[str]] = None):
+        """Open the LISTEN connection. Safe to call when asyncpg is unavailable."""
+        self._channels.update(channels or [])
+        if asyncpg is None or not PUBSUB_DATABASE_URL or self.fanout_enabled:
+            return
+        try:
+            self._connection = await asyncpg.connect(_asyncpg_dsn(PUBSUB_DATABASE_URL))
+            for channel in self._channels:
+                await self._connection.add_listener(channel, self._on_notify)
+                self._listening.add(channel)
+        except Exception as e:
+            print(f"[WARNING] pubsub LISTEN unavailable, running single-worker: {e}")
+            self._connection = None
+            self._listening.clear()
+
+    async def listen(self, channel: str):
+        """Start listening on another channel after start()."""
+        self._channels.add(channel)
+        if self.fanout_enabled and channel not in self._listening:
+            await self._connection.add_listener(channel, self._on_notify)
+            self._listening.add(channel)
+
+    async def stop(self):
+        if self._connection is not None:
+            try:
+                await self._connection.close()
+            finally:
+                self._connection = None
+                self._listening.clear()
+
+
+broker = Broker()
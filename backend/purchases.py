@@ -0,0 +1,89 @@
+"""
+Verified-purchase lookups for reviews.
+
+A purchase is an OrderItem for the product in one of the user's orders with
+a status in VERIFIED_ORDER_STATUSES (hot or archived orders). The first check
+for a user loads the set of every product they have purchased in one query
+and later checks answer from it, so each user costs one query per cache
+lifetime however many products they review. A product found in the set is
+trusted for PURCHASED_TTL_SECONDS; one missing from it only while the set is
+younger than NOT_PURCHASED_TTL_SECONDS, after which the set is reloaded.
+update_order_status() calls notify_changed(), which drops the customer's set
+on every worker through the pubsub "purchases" channel, so a cancelled order
+stops granting review rights at once; the TTLs only bound staleness if a
+notification is missed.
+"""
+import time
+from typing import FrozenSet, Tuple
+
+from cache import TTLCache
+from database import db
+from pubsub import broker
+
+VERIFIED_ORDER_STATUSES = ("delivered", "shipped", "processing")
+
+CHANNEL = "purchases"
+
+PURCHASED_TTL_SECONDS = 300
+NOT_PURCHASED_TTL_SECONDS = 60
+
+_STATUS_LIST = ", ".join(f"'{status}'" for status in VERIFIED_ORDER_STATUSES)
+
+_PURCHASED_SQL = f"""
+SELECT oi."productId" FROM "OrderItem" oi
+JOIN "Order" o ON o."id" = oi."orderId"
+WHERE o."userId" = $1 AND o."status" IN ({_STATUS_LIST})
+UNION
+SELECT ai."productId" FROM "OrderItemArchive" ai
+JOIN "OrderArchive" ao ON ao."id" = ai."orderId"
+WHERE ao."userId" = $1 AND ao."status" IN ({_STATUS_LIST})
+"""
+
+# user_id -> (loaded at, purchased product ids)
+purchase_cache = TTLCache(ttl=PURCHASED_TTL_SECONDS, maxsize=20000)
+
+# Bumped by every invalidation
+_generation = 0
+
+
+async def purchased_products(user_id: str) -> Tuple[float, FrozenSet[str]]:
+    """(monotonic load time, product ids) for the user, loaded once per cache lifetime."""
+    entry = purchase_cache.get(user_id)
+    if entry is None:
+        generation = _generation
+        rows = await db.query_raw(_PURCHASED_SQL, user_id)
+        entry = (time.monotonic(), frozenset(row["productId"] for row in rows))
+        # A set loaded across an invalidation may predate the change
+        if generation == _generation:
+            purchase_cache.set(user_id, entry)
+    return entry
+
+
+async def has_purchased(user_id: str, product_id: str) -> bool:
+    loaded_at, products = await purchased_products(user_id)
+    if product_id in products:
+        return True
+    if time.monotonic() - loaded_at < NOT_PURCHASED_TTL_SECONDS:
+        return False
+    # Too old to trust a "no": reload the set
+    invalidate(user_id)
+    _, products = await purchased_products(user_id)
+    return product_id in products
+
+
+def invalidate(user_id: str):
+    global _generation
+    _generation += 1
+    purchase_cache.delete(user_id)
+
+
+async def notify_changed(user_id: str):
+    """Call after changing the status of one of the user's orders."""
+    await broker.publish(CHANNEL, f"purchases:{user_id}", {"userId": user_id})
+
+
+async def _on_purchases_changed(topic: str, data):
+    invalidate(data["userId"])
+
+
+broker.on(CHANNEL, _on_purchases_changed)
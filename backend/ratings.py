@@ -0,0 +1,198 @@
+"""
+Incremental product rating aggregates.
+
+Product carries reviewCount, ratingSum and one counter per star. Review
+writes apply a delta to those counters (and the derived averageRating) in a
+single UPDATE inside the same transaction as the review change, so the
+review summary is a single-row read. reconcile_product_ratings() recomputes
+the counters from the Review table to repair any drift, a chunk of locked
+products at a time in one UPDATE, so it never overwrites a concurrent delta.
+
+Only approved reviews count; reviews awaiting moderation are left out until
+an admin approves them.
+"""
+import asyncio
+import os
+from typing import Iterable, Optional, Tuple
+
+from database import db
+
+STARS = (1, 2, 3, 4, 5)
+
+RATING_RECONCILE_INTERVAL_HOURS = float(os.getenv("RATING_RECONCILE_INTERVAL_HOURS", 24))
+
+_APPLY_DELTA_SQL = """
+UPDATE "Product" SET
+    "reviewCount" = "reviewCount" + $2,
+    "ratingSum" = "ratingSum" + $3,
+    "rating1Count" = "rating1Count" + $4,
+    "rating2Count" = "rating2Count" + $5,
+    "rating3Count" = "rating3Count" + $6,
+    "rating4Count" = "rating4Count" + $7,
+    "rating5Count" = "rating5Count" + $8,
+    "averageRating" = CASE
+        WHEN "reviewCount" + $2 > 0 THEN ("ratingSum" + $3)::float / ("reviewCount" + $2)
+        ELSE 0
+    END
+WHERE "id" = $1
+"""
+
+
+RECONCILE_CHUNK_SIZE = 500
+
+# Targeted recounts wait for the locks (in id order, so two recounts can't
+# deadlock); only the background sweep skips busy products
+_LOCK_IDS_SQL = """
+SELECT "id" FROM "Product" WHERE "id" = ANY($1::text[]) ORDER BY "id" FOR UPDATE
+"""
+
+_LOCK_PAGE_SQL = """
+SELECT "id" FROM "Product" WHERE "id" > $1 ORDER BY "id" LIMIT $2 FOR UPDATE SKIP LOCKED
+"""
+
+# Counters for products $1 from their approved reviews, in one statement
+_RECONCILE_SQL = """
+UPDATE "Product" p SET
+    "reviewCount" = c."reviewCount",
+    "ratingSum" = c."ratingSum",
+    "rating1Count" = c."rating1Count",
+    "rating2Count" = c."rating2Count",
+    "rating3Count" = c."rating3Count",
+    "rating4Count" = c."rating4Count",
+    "rating5Count" = c."rating5Count",
+    "averageRating" = CASE WHEN c."reviewCount" > 0 THEN c."ratingSum"::float / c."reviewCount" ELSE 0 END
+FROM (
+    SELECT p2."id",
+           COUNT(r."id")::int AS "reviewCount",
+           COALESCE(SUM(r."rating"), 0)::int AS "ratingSum",
+           COUNT(*) FILTER (WHERE r."rating" = 1)::int AS "rating1Count",
+           COUNT(*) FILTER (WHERE r."rating" = 2)::int AS "rating2Count",
+           COUNT(*) FILTER (WHERE r."rating" = 3)::int AS "rating3Count",
+           COUNT(*) FILTER (WHERE r."rating" = 4)::int AS "rating4Count",
+           COUNT(*) FILTER (WHERE r."rating" = 5)::int AS "rating5Count"
+    FROM "Product" p2
+    LEFT JOIN "Review" r ON r."productId" = p2."id" AND r."status" = 'approved'
+    WHERE p2."id" = ANY($1::text[])
+    GROUP BY p2."id"
+) c
+WHERE p."id" = c."id" AND (
+    p."reviewCount" <> c."reviewCount" OR p."ratingSum" <> c."ratingSum"
+    OR p."rating1Count" <> c."rating1Count" OR p."rating2Count" <> c."rating2Count"
+    OR p."rating3Count" <> c."rating3Count" OR p."rating4Count" <> c."rating4Count"
+    OR p."rating5Count" <> c."rating5Count"
+)
+"""
+
+# The review as committed, locked until the caller's transaction ends
+_LOCK_REVIEW_SQL = """
+SELECT "productId", "rating", "status" FROM "Review" WHERE "id" = $1 FOR UPDATE
+"""
+
+
+def star_field(rating: int) -> str:
+    return f"rating{rating}Count"
+
+
+async def apply_rating_delta(client, product_id: str, old_rating: Optional[int], new_rating: Optional[int]):
+    """
+    Move one review from old_rating to new_rating (None = no review).
+    Pass the transaction client so the counters commit with the review write.
+    """
+    if old_rating == new_rating:
+        return
+
+    star_deltas = {star: 0 for star in STARS}
+    count_delta = 0
+    sum_delta = 0
+    if old_rating is not None:
+        star_deltas[old_rating] -= 1
+        count_delta -= 1
+        sum_delta -= old_rating
+    if new_rating is not None:
+        star_deltas[new_rating] += 1
+        count_delta += 1
+        sum_delta += new_rating
+
+    await client.execute_raw(
+        _APPLY_DELTA_SQL,
+        product_id,
+        count_delta,
+        sum_delta,
+        *(star_deltas[star] for star in STARS)
+    )
+
+
+async def lock_review(client, review_id: str) -> Optional[dict]:
+    """
+    Lock a review row in the caller's transaction and return its productId,
+    rating and status. Deltas must start from this row, not from a read made
+    before the transaction, or a concurrent edit or moderation skews them.
+    """
+    return await client.query_first(_LOCK_REVIEW_SQL, review_id)
+
+
+def rating_summary(product) -> dict:
+    """ReviewSummary fields from a Product row's counters."""
+    return {
+        "productId": product.id,
+        "averageRating": round(product.ratingSum / product.reviewCount, 1) if product.reviewCount else 0,
+        "totalReviews": product.reviewCount,
+        "ratingDistribution": {str(star): getattr(product, star_field(star)) for star in (5, 4, 3, 2, 1)},
+    }
+
+
+async def _reconcile_chunk(lock_sql: str, *args) -> Tuple[int, Optional[str]]:
+    """
+    Lock a chunk of products, then recount them. Returns (products fixed,
+    last id locked). The lock comes first so the recount's snapshot already
+    includes every committed delta, and later deltas wait for it.
+    """
+    async with db.tx() as transaction:
+        locked = await transaction.query_raw(lock_sql, *args)
+        if not locked:
+            return 0, None
+        ids = [row["id"] for row in locked]
+        fixed = await transaction.execute_raw(_RECONCILE_SQL, ids)
+    return fixed, ids[-1]
+
+
+async def reconcile_product_ratings(product_ids: Optional[Iterable[str]] = None) -> int:
+    """
+    Recompute rating counters from the Review table. Limited to product_ids
+    when given, otherwise every product. Returns the number of products fixed.
+    Given product_ids are always recounted, waiting for any transaction that
+    holds them; the full sweep skips products locked by another transaction
+    (e.g. a checkout) and leaves them for the next run.
+    """
+    if product_ids is not None:
+        ids = sorted(set(product_ids))
+        fixed = 0
+        for index in range(0, len(ids), RECONCILE_CHUNK_SIZE):
+            chunk_fixed, _ = await _reconcile_chunk(_LOCK_IDS_SQL, ids[index:index + RECONCILE_CHUNK_SIZE])
+            fixed += chunk_fixed
+        return fixed
+
+    fixed = 0
+    after = ""
+    while True:
+        chunk_fixed, after = await _reconcile_chunk(_LOCK_PAGE_SQL, after, RECONCILE_CHUNK_SIZE)
+        if after is None:
+            return fixed
+        fixed += chunk_fixed
+
+
+async def reconcile_loop():
+    """
+    Background task: repair rating drift every RATING_RECONCILE_INTERVAL_HOURS.
+    The first run at startup also backfills counters for existing reviews.
+    """
+    while True:
+        try:
+            fixed = await reconcile_product_ratings()
+            if fixed:
+                print(f"[WARNING] Rating reconciliation repaired {fixed} products")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARNING] Rating reconciliation failed: {e}")
+        await asyncio.sleep(RATING_RECONCILE_INTERVAL_HOURS * 3600)
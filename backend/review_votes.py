@@ -0,0 +1,126 @@
+"""
+Write-behind buffer for review "helpful" counts.
+
+Each vote inserts a ReviewVote row (the unique (userId, reviewId) pair
+rejects repeat votes) and marks the review dirty in memory. Every
+VOTE_FLUSH_SECONDS the dirty reviews get their count recomputed from
+ReviewVote in one statement, so a flush is idempotent and never loses or
+double-counts a vote. Readers add pending() to the stored count, so the
+worker that took a vote shows it at once; other workers show it after the
+next flush.
+
+The votes are the source of truth: reconcile_loop() periodically recounts
+every review whose stored count disagrees with its votes, which also
+repairs counts a crashed worker never flushed.
+"""
+import asyncio
+import os
+from typing import Dict, Optional
+
+from database import db, try_advisory_xact_lock
+
+VOTE_FLUSH_SECONDS = float(os.getenv("VOTE_FLUSH_SECONDS", 2))
+HELPFUL_RECONCILE_INTERVAL_HOURS = float(os.getenv("HELPFUL_RECONCILE_INTERVAL_HOURS", 1))
+
+# pg advisory lock held by the worker reconciling helpful counts
+HELPFUL_RECONCILE_LOCK_KEY = 482003
+
+_RECOUNT_SQL = """
+UPDATE "Review" r
+SET "helpful" = (SELECT COUNT(*) FROM "ReviewVote" v WHERE v."reviewId" = r."id")
+WHERE r."id" = ANY($1::text[])
+"""
+
+# Reviews voted on in the last minute are left to the voting worker's flush,
+# whose recount may be newer than this statement's snapshot
+_RECONCILE_SQL = """
+UPDATE "Review" r
+SET "helpful" = c."votes"
+FROM (
+    SELECT r2."id", COUNT(v."id")::int AS "votes"
+    FROM "Review" r2
+    LEFT JOIN "ReviewVote" v ON v."reviewId" = r2."id"
+    GROUP BY r2."id"
+) c
+WHERE r."id" = c."id" AND r."helpful" <> c."votes"
+  AND NOT EXISTS (
+    SELECT 1 FROM "ReviewVote" recent
+    WHERE recent."reviewId" = r."id" AND recent."createdAt" > NOW() - INTERVAL '1 minute'
+  )
+"""
+
+
+class HelpfulVoteBuffer:
+    def __init__(self):
+        self._pending: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, review_id: str, count: int = 1):
+        self._pending[review_id] = self._pending.get(review_id, 0) + count
+
+    def pending(self, review_id: str) -> int:
+        return self._pending.get(review_id, 0)
+
+    async def flush(self) -> int:
+        """Recount all dirty reviews. Returns the number of reviews updated."""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        try:
+            # A review deleted since the vote is simply not matched
+            await db.execute_raw(_RECOUNT_SQL, list(batch))
+        except Exception:
+            # Put the reviews back so the next flush retries them
+            for review_id, count in batch.items():
+                self.add(review_id, count)
+            raise
+        return len(batch)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(VOTE_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WARNING] Helpful vote flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"[WARNING] Final helpful vote flush failed: {e}")
+
+
+vote_buffer = HelpfulVoteBuffer()
+
+
+async def reconcile_helpful_counts() -> int:
+    """Recount reviews whose helpful count disagrees with their votes. Returns reviews fixed."""
+    async with db.tx() as transaction:
+        if not await try_advisory_xact_lock(transaction, HELPFUL_RECONCILE_LOCK_KEY):
+            return 0
+        return await transaction.execute_raw(_RECONCILE_SQL)
+
+
+async def reconcile_loop():
+    """Background task: repair helpful counts every HELPFUL_RECONCILE_INTERVAL_HOURS."""
+    while True:
+        try:
+            fixed = await reconcile_helpful_counts()
+            if fixed:
+                print(f"[WARNING] Helpful vote reconciliation repaired {fixed} reviews")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARNING] Helpful vote reconciliation failed: {e}")
+        await asyncio.sleep(HELPFUL_RECONCILE_INTERVAL_HOURS * 3600)
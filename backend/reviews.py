@@ -0,0 +1,175 @@
+"""
+Review listing queries, bulk import and moderation.
+
+Pages are fetched with keyset pagination on (createdAt, id) for the "recent"
+sort and (helpful, id) for the "helpful" sort, so deep pages cost the same as
+the first one. The query joins only the reviewer's id and name - the
+reviewer's email and password hash never leave the database.
+
+Bulk import and moderation write in chunks and recompute rating aggregates
+once per affected product at the end, instead of once per review.
+"""
+import asyncio
+import base64
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from database import db
+import ratings
+from review_votes import vote_buffer
+
+REVIEW_IMPORT_CHUNK_SIZE = 500
+
+SORT_COLUMNS = {
+    "recent": ('"createdAt"', "::timestamp"),
+    "helpful": ('"helpful"', "::int"),
+}
+
+_SELECT = """
+SELECT r."id", r."userId", r."productId", r."rating", r."title", r."comment",
+       r."isVerified", r."helpful", r."images", r."createdAt", r."updatedAt",
+       u."name" AS "userName"
+FROM "Review" r
+JOIN "User" u ON u."id" = r."userId"
+WHERE r."productId" = $1 AND r."status" = 'approved'
+"""
+
+
+def encode_cursor(sort: str, row: dict) -> str:
+    value = row["createdAt"] if sort == "recent" else row["helpful"]
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[object, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, review_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort != sort:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+    return value, review_id
+
+
+def _to_review(row: dict) -> dict:
+    return {
+        "id": row["id"],
+        "userId": row["userId"],
+        "productId": row["productId"],
+        "rating": row["rating"],
+        "title": row["title"],
+        "comment": row["comment"],
+        "isVerified": row["isVerified"],
+        "helpful": row["helpful"] + vote_buffer.pending(row["id"]),
+        "images": row["images"] or [],
+        "createdAt": row["createdAt"],
+        "updatedAt": row["updatedAt"],
+        "user": {"id": row["userId"], "name": row["userName"]},
+    }
+
+
+async def fetch_reviews(
+    product_id: str,
+    sort: str = "recent",
+    limit: int = 10,
+    cursor: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """One page of reviews with reviewer id/name. Returns (reviews, next_cursor)."""
+    # Anything other than "recent" sorts by helpful votes, as before
+    sort = "recent" if sort == "recent" else "helpful"
+    column, cast = SORT_COLUMNS[sort]
+    limit = max(1, min(limit, 100))
+
+    query = _SELECT
+    args: list = [product_id]
+    if cursor:
+        value, review_id = decode_cursor(cursor, sort)
+        query += f' AND (r.{column}, r."id") < ($2{cast}, $3)'
+        args += [value, review_id]
+
+    # Fetch one extra row to know whether another page exists
+    query += f' ORDER BY r.{column} DESC, r."id" DESC LIMIT {limit + 1}'
+
+    rows = await db.query_raw(query, *args)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort, rows[-1])
+    return [_to_review(row) for row in rows], next_cursor
+
+
+async def import_reviews(items) -> Dict[str, object]:
+    """
+    Insert ReviewImportItem objects with create_many in chunks. Rows with an
+    invalid rating or unknown user/product are skipped and reported; rows that
+    duplicate an existing (userId, productId) review are skipped silently.
+    """
+    user_ids = list({item.userId for item in items})
+    product_ids = list({item.productId for item in items})
+    users, products = await asyncio.gather(
+        db.user.find_many(where={"id": {"in": user_ids}}),
+        db.product.find_many(where={"id": {"in": product_ids}}),
+    )
+    known_users = {u.id for u in users}
+    known_products = {p.id for p in products}
+
+    errors: List[str] = []
+    rows: List[dict] = []
+    for index, item in enumerate(items):
+        if item.rating < 1 or item.rating > 5:
+            errors.append(f"#{index}: rating must be between 1 and 5")
+        elif item.userId not in known_users:
+            errors.append(f"#{index}: user {item.userId} not found")
+        elif item.productId not in known_products:
+            errors.append(f"#{index}: product {item.productId} not found")
+        else:
+            rows.append(item.model_dump(exclude_none=True))
+
+    imported = 0
+    for start in range(0, len(rows), REVIEW_IMPORT_CHUNK_SIZE):
+        imported += await db.review.create_many(
+            data=rows[start:start + REVIEW_IMPORT_CHUNK_SIZE],
+            skip_duplicates=True
+        )
+
+    affected = {row["productId"] for row in rows}
+    updated = await ratings.reconcile_product_ratings(affected) if affected else 0
+
+    return {
+        "imported": imported,
+        "skipped": len(items) - imported,
+        "errors": errors,
+        "productsUpdated": updated,
+    }
+
+
+async def moderate_reviews(approve: List[str], delete: List[str]) -> Dict[str, int]:
+    """Approve and delete reviews in one transaction, then fix their products' ratings."""
+    ids = list(set(approve) | set(delete))
+    if not ids:
+        return {"approved": 0, "deleted": 0, "productsUpdated": 0}
+
+    targets = await db.review.find_many(where={"id": {"in": ids}})
+    affected = {review.productId for review in targets}
+    to_approve = list(set(approve) - set(delete))
+
+    async with db.tx() as transaction:
+        approved = 0
+        if to_approve:
+            approved = await transaction.review.update_many(
+                where={"id": {"in": to_approve}, "status": {"not": "approved"}},
+                data={"status": "approved"}
+            )
+        deleted = 0
+        if delete:
+            deleted = await transaction.review.delete_many(where={"id": {"in": delete}})
+
+    updated = await ratings.reconcile_product_ratings(affected) if affected else 0
+    return {"approved": approved, "deleted": deleted, "productsUpdated": updated}
@@ -0,0 +1,218 @@
+"""
+Daily sales rollups.
+
+Three tables hold pre-aggregated sales per UTC day:
+
+    DailyStoreProductSales   store x product x day   (top products)
+    DailyStoreSales          store x day             (store totals, distinct orders)
+    DailyPlatformSales       day                     (platform totals, paid revenue)
+
+refresh() finds orders whose updatedAt is past the "daily_sales" watermark,
+and recomputes only the days those orders were created on, from the hot and
+archived order tables. A recompute replaces the whole day, so it is
+idempotent: the watermark is re-read with a small overlap to catch commits
+that landed out of order. Code that deletes orders outright calls
+mark_stale() with their creation times, since a deleted order has no
+updatedAt to find. rollup_loop() runs refresh() every ROLLUP_INTERVAL_SECONDS
+on every worker; an advisory lock lets one of them do the pass and the rest
+skip it. The first pass backfills all history.
+
+Readers use the rollups for whole days before live_from() and query live
+orders from there on. That is today's orders, or more if the job is behind,
+so figures are never stale by more than one refresh for past days.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from database import db, try_advisory_xact_lock
+
+ROLLUP_INTERVAL_SECONDS = float(os.getenv("ROLLUP_INTERVAL_SECONDS", 300))
+ROLLUP_DAYS_PER_STATEMENT = 31
+ROLLUP_TX_TIMEOUT_SECONDS = 600
+WATERMARK_OVERLAP_SECONDS = 60
+WATERMARK = "daily_sales"
+
+# pg advisory lock held by the worker running a refresh pass
+ROLLUP_LOCK_KEY = 482001
+
+EPOCH = datetime(1970, 1, 1)
+
+# Hot and archived orders/items. Archived orders are older than any refresh
+# window normally, but a day that mixes both must be rebuilt from both.
+ORDERS = """(
+    SELECT "id", "createdAt", "totalAmount", "paymentStatus" FROM "Order"
+    UNION ALL
+    SELECT "id", "createdAt", "totalAmount", "paymentStatus" FROM "OrderArchive"
+)"""
+ITEMS = """(
+    SELECT "orderId", "productId", "quantity", "price" FROM "OrderItem"
+    UNION ALL
+    SELECT "orderId", "productId", "quantity", "price" FROM "OrderItemArchive"
+)"""
+
+_CHANGED_SQL = """
+SELECT ARRAY_AGG(DISTINCT ("createdAt"::date)::text) AS "days", MAX("updatedAt") AS "latest"
+FROM "Order"
+WHERE "updatedAt" > $1::timestamp
+"""
+
+_STALE_SQL = """
+SELECT ARRAY_AGG("day"::text) AS "days" FROM "RollupStaleDay"
+"""
+
+_MARK_STALE_SQL = """
+INSERT INTO "RollupStaleDay" ("day", "createdAt")
+SELECT DISTINCT d, NOW() FROM unnest($1::date[]) AS d
+ON CONFLICT ("day") DO NOTHING
+"""
+
+# $1: days to rebuild (text[] of ISO dates)
+_DAYS = """unnest($1::date[]) AS d("day")"""
+
+_REBUILD_SQL = [
+    'DELETE FROM "DailyStoreProductSales" WHERE "day" = ANY($1::date[])',
+    'DELETE FROM "DailyStoreSales" WHERE "day" = ANY($1::date[])',
+    'DELETE FROM "DailyPlatformSales" WHERE "day" = ANY($1::date[])',
+    f"""
+    INSERT INTO "DailyStoreProductSales" ("storeId", "productId", "day", "revenue", "units", "orders")
+    SELECT p."storeId", i."productId", d."day", SUM(i."price" * i."quantity"), SUM(i."quantity"), COUNT(DISTINCT o."id")
+    FROM {_DAYS}
+    JOIN {ORDERS} o ON o."createdAt" >= d."day" AND o."createdAt" < d."day" + 1
+    JOIN {ITEMS} i ON i."orderId" = o."id"
+    JOIN "Product" p ON p."id" = i."productId"
+    GROUP BY p."storeId", i."productId", d."day"
+    """,
+    f"""
+    INSERT INTO "DailyStoreSales" ("storeId", "day", "revenue", "units", "orders")
+    SELECT p."storeId", d."day", SUM(i."price" * i."quantity"), SUM(i."quantity"), COUNT(DISTINCT o."id")
+    FROM {_DAYS}
+    JOIN {ORDERS} o ON o."createdAt" >= d."day" AND o."createdAt" < d."day" + 1
+    JOIN {ITEMS} i ON i."orderId" = o."id"
+    JOIN "Product" p ON p."id" = i."productId"
+    GROUP BY p."storeId", d."day"
+    """,
+    f"""
+    INSERT INTO "DailyPlatformSales" ("day", "orders", "revenue", "paidOrders", "paidRevenue")
+    SELECT d."day", COUNT(*), SUM(o."totalAmount"),
+           COUNT(*) FILTER (WHERE o."paymentStatus" = 'paid'),
+           COALESCE(SUM(o."totalAmount") FILTER (WHERE o."paymentStatus" = 'paid'), 0)
+    FROM {_DAYS}
+    JOIN {ORDERS} o ON o."createdAt" >= d."day" AND o."createdAt" < d."day" + 1
+    GROUP BY d."day"
+    """,
+]
+
+_WATERMARK_SQL = """
+INSERT INTO "RollupWatermark" ("name", "watermark", "updatedAt") VALUES ($1, $2::timestamp, NOW())
+ON CONFLICT ("name") DO UPDATE SET "watermark" = EXCLUDED."watermark", "updatedAt" = NOW()
+"""
+
+_ROLLED_PAID_REVENUE_SQL = """
+SELECT COALESCE(SUM("paidRevenue"), 0)::float AS "revenue"
+FROM "DailyPlatformSales"
+WHERE "day" < $1::timestamp
+"""
+
+_LIVE_PAID_REVENUE_SQL = f"""
+SELECT COALESCE(SUM(o."totalAmount"), 0)::float AS "revenue"
+FROM {ORDERS} o
+WHERE o."paymentStatus" = 'paid' AND o."createdAt" >= $1::timestamp
+"""
+
+
+def utc_naive(moment: datetime) -> datetime:
+    """Order timestamps are stored as UTC without a zone."""
+    if moment.tzinfo:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def start_of_day(moment: datetime) -> datetime:
+    return utc_naive(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def get_watermark(client=None) -> Optional[datetime]:
+    row = await (client or db).rollupwatermark.find_unique(where={"name": WATERMARK})
+    return utc_naive(row.watermark) if row else None
+
+
+async def live_from() -> datetime:
+    """First instant not covered by the rollups (UTC, naive): today, or the watermark's day if earlier."""
+    today = start_of_day(datetime.now(timezone.utc))
+    watermark = await get_watermark()
+    if watermark is None:
+        return EPOCH
+    return min(today, start_of_day(watermark))
+
+
+async def mark_stale(client, created_ats: List[datetime]):
+    """Have the next refresh rebuild the days of these (deleted) orders."""
+    days = sorted({start_of_day(moment).date().isoformat() for moment in created_ats})
+    if days:
+        await client.execute_raw(_MARK_STALE_SQL, days)
+
+
+async def rebuild_days(client, days: List[str]):
+    """Recompute the rollups for these ISO dates with the transaction client."""
+    for index in range(0, len(days), ROLLUP_DAYS_PER_STATEMENT):
+        chunk = days[index:index + ROLLUP_DAYS_PER_STATEMENT]
+        for statement in _REBUILD_SQL:
+            await client.execute_raw(statement, chunk)
+
+
+async def refresh() -> Tuple[int, Optional[datetime]]:
+    """
+    Rebuild days with orders changed since the watermark, and stale days.
+    Returns (days rebuilt, new watermark); (0, None) if another worker holds
+    the refresh lock.
+    """
+    async with db.tx(timeout=timedelta(seconds=ROLLUP_TX_TIMEOUT_SECONDS)) as transaction:
+        if not await try_advisory_xact_lock(transaction, ROLLUP_LOCK_KEY):
+            return 0, None
+
+        watermark = await get_watermark(transaction)
+        since = watermark - timedelta(seconds=WATERMARK_OVERLAP_SECONDS) if watermark else EPOCH
+
+        row = await transaction.query_first(_CHANGED_SQL, since.isoformat())
+        stale = await transaction.query_first(_STALE_SQL)
+        stale_days = (stale["days"] or []) if stale else []
+        days = sorted(set((row["days"] or []) if row else []) | set(stale_days))
+        if not days:
+            return 0, watermark
+
+        await rebuild_days(transaction, days)
+        if stale_days:
+            await transaction.execute_raw('DELETE FROM "RollupStaleDay" WHERE "day" = ANY($1::date[])', stale_days)
+
+        latest = row["latest"] if row else None
+        if latest is None:
+            return len(days), watermark
+        if isinstance(latest, str):
+            latest = datetime.fromisoformat(latest.replace("Z", "+00:00"))
+        latest = utc_naive(latest)
+        await transaction.execute_raw(_WATERMARK_SQL, WATERMARK, latest.isoformat())
+    return len(days), latest
+
+
+async def rollup_loop():
+    """Background task: refresh the rollups every ROLLUP_INTERVAL_SECONDS."""
+    while True:
+        try:
+            await refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARNING] Sales rollup refresh failed: {e}")
+        await asyncio.sleep(ROLLUP_INTERVAL_SECONDS)
+
+
+async def platform_paid_revenue() -> float:
+    """All-time paid revenue: rollups before live_from() plus live orders since."""
+    boundary = (await live_from()).isoformat()
+    rolled, live = await asyncio.gather(
+        db.query_first(_ROLLED_PAID_REVENUE_SQL, boundary),
+        db.query_first(_LIVE_PAID_REVENUE_SQL, boundary),
+    )
+    return rolled["revenue"] + live["revenue"]
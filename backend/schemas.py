@@ -112,15 +112,25 @@ class MessageOut(BaseModel):
     class Config:
         from_attributes = True
 
+class SalesReportPoint(BaseModel):
+    period: datetime  # Start of the day/week/month
+    revenue: float
+    orders: int
+    unitsSold: int
+
 class SalesReport(BaseModel):
     totalRevenue: float
     totalOrders: int
     totalProductsSold: int
     recentOrders: List[dict]
     topProducts: List[dict]
+    series: List[SalesReportPoint] = []
+    periodStart: Optional[datetime] = None
+    periodEnd: Optional[datetime] = None
+    bucket: Optional[str] = None
 
 class OrderItemCreate(OrderItemBase):
-    pass
+    price: Optional[float] = None  # Ignored: the server prices every line
 
 class OrderItemOut(OrderItemBase):
     id: str
@@ -138,6 +148,7 @@ class OrderBase(BaseModel):
     paymentReference: Optional[str] = None
 
 class OrderCreate(OrderBase):
+    totalAmount: Optional[float] = None  # Ignored: computed by the pricing engine
     items: List[OrderItemCreate]
     shippingAddress: Optional[str] = None
     billingAddress: Optional[str] = None
@@ -169,6 +180,35 @@ class OrderMarkPaid(BaseModel):
     paymentProvider: Optional[str] = "local"
     paymentReference: Optional[str] = None
 
+# ============================================================
+# CHECKOUT PRICING SCHEMAS
+# ============================================================
+
+class QuoteItem(BaseModel):
+    productId: str
+    quantity: int
+
+class QuoteRequest(BaseModel):
+    items: List[QuoteItem]
+
+class QuoteLineOut(BaseModel):
+    productId: str
+    name: str
+    quantity: int
+    basePrice: float
+    unitPrice: float
+    lineTotal: float
+    inFlashSale: bool
+    discountPercent: Optional[int] = None
+    maxQuantity: Optional[int] = None
+    flashSaleProductId: Optional[str] = None
+
+class QuoteOut(BaseModel):
+    items: List[QuoteLineOut]
+    subtotal: float
+    discount: float
+    total: float
+
 # ============================================================
 # ORDER TRACKING SCHEMAS
 # ============================================================
@@ -248,6 +288,16 @@ class FlashSaleOut(FlashSaleBase):
     class Config:
         from_attributes = True
 
+class FlashPriceOut(BaseModel):
+    productId: str
+    inFlashSale: bool
+    basePrice: float
+    salePrice: Optional[float] = None
+    discountPercent: Optional[int] = None
+    maxQuantity: Optional[int] = None
+    remainingQuantity: int
+    timeRemaining: Optional[int] = None
+
 class FlashSaleListOut(BaseModel):
     id: str
     name: str
@@ -317,6 +367,7 @@ class ReviewOut(ReviewBase):
     isVerified: bool
     helpful: int
     images: List[str]
+    status: str = "approved"
     createdAt: datetime
     updatedAt: datetime
 
@@ -324,7 +375,7 @@ class ReviewOut(ReviewBase):
         from_attributes = True
 
 class ReviewWithUser(ReviewOut):
-    user: Optional[dict] = None  # Basic user info (name, etc.)
+    user: Optional[dict] = None  # Basic user info (id, name)
 
 class ReviewSummary(BaseModel):
     productId: str
@@ -332,6 +383,36 @@ class ReviewSummary(BaseModel):
     totalReviews: int
     ratingDistribution: dict  # {5: count, 4: count, ...}
 
+class ReviewImportItem(BaseModel):
+    userId: str
+    productId: str
+    rating: int
+    title: Optional[str] = None
+    comment: str
+    isVerified: bool = False
+    helpful: int = 0
+    images: List[str] = []
+    status: Literal["approved", "pending"] = "approved"
+    createdAt: Optional[datetime] = None  # Keep the original date when migrating
+
+class ReviewImport(BaseModel):
+    reviews: List[ReviewImportItem]
+
+class ReviewImportResult(BaseModel):
+    imported: int
+    skipped: int
+    errors: List[str]
+    productsUpdated: int
+
+class ReviewModeration(BaseModel):
+    approve: List[str] = []
+    delete: List[str] = []
+
+class ReviewPage(BaseModel):
+    summary: ReviewSummary
+    reviews: List[ReviewWithUser]
+    nextCursor: Optional[str] = None  # Pass back as ?cursor= for the next page
+
 # ============================================================
 # VENDOR COMMISSION SCHEMAS
 # ============================================================
@@ -347,6 +428,7 @@ class VendorEarningBase(BaseModel):
 class VendorEarningOut(VendorEarningBase):
     id: str
     storeId: str
+    allocatedAmount: float = 0.0
     createdAt: datetime
     updatedAt: datetime
 
@@ -357,6 +439,7 @@ class VendorEarningSummary(BaseModel):
     totalEarnings: float
     availableBalance: float
     pendingEarnings: float
+    reservedBalance: float = 0  # Held by payout requests awaiting approval
     paidAmount: float
     totalOrders: int
     recentEarnings: List[VendorEarningOut]
@@ -392,12 +475,26 @@ class VendorPayoutUpdate(BaseModel):
     processedBy: str
     rejectionReason: Optional[str] = None
 
+class PayoutBatchProcess(BaseModel):
+    payoutIds: List[str]
+    status: str  # completed, rejected or failed
+    rejectionReason: Optional[str] = None
+
+class PayoutBatchResult(BaseModel):
+    processed: int
+    skipped: List[str]  # Not found or no longer pending
+
 class CommissionBase(BaseModel):
     name: str
     rate: float
     description: Optional[str] = None
     isActive: bool = True
     isDefault: bool = False
+    storeId: Optional[str] = None  # Only this store
+    categoryId: Optional[str] = None  # Only this category
+    startsAt: Optional[datetime] = None
+    endsAt: Optional[datetime] = None
+    priority: int = 0  # Higher wins among rules of the same scope
 
 class CommissionCreate(CommissionBase):
     pass
@@ -408,6 +505,11 @@ class CommissionUpdate(BaseModel):
     description: Optional[str] = None
     isActive: Optional[bool] = None
     isDefault: Optional[bool] = None
+    storeId: Optional[str] = None
+    categoryId: Optional[str] = None
+    startsAt: Optional[datetime] = None
+    endsAt: Optional[datetime] = None
+    priority: Optional[int] = None
 
 class CommissionOut(CommissionBase):
     id: str
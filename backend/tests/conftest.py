@@ -0,0 +1,13 @@
+"""
+Unit tests for the backend modules. They need the backend requirements and a
+generated Prisma client (`prisma generate`), but no database: anything that
+would query is replaced with a small fake.
+
+    pip install -r requirements.txt pytest
+    python -m pytest tests
+"""
+import os
+import sys
+
+# Backend modules are imported flat, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,65 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import commissions
+from commissions import CompiledRules
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def commission(id, rate, store=None, category=None, priority=0, active=True, default=False,
+               starts=None, ends=None):
+    return SimpleNamespace(
+        id=id, rate=rate, storeId=store, categoryId=category, priority=priority,
+        isActive=active, isDefault=default, startsAt=starts, endsAt=ends,
+    )
+
+
+def test_falls_back_to_the_built_in_default():
+    rules = CompiledRules([])
+    assert rules.rate_for("s1", "c1", NOW) == commissions.DEFAULT_COMMISSION_RATE
+
+
+def test_default_commission_applies_even_when_inactive():
+    rules = CompiledRules([commission("d", 0.15, default=True, active=False)])
+    assert rules.rate_for("s1", "c1", NOW) == 0.15
+
+
+def test_most_specific_rule_wins():
+    rules = CompiledRules([
+        commission("d", 0.10, default=True),
+        commission("cat", 0.08, category="c1"),
+        commission("store", 0.06, store="s1"),
+        commission("both", 0.04, store="s1", category="c1"),
+    ])
+
+    assert rules.rate_for("s1", "c1", NOW) == 0.04
+    assert rules.rate_for("s1", "c2", NOW) == 0.06
+    assert rules.rate_for("s2", "c1", NOW) == 0.08
+    assert rules.rate_for("s2", "c2", NOW) == 0.10
+
+
+def test_priority_breaks_ties_at_the_same_level():
+    rules = CompiledRules([
+        commission("low", 0.07, store="s1", priority=1),
+        commission("high", 0.05, store="s1", priority=5),
+    ])
+    assert rules.rate_for("s1", None, NOW) == 0.05
+
+
+def test_rules_outside_their_window_are_skipped():
+    rules = CompiledRules([
+        commission("future", 0.01, store="s1", priority=9, starts=datetime(2024, 7, 1)),
+        commission("expired", 0.02, store="s1", priority=8, ends=NOW),
+        commission("current", 0.03, store="s1", starts=datetime(2024, 5, 1), ends=datetime(2024, 7, 1)),
+    ])
+    assert rules.rate_for("s1", None, NOW) == 0.03
+
+
+def test_inactive_and_unscoped_commissions_never_apply():
+    rules = CompiledRules([
+        commission("off", 0.01, store="s1", active=False),
+        commission("unscoped", 0.02),
+    ])
+    assert rules.rate_for("s1", "c1", NOW) == commissions.DEFAULT_COMMISSION_RATE
+    assert (None, None) not in rules.rules
@@ -0,0 +1,57 @@
+import asyncio
+from datetime import datetime
+
+import exports
+
+
+def collect(rows):
+    async def run():
+        return [row async for row in rows]
+    return asyncio.run(run())
+
+
+def test_paginate_passes_the_last_row_of_each_page(monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_PAGE_SIZE", 2)
+    rows = list(range(5))
+    calls = []
+
+    async def fetch_page(after, take):
+        calls.append(after)
+        start = 0 if after is None else after + 1
+        return rows[start:start + take]
+
+    assert collect(exports.paginate(fetch_page)) == rows
+    assert calls == [None, 1, 3]
+
+
+def test_paginate_stops_after_an_empty_page(monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_PAGE_SIZE", 2)
+    calls = []
+
+    async def fetch_page(after, take):
+        calls.append(after)
+        return [1, 2] if after is None else []
+
+    assert collect(exports.paginate(fetch_page)) == [1, 2]
+    assert calls == [None, 2]
+
+
+def test_csv_cell_escapes_formulas():
+    for value in ("=HYPERLINK(\"x\")", "+1", "-2+3", "@SUM(A1)", "\tcmd", "\rcmd"):
+        assert exports.csv_cell(value) == "'" + value
+
+
+def test_csv_cell_leaves_other_values_alone():
+    assert exports.csv_cell("Acme Store") == "Acme Store"
+    assert exports.csv_cell(-12.5) == -12.5
+    assert exports.csv_cell(None) == ""
+    assert exports.csv_cell(datetime(2024, 1, 2, 3, 4)) == "2024-01-02T03:04:00"
+
+
+def test_csv_export_escapes_vendor_text():
+    async def rows():
+        yield {"storeName": "=cmd|' /C calc'!A0", "amount": 10.0}
+
+    body = b"".join(collect(exports._encode(rows(), ["storeName", "amount"], "csv"))).decode()
+
+    assert body.splitlines() == ["storeName,amount", "'=cmd|' /C calc'!A0,10.0"]
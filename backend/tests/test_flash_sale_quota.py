@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import flash_sale_quota
+from flash_sale_quota import SoldCountBuffer
+
+
+class FakeClient:
+    def __init__(self, affected=1, rows=None, fail=False):
+        self.affected = affected
+        self.rows = rows or []
+        self.fail = fail
+        self.calls = []
+
+    async def execute_raw(self, query, *args):
+        self.calls.append((query, args))
+        return self.affected
+
+    async def query_raw(self, query, *args):
+        self.calls.append((query, args))
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        return self.rows
+
+
+LINE = {"flashSaleProductId": "fp1", "quantity": 2, "maxQuantity": 3, "name": "Phone"}
+
+
+def test_claim_upserts_the_customer_tally_with_the_limit():
+    client = FakeClient(affected=1)
+
+    asyncio.run(flash_sale_quota.claim_customer_quota(client, LINE, "u1"))
+
+    query, args = client.calls[0]
+    assert 'ON CONFLICT ("flashSaleProductId", "userId")' in query
+    assert args == ("fp1", "u1", 2, 3)
+
+
+def test_claim_over_the_limit_raises():
+    client = FakeClient(affected=0)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(flash_sale_quota.claim_customer_quota(client, LINE, "u1"))
+    assert exc.value.status_code == 400
+
+
+def test_release_returns_the_released_rows():
+    rows = [{"flashSaleProductId": "fp1", "quantity": 2}]
+    client = FakeClient(rows=rows)
+
+    released = asyncio.run(flash_sale_quota.release_customer_quota(client, "o1", "u1"))
+
+    assert released == rows
+    assert client.calls[0][1] == ("o1", "u1")
+
+
+def test_sold_count_adds_pending_sales_to_the_stored_count():
+    buffer = SoldCountBuffer()
+    buffer.record("fp1", 2)
+    buffer.record("fp1", -1)
+
+    assert buffer.sold_count(SimpleNamespace(id="fp1", soldCount=5)) == 6
+    assert buffer.sold_count(SimpleNamespace(id="fp2", soldCount=5)) == 5
+
+
+def test_flush_replaces_pending_sales_with_the_recomputed_count(monkeypatch):
+    client = FakeClient(rows=[{"id": "fp1", "soldCount": 7}])
+    monkeypatch.setattr(flash_sale_quota, "db", client)
+    buffer = SoldCountBuffer()
+    buffer.record("fp1", 2)
+
+    assert asyncio.run(buffer.flush()) == 1
+    assert client.calls[0][1] == (["fp1"],)
+    assert buffer.sold_count(SimpleNamespace(id="fp1", soldCount=0)) == 7
+    assert asyncio.run(buffer.flush()) == 0
+
+
+def test_failed_flush_keeps_the_pending_sales(monkeypatch):
+    monkeypatch.setattr(flash_sale_quota, "db", FakeClient(fail=True))
+    buffer = SoldCountBuffer()
+    buffer.record("fp1", 2)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(buffer.flush())
+
+    assert buffer.sold_count(SimpleNamespace(id="fp1", soldCount=5)) == 7
+    monkeypatch.setattr(flash_sale_quota, "db", FakeClient(rows=[{"id": "fp1", "soldCount": 7}]))
+    assert asyncio.run(buffer.flush()) == 1
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import ledger
+
+
+def earning(id, vendor_amount, allocated=0.0):
+    return SimpleNamespace(id=id, vendorAmount=vendor_amount, allocatedAmount=allocated)
+
+
+def test_allocates_oldest_first_and_splits_the_last_earning():
+    earnings = [earning("e1", 40.0), earning("e2", 50.0), earning("e3", 30.0)]
+
+    allocations = ledger.plan_allocations(earnings, "p1", 70.0)
+
+    assert allocations == [
+        {"payoutId": "p1", "earningId": "e1", "amount": 40.0},
+        {"payoutId": "p1", "earningId": "e2", "amount": 30.0},
+    ]
+
+
+def test_uses_only_the_unallocated_part_of_an_earning():
+    earnings = [earning("e1", 50.0, allocated=30.0), earning("e2", 50.0)]
+
+    allocations = ledger.plan_allocations(earnings, "p1", 40.0)
+
+    assert [(a["earningId"], a["amount"]) for a in allocations] == [("e1", 20.0), ("e2", 20.0)]
+
+
+def test_skips_fully_allocated_earnings():
+    earnings = [earning("e1", 50.0, allocated=50.0), earning("e2", 25.0)]
+
+    allocations = ledger.plan_allocations(earnings, "p1", 25.0)
+
+    assert [a["earningId"] for a in allocations] == ["e2"]
+
+
+def test_tolerates_float_rounding():
+    earnings = [earning("e1", 0.1), earning("e2", 0.2)]
+
+    allocations = ledger.plan_allocations(earnings, "p1", 0.3)
+
+    assert [a["earningId"] for a in allocations] == ["e1", "e2"]
+
+
+def test_zero_amount_allocates_nothing():
+    assert ledger.plan_allocations([earning("e1", 10.0)], "p1", 0.0) == []
+
+
+def test_raises_when_earnings_do_not_cover_the_amount():
+    with pytest.raises(HTTPException) as exc:
+        ledger.plan_allocations([earning("e1", 10.0)], "p1", 25.0)
+    assert exc.value.status_code == 409
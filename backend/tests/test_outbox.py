@@ -0,0 +1,133 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import outbox
+
+
+class FakeOutboxTable:
+    def __init__(self):
+        self.updates = []
+
+    async def update_many(self, where, data):
+        self.updates.append((where["id"]["in"], data))
+
+    async def update(self, where, data):
+        self.updates.append(([where["id"]], data))
+
+
+class FakeDb:
+    def __init__(self, events):
+        self.events = events
+        self.outboxevent = FakeOutboxTable()
+
+    async def query_raw(self, query, *args):
+        events, self.events = self.events, []
+        return events
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    registered = {}
+    monkeypatch.setattr(outbox, "_handlers", registered)
+    return registered
+
+
+def event(id, type="test.event", payload=None, attempts=1):
+    return {"id": id, "type": type, "aggregateId": f"agg-{id}", "payload": payload or {}, "attempts": attempts}
+
+
+def test_process_event_passes_the_payload_and_aggregate_id(handlers):
+    received = []
+
+    @outbox.handler("test.event")
+    async def handle(payload):
+        received.append(payload)
+
+    error = asyncio.run(outbox.worker.process_event(event("e1", payload=json.dumps({"x": 1}))))
+
+    assert error is None
+    assert received == [{"x": 1, "aggregateId": "agg-e1"}]
+
+
+def test_process_event_reports_failures_and_unknown_types(handlers):
+    @outbox.handler("test.event")
+    async def handle(payload):
+        raise ValueError("boom")
+
+    assert asyncio.run(outbox.worker.process_event(event("e1"))) == "ValueError: boom"
+    assert "No handler" in asyncio.run(outbox.worker.process_event(event("e2", type="other")))
+
+
+def test_drain_once_marks_done_and_retries_failures(handlers, monkeypatch):
+    @outbox.handler("test.event")
+    async def handle(payload):
+        if payload["aggregateId"] != "agg-ok":
+            raise RuntimeError("later")
+
+    fake = FakeDb([event("ok"), event("retry", attempts=1), event("dead", attempts=outbox.OUTBOX_MAX_ATTEMPTS)])
+    monkeypatch.setattr(outbox, "db", fake)
+
+    assert asyncio.run(outbox.OutboxWorker().drain_once()) == 3
+
+    done, retry, dead = fake.outboxevent.updates
+    assert done[0] == ["ok"] and done[1]["status"] == "done"
+    assert retry[0] == ["retry"] and retry[1]["status"] == "pending"
+    assert retry[1]["availableAt"] > datetime.now(timezone.utc)
+    assert dead[0] == ["dead"] and dead[1]["status"] == "failed"
+
+
+# order.paid: one earning per store, skipping stores that already have one
+
+class FakeOrders:
+    def __init__(self, order):
+        self.order = order
+
+    async def find_unique(self, where, include=None):
+        return self.order if self.order and self.order.id == where["id"] else None
+
+
+class FakeEarnings:
+    def __init__(self, store_ids):
+        self.store_ids = store_ids
+
+    async def find_many(self, where):
+        return [SimpleNamespace(storeId=store_id) for store_id in self.store_ids]
+
+
+@pytest.fixture
+def paid_order(monkeypatch):
+    import main
+
+    order = SimpleNamespace(id="o1", items=["item"])
+    created = []
+    seen_at = []
+
+    async def commission_by_store(items, at=None):
+        seen_at.append(at)
+        return {"s1": (100.0, 10.0), "s2": (50.0, 5.0)}
+
+    async def create_vendor_earning(order_id, amount, store_id, commission_amount=None):
+        created.append((order_id, store_id, amount, commission_amount))
+
+    monkeypatch.setattr(main, "db", SimpleNamespace(order=FakeOrders(order), vendorearning=FakeEarnings(["s1"])))
+    monkeypatch.setattr(main.commissions, "commission_by_store", commission_by_store)
+    monkeypatch.setattr(main, "create_vendor_earning", create_vendor_earning)
+    return SimpleNamespace(handle=main.handle_order_paid, created=created, seen_at=seen_at)
+
+
+def test_order_paid_creates_missing_earnings_at_the_payment_time(paid_order):
+    paid_at = "2024-06-01T12:00:00+00:00"
+
+    asyncio.run(paid_order.handle({"aggregateId": "o1", "paidAt": paid_at}))
+
+    assert paid_order.created == [("o1", "s2", 50.0, 5.0)]
+    assert paid_order.seen_at == [datetime.fromisoformat(paid_at)]
+
+
+def test_order_paid_ignores_deleted_orders(paid_order):
+    asyncio.run(paid_order.handle({"aggregateId": "gone"}))
+    assert paid_order.created == []
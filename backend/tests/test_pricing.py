@@ -0,0 +1,121 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import pricing
+
+
+class FakeProducts:
+    def __init__(self, products):
+        self.products = {p.id: p for p in products}
+        self.queries = 0
+
+    async def find_many(self, where):
+        self.queries += 1
+        return [self.products[i] for i in where["id"]["in"] if i in self.products]
+
+
+class FakeScheduler:
+    def __init__(self, prices=None):
+        self.prices = prices or {}
+
+    async def flash_price(self, product_id):
+        return self.prices.get(product_id)
+
+
+def product(id, price, stock=10):
+    return SimpleNamespace(id=id, name=f"Product {id}", price=price, stock=stock)
+
+
+def line(product_id, quantity):
+    return SimpleNamespace(productId=product_id, quantity=quantity)
+
+
+@pytest.fixture
+def shop(monkeypatch):
+    products = FakeProducts([product("a", 100.0), product("b", 19.99, stock=2)])
+    scheduler = FakeScheduler()
+    monkeypatch.setattr(pricing, "db", SimpleNamespace(product=products))
+    monkeypatch.setattr(pricing, "scheduler", scheduler)
+    pricing.price_cache.clear()
+    yield SimpleNamespace(products=products, scheduler=scheduler)
+    pricing.price_cache.clear()
+
+
+def test_merge_quantities_sums_repeated_products_in_order():
+    merged = pricing.merge_quantities([line("b", 1), line("a", 2), line("b", 3)])
+    assert list(merged.items()) == [("b", 4), ("a", 2)]
+
+
+def test_merge_quantities_rejects_non_positive_quantities():
+    with pytest.raises(HTTPException) as exc:
+        pricing.merge_quantities([line("a", 0)])
+    assert exc.value.status_code == 400
+
+
+def test_quote_uses_base_prices(shop):
+    quote = asyncio.run(pricing.quote_items([line("a", 2), line("b", 1)]))
+
+    assert [l["lineTotal"] for l in quote["items"]] == [200.0, 19.99]
+    assert quote["subtotal"] == 219.99
+    assert quote["total"] == 219.99
+    assert quote["discount"] == 0.0
+
+
+def test_quote_uses_the_flash_sale_price(shop):
+    ends = datetime.now(timezone.utc) + timedelta(hours=1)
+    fp = SimpleNamespace(id="fp1", flashSaleId="s1", salePrice=60.0, discountPercent=40, maxQuantity=3)
+    shop.scheduler.prices["a"] = (fp, SimpleNamespace(endTime=ends))
+
+    quote = asyncio.run(pricing.quote_items([line("a", 2)]))
+
+    item = quote["items"][0]
+    assert item["unitPrice"] == 60.0
+    assert item["inFlashSale"] is True
+    assert item["flashSaleProductId"] == "fp1"
+    assert quote["subtotal"] == 200.0
+    assert quote["total"] == 120.0
+    assert quote["discount"] == 80.0
+
+
+def test_quote_enforces_the_flash_sale_limit(shop):
+    fp = SimpleNamespace(id="fp1", flashSaleId="s1", salePrice=60.0, discountPercent=40, maxQuantity=1)
+    shop.scheduler.prices["a"] = (fp, SimpleNamespace(endTime=datetime.now(timezone.utc)))
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(pricing.quote_items([line("a", 2)]))
+    assert exc.value.status_code == 400
+
+
+def test_quote_rejects_insufficient_stock(shop):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(pricing.quote_items([line("b", 3)]))
+    assert exc.value.status_code == 400
+
+
+def test_quote_rejects_unknown_products(shop):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(pricing.quote_items([line("missing", 1)]))
+    assert exc.value.status_code == 404
+
+
+def test_price_book_is_cached(shop):
+    asyncio.run(pricing.load_price_book(["a", "b"]))
+    asyncio.run(pricing.load_price_book(["a", "b"]))
+    assert shop.products.queries == 1
+
+    pricing.invalidate(["a"])
+    asyncio.run(pricing.load_price_book(["a", "b"]))
+    assert shop.products.queries == 2
+
+
+def test_flash_prices_follow_the_request_order_with_a_warm_cache(shop):
+    shop.products.products["c"] = product("c", 5.0)
+    asyncio.run(pricing.load_price_book(["b"]))
+
+    prices = asyncio.run(pricing.flash_prices(["a", "b", "missing", "a", "c"]))
+
+    assert [p["productId"] for p in prices] == ["a", "b", "c"]
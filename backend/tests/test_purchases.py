@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+import purchases
+
+
+class FakeDb:
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        self.queries = 0
+
+    async def query_raw(self, query, user_id):
+        self.queries += 1
+        return [{"productId": product_id} for product_id in self.product_ids]
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = FakeDb(["p1", "p2"])
+    monkeypatch.setattr(purchases, "db", fake)
+    purchases.purchase_cache.clear()
+    yield fake
+    purchases.purchase_cache.clear()
+
+
+def test_one_query_answers_every_product(fake_db):
+    assert asyncio.run(purchases.has_purchased("u1", "p1")) is True
+    assert asyncio.run(purchases.has_purchased("u1", "p2")) is True
+    assert asyncio.run(purchases.has_purchased("u1", "p3")) is False
+    assert fake_db.queries == 1
+
+
+def test_old_negative_answers_reload_the_set(fake_db, monkeypatch):
+    asyncio.run(purchases.has_purchased("u1", "p1"))
+    monkeypatch.setattr(purchases, "NOT_PURCHASED_TTL_SECONDS", 0)
+    fake_db.product_ids.append("p3")
+
+    assert asyncio.run(purchases.has_purchased("u1", "p1")) is True
+    assert fake_db.queries == 1
+    assert asyncio.run(purchases.has_purchased("u1", "p3")) is True
+    assert fake_db.queries == 2
+
+
+def test_invalidate_drops_the_set(fake_db):
+    asyncio.run(purchases.has_purchased("u1", "p1"))
+    fake_db.product_ids.remove("p1")
+
+    purchases.invalidate("u1")
+
+    assert asyncio.run(purchases.has_purchased("u1", "p1")) is False
+    assert fake_db.queries == 2
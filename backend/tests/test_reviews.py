@@ -0,0 +1,34 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import reviews
+
+
+def test_recent_cursor_round_trips():
+    row = {"id": "r1", "createdAt": datetime(2024, 5, 1, 12, 30), "helpful": 4}
+
+    cursor = reviews.encode_cursor("recent", row)
+
+    assert "=" not in cursor
+    assert reviews.decode_cursor(cursor, "recent") == ("2024-05-01T12:30:00", "r1")
+
+
+def test_helpful_cursor_round_trips():
+    cursor = reviews.encode_cursor("helpful", {"id": "r2", "createdAt": None, "helpful": 7})
+    assert reviews.decode_cursor(cursor, "helpful") == (7, "r2")
+
+
+def test_cursor_must_match_the_sort():
+    cursor = reviews.encode_cursor("helpful", {"id": "r2", "createdAt": None, "helpful": 7})
+
+    with pytest.raises(HTTPException) as exc:
+        reviews.decode_cursor(cursor, "recent")
+    assert exc.value.status_code == 400
+
+
+def test_garbage_cursor_is_rejected():
+    with pytest.raises(HTTPException) as exc:
+        reviews.decode_cursor("not-a-cursor", "recent")
+    assert exc.value.status_code == 400
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+
+import rollups
+from vendor_reports import report_period, split_period
+
+
+def test_utc_naive_converts_aware_times():
+    aware = datetime(2024, 3, 1, 2, 0, tzinfo=timezone(timedelta(hours=5)))
+    assert rollups.utc_naive(aware) == datetime(2024, 2, 29, 21, 0)
+
+
+def test_utc_naive_keeps_naive_times():
+    assert rollups.utc_naive(datetime(2024, 3, 1, 2, 0)) == datetime(2024, 3, 1, 2, 0)
+
+
+def test_start_of_day_is_the_utc_midnight():
+    aware = datetime(2024, 3, 1, 2, 30, tzinfo=timezone(timedelta(hours=5)))
+    assert rollups.start_of_day(aware) == datetime(2024, 2, 29)
+
+
+def test_split_period_uses_rollups_for_whole_days_only():
+    start = datetime(2024, 1, 1, 15, 0)
+    end = datetime(2024, 1, 10, 6, 0)
+    live_from = datetime(2024, 1, 20)
+
+    rollup_start, rollup_end, live = split_period(start, end, live_from)
+
+    assert (rollup_start, rollup_end) == (datetime(2024, 1, 2), datetime(2024, 1, 10))
+    assert live == [(start, datetime(2024, 1, 2)), (datetime(2024, 1, 10), end)]
+
+
+def test_split_period_queries_live_past_the_watermark():
+    start = datetime(2024, 1, 1)
+    end = datetime(2024, 1, 10)
+    live_from = datetime(2024, 1, 5)
+
+    rollup_start, rollup_end, live = split_period(start, end, live_from)
+
+    assert (rollup_start, rollup_end) == (start, live_from)
+    assert live == [(start, start), (live_from, end)]
+
+
+def test_split_period_within_one_day_is_all_live():
+    start = datetime(2024, 1, 1, 8, 0)
+    end = datetime(2024, 1, 1, 20, 0)
+
+    rollup_start, rollup_end, live = split_period(start, end, datetime(2024, 2, 1))
+
+    assert (rollup_start, rollup_end) == (None, None)
+    # Both live ranges together cover the period exactly once
+    assert live == [(start, end), (start, start)]
+
+
+def test_report_period_defaults_to_all_time():
+    start, end = report_period(None, None, "day")
+
+    assert start == rollups.EPOCH.replace(tzinfo=timezone.utc)
+    assert end <= datetime.now(timezone.utc)
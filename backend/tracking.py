@@ -0,0 +1,196 @@
+"""
+Precomputed order tracking documents.
+
+The tracking page used to run a three-level include, a store lookup and a
+history query on every call. Instead, every write to an order's status or
+payment rebuilds a compact OrderTrackingProjection row, in the same
+transaction, holding the serialized OrderTrackingOut plus the owner and store
+IDs needed for permission checks. Archival builds any missing projection
+before the order leaves the live tables. Reads are served from an in-process
+cache (then the projection row) with an ETag derived from the projection
+version, so unchanged documents cost a 304 and no queries.
+
+Other workers drop their cached copy when the order status event arrives;
+TRACKING_CACHE_SECONDS bounds how stale a copy can get if that event is missed.
+"""
+import json
+import os
+from datetime import datetime
+from typing import NamedTuple, Optional, FrozenSet
+
+from prisma import Json
+
+import schemas
+from cache import TTLCache
+from database import db
+import order_events
+from pubsub import broker
+
+TRACKING_CACHE_SECONDS = float(os.getenv("TRACKING_CACHE_SECONDS", 15))
+VENDOR_STORE_CACHE_SECONDS = 300
+
+STATUS_STEPS = {
+    "pending": 0,
+    "paid": 1,
+    "processing": 2,
+    "shipped": 3,
+    "delivered": 4,
+    "cancelled": -1  # Special case
+}
+
+
+class TrackingEntry(NamedTuple):
+    userId: str
+    storeIds: FrozenSet[str]
+    etag: str
+    body: bytes
+    orderUpdatedAt: Optional[str]
+    orderId: str
+    version: int
+
+
+projection_cache = TTLCache(ttl=TRACKING_CACHE_SECONDS, maxsize=5000)
+vendor_store_cache = TTLCache(ttl=VENDOR_STORE_CACHE_SECONDS, maxsize=5000)
+
+
+def _to_entry(projection) -> TrackingEntry:
+    document = projection.document
+    if isinstance(document, str):
+        document = json.loads(document)
+    return TrackingEntry(
+        userId=projection.userId,
+        storeIds=frozenset(projection.storeIds),
+        etag=f'"{projection.orderId}-{projection.version}"',
+        body=json.dumps(document, separators=(",", ":")).encode("utf-8"),
+        orderUpdatedAt=document.get("order", {}).get("updatedAt"),
+        orderId=projection.orderId,
+        version=projection.version,
+    )
+
+
+def remember(entry: TrackingEntry):
+    """Cache an entry unless a newer version of the document is already cached."""
+    cached = projection_cache.get(entry.orderId)
+    if cached is None or cached.version <= entry.version:
+        projection_cache.set(entry.orderId, entry)
+
+
+async def refresh_projection(order, client=None) -> TrackingEntry:
+    """
+    Rebuild the tracking document for an order. `order` must include
+    items -> product. Called on every status/payment write; pass the
+    transaction that made the write so the document commits with it (the
+    updated order row stays locked until then, so rebuilds can't interleave).
+    The caller then remember()s the entry. Without a client the entry is
+    cached straight away.
+    """
+    client = client or db
+    status_history = await client.orderstatushistory.find_many(
+        where={"orderId": order.id},
+        order={"createdAt": "desc"}
+    )
+
+    document = schemas.OrderTrackingOut(
+        order=order,
+        statusHistory=status_history,
+        currentStep=STATUS_STEPS.get(order.status, 0),
+        estimatedDelivery=order.estimatedDelivery,
+        trackingNumber=order.trackingNumber,
+        shippingCarrier=order.shippingCarrier
+    ).model_dump(mode="json")
+    store_ids = sorted({item.product.storeId for item in order.items if item.product})
+
+    projection = await client.ordertrackingprojection.upsert(
+        where={"orderId": order.id},
+        data={
+            "create": {
+                "orderId": order.id,
+                "userId": order.userId,
+                "storeIds": store_ids,
+                "document": Json(document),
+            },
+            "update": {
+                "storeIds": store_ids,
+                "document": Json(document),
+                "version": {"increment": 1},
+            },
+        }
+    )
+
+    entry = _to_entry(projection)
+    if client is db:
+        remember(entry)
+    return entry
+
+
+async def ensure_projections(client, orders):
+    """Build projections for orders that have none yet (orders must include items -> product)."""
+    if not orders:
+        return
+    existing = await client.ordertrackingprojection.find_many(
+        where={"orderId": {"in": [o.id for o in orders]}}
+    )
+    have = {p.orderId for p in existing}
+    for order in orders:
+        if order.id not in have:
+            await refresh_projection(order, client)
+
+
+async def get_tracking(order_id: str) -> Optional[TrackingEntry]:
+    """Cached entry, else the projection row, else build it from the order."""
+    entry = projection_cache.get(order_id)
+    if entry is not None:
+        return entry
+
+    projection = await db.ordertrackingprojection.find_unique(where={"orderId": order_id})
+    if projection:
+        entry = _to_entry(projection)
+        remember(entry)
+        return entry
+
+    # Orders created before projections existed are built on first read
+    order = await db.order.find_unique(
+        where={"id": order_id},
+        include={"items": {"include": {"product": True}}}
+    )
+    if not order:
+        return None
+    return await refresh_projection(order)
+
+
+async def vendor_store_id(user_id: str) -> Optional[str]:
+    """Cached store ID for a vendor (empty string cached for vendors without a store)."""
+    store_id = vendor_store_cache.get(user_id)
+    if store_id is None:
+        store = await db.store.find_first(where={"vendorId": user_id})
+        store_id = store.id if store else ""
+        vendor_store_cache.set(user_id, store_id)
+    return store_id or None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+async def _on_order_event(topic: str, data):
+    """Drop cached documents that are older than a status change seen on any worker."""
+    if not isinstance(data, dict):
+        return
+    order_id = data.get("orderId")
+    entry = projection_cache.get(order_id)
+    if entry is None:
+        return
+    try:
+        is_current = (
+            datetime.fromisoformat(entry.orderUpdatedAt) == datetime.fromisoformat(data.get("updatedAt"))
+        )
+    except (TypeError, ValueError):
+        is_current = False
+    if not is_current:
+        projection_cache.delete(order_id)
+
+
+broker.on(order_events.CHANNEL, _on_order_event)
@@ -0,0 +1,204 @@
+"""
+Vendor sales reports, aggregated in the database.
+
+A report over [start, end) reads whole UTC days from the daily rollups (see
+rollups.py) and queries live orders only for what the rollups don't cover:
+today (or since the rollup watermark) and any partial days at the edges of
+the period. Live queries read hot and archived orders alike, since an edge
+day can predate archival, and are driven by the createdAt indexes, so a
+report costs the same at any history size. Without bounds a report covers
+the store's whole history, as it did before periods existed. Totals, the per-bucket series,
+top products and recent orders are separate grouped queries run
+concurrently and merged here.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from database import db
+import rollups
+
+BUCKETS = ("day", "week", "month")
+TOP_PRODUCTS = 5
+RECENT_ORDERS = 5
+
+# Hot and archived orders/items; the range filters are pushed into each branch
+_ORDERS = """(
+    SELECT "id", "totalAmount", "status", "createdAt" FROM "Order"
+    UNION ALL
+    SELECT "id", "totalAmount", "status", "createdAt" FROM "OrderArchive"
+)"""
+
+# Store's live order lines in up to two ranges.
+# $1 store, [$2, $3) and [$4, $5) (either may be empty)
+_LIVE_LINES = f"""
+FROM {_ORDERS} o
+JOIN {rollups.ITEMS} oi ON oi."orderId" = o."id"
+JOIN "Product" p ON p."id" = oi."productId"
+WHERE p."storeId" = $1
+  AND ((o."createdAt" >= $2::timestamp AND o."createdAt" < $3::timestamp)
+    OR (o."createdAt" >= $4::timestamp AND o."createdAt" < $5::timestamp))
+"""
+
+_LIVE_SERIES_SQL = f"""
+SELECT date_trunc($6, o."createdAt") AS "bucket",
+       SUM(oi."price" * oi."quantity")::float AS "revenue",
+       COUNT(DISTINCT o."id")::int AS "orders",
+       SUM(oi."quantity")::int AS "units"
+{_LIVE_LINES}
+GROUP BY 1
+"""
+
+_LIVE_PRODUCTS_SQL = f"""
+SELECT oi."productId",
+       SUM(oi."quantity")::int AS "sold",
+       SUM(oi."price" * oi."quantity")::float AS "revenue"
+{_LIVE_LINES}
+GROUP BY oi."productId"
+"""
+
+# Rollup days in [$2, $3)
+_ROLLUP_SERIES_SQL = """
+SELECT date_trunc($4, "day"::timestamp) AS "bucket",
+       SUM("revenue")::float AS "revenue",
+       SUM("orders")::int AS "orders",
+       SUM("units")::int AS "units"
+FROM "DailyStoreSales"
+WHERE "storeId" = $1 AND "day" >= $2::date AND "day" < $3::date
+GROUP BY 1
+"""
+
+_ROLLUP_PRODUCTS_SQL = """
+SELECT "productId",
+       SUM("units")::int AS "sold",
+       SUM("revenue")::float AS "revenue"
+FROM "DailyStoreProductSales"
+WHERE "storeId" = $1 AND "day" >= $2::date AND "day" < $3::date
+GROUP BY "productId"
+"""
+
+_RECENT_ORDERS_SQL = f"""
+SELECT o."id", o."totalAmount", o."status", o."createdAt"
+FROM {_ORDERS} o
+WHERE o."createdAt" >= $2::timestamp AND o."createdAt" < $3::timestamp
+  AND EXISTS (
+    SELECT 1 FROM {rollups.ITEMS} oi
+    JOIN "Product" p ON p."id" = oi."productId"
+    WHERE oi."orderId" = o."id" AND p."storeId" = $1
+  )
+ORDER BY o."createdAt" DESC
+LIMIT {RECENT_ORDERS}
+"""
+
+
+def report_period(start: Optional[datetime], end: Optional[datetime], bucket: str) -> Tuple[datetime, datetime]:
+    """Validate query parameters; default to the store's whole history up to now."""
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Invalid bucket. Must be one of: {', '.join(BUCKETS)}")
+    end = end or datetime.now(timezone.utc)
+    start = start or rollups.EPOCH
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    return start, end
+
+
+def split_period(start: datetime, end: datetime, live_from: datetime):
+    """
+    (rollup_start, rollup_end, live_ranges) for naive UTC bounds: whole days
+    before live_from come from the rollups, the rest is queried live.
+    """
+    first_whole_day = rollups.start_of_day(start)
+    if first_whole_day < start:
+        first_whole_day += timedelta(days=1)
+    rollup_start = first_whole_day
+    rollup_end = min(rollups.start_of_day(end), live_from)
+
+    if rollup_start >= rollup_end:
+        return None, None, [(start, end), (start, start)]
+    return rollup_start, rollup_end, [(start, rollup_start), (rollup_end, end)]
+
+
+def _bucket_key(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return rollups.utc_naive(value)
+
+
+async def _no_rows():
+    return []
+
+
+async def store_report(store_id: str, start: datetime, end: datetime, bucket: str = "day") -> dict:
+    naive_start, naive_end = rollups.utc_naive(start), rollups.utc_naive(end)
+    rollup_start, rollup_end, live_ranges = split_period(naive_start, naive_end, await rollups.live_from())
+
+    live_args = [store_id]
+    for range_start, range_end in live_ranges:
+        live_args += [range_start.isoformat(), range_end.isoformat()]
+
+    if rollup_start is not None:
+        rollup_args = (store_id, rollup_start.date().isoformat(), rollup_end.date().isoformat())
+        rollup_series = db.query_raw(_ROLLUP_SERIES_SQL, *rollup_args, bucket)
+        rollup_products = db.query_raw(_ROLLUP_PRODUCTS_SQL, *rollup_args)
+    else:
+        rollup_series, rollup_products = _no_rows(), _no_rows()
+
+    series_rows, product_rows, live_series, live_products, recent_orders = await asyncio.gather(
+        rollup_series,
+        rollup_products,
+        db.query_raw(_LIVE_SERIES_SQL, *live_args, bucket),
+        db.query_raw(_LIVE_PRODUCTS_SQL, *live_args),
+        db.query_raw(_RECENT_ORDERS_SQL, store_id, naive_start.isoformat(), naive_end.isoformat()),
+    )
+
+    # Each order falls in exactly one day, so per-day order counts add up
+    series: Dict[datetime, Dict[str, float]] = {}
+    for row in list(series_rows) + list(live_series):
+        point = series.setdefault(_bucket_key(row["bucket"]), {"revenue": 0.0, "orders": 0, "unitsSold": 0})
+        point["revenue"] += row["revenue"] or 0
+        point["orders"] += row["orders"] or 0
+        point["unitsSold"] += row["units"] or 0
+
+    products: Dict[str, Dict[str, float]] = {}
+    for row in list(product_rows) + list(live_products):
+        stats = products.setdefault(row["productId"], {"sold": 0, "revenue": 0.0})
+        stats["sold"] += row["sold"] or 0
+        stats["revenue"] += row["revenue"] or 0
+    top_ids = sorted(products, key=lambda pid: products[pid]["sold"], reverse=True)[:TOP_PRODUCTS]
+    names = {}
+    if top_ids:
+        names = {p.id: p.name for p in await db.product.find_many(where={"id": {"in": top_ids}})}
+
+    return {
+        "totalRevenue": sum(point["revenue"] for point in series.values()),
+        "totalOrders": sum(point["orders"] for point in series.values()),
+        "totalProductsSold": sum(point["unitsSold"] for point in series.values()),
+        "recentOrders": [
+            {
+                "id": row["id"],
+                "amount": row["totalAmount"],
+                "status": row["status"],
+                "date": str(row["createdAt"]),
+            }
+            for row in recent_orders
+        ],
+        "topProducts": [
+            {
+                "productId": pid,
+                "name": names.get(pid),
+                "sold": products[pid]["sold"],
+                "revenue": products[pid]["revenue"],
+            }
+            for pid in top_ids
+        ],
+        "series": [{"period": period, **series[period]} for period in sorted(series)],
+        "periodStart": start,
+        "periodEnd": end,
+        "bucket": bucket,
+    }
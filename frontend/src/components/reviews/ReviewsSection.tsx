@@ -1,7 +1,7 @@
 "use client";
 
 import React, { useState, useEffect } from "react";
-import { getProductReviews, getProductReviewsList, Review, ReviewSummary, ReviewCreate, ReviewUpdate } from "@/lib/api";
+import { getProductReviews, Review, ReviewSummary, ReviewCreate, ReviewUpdate } from "@/lib/api";
 import { RatingDisplay, RatingBreakdown, ReviewList, ReviewListSkeleton, ReviewForm } from "./index";
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/Tabs";
 import { Button } from "@/components/ui";
@@ -16,22 +16,21 @@ export function ReviewsSection({ productId }: ReviewsSectionProps) {
     const [isLoading, setIsLoading] = useState(true);
     const [showForm, setShowForm] = useState(false);
     const [editingReview, setEditingReview] = useState<Review | undefined>(undefined);
-    const [page, setPage] = useState(1);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
     const [sort, setSort] = useState<"recent" | "helpful">("recent");
 
     useEffect(() => {
         loadReviews();
-    }, [productId, page, sort]);
+    }, [productId, sort]);
 
     const loadReviews = async () => {
         setIsLoading(true);
         try {
-            const [summaryData, reviewsData] = await Promise.all([
-                getProductReviews(productId),
-                getProductReviewsList(productId, page, 10, sort),
-            ]);
-            setSummary(summaryData);
-            setReviews(reviewsData);
+            const data = await getProductReviews(productId, null, 10, sort);
+            setSummary(data.summary);
+            setReviews(data.reviews);
+            setNextCursor(data.nextCursor);
         } catch (error) {
             console.error("Failed to load reviews:", error);
         } finally {
@@ -39,6 +38,21 @@ export function ReviewsSection({ productId }: ReviewsSectionProps) {
         }
     };
 
+    const loadMoreReviews = async () => {
+        if (!nextCursor) return;
+        setIsLoadingMore(true);
+        try {
+            const data = await getProductReviews(productId, nextCursor, 10, sort);
+            setSummary(data.summary);
+            setReviews((current) => [...current, ...data.reviews]);
+            setNextCursor(data.nextCursor);
+        } catch (error) {
+            console.error("Failed to load more reviews:", error);
+        } finally {
+            setIsLoadingMore(false);
+        }
+    };
+
     const handleReviewSubmit = () => {
         setShowForm(false);
         setEditingReview(undefined);
@@ -120,7 +134,6 @@ export function ReviewsSection({ productId }: ReviewsSectionProps) {
                         value={sort}
                         onChange={(e) => {
                             setSort(e.target.value as typeof sort);
-                            setPage(1);
                         }}
                         className="px-3 py-2 text-sm border border-gray-200 rounded-lg focus:outline-none focus:ring-2 focus:ring-primary/20 focus:border-primary"
                     >
@@ -141,10 +154,11 @@ export function ReviewsSection({ productId }: ReviewsSectionProps) {
                 )}
 
                 {/* Load More */}
-                {summary && summary.totalReviews > reviews.length && (
+                {!isLoading && nextCursor && (
                     <div className="mt-6 text-center">
                         <Button
-                            onClick={() => setPage(page + 1)}
+                            onClick={loadMoreReviews}
+                            loading={isLoadingMore}
                             variant="outline"
                             className="w-full sm:w-auto"
                         >
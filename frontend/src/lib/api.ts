@@ -175,6 +175,12 @@ export interface ReviewSummary {
     };
 }
 
+export interface ReviewPage {
+    summary: ReviewSummary;
+    reviews: ReviewWithUser[];
+    nextCursor: string | null;
+}
+
 export interface ReviewCreate {
     productId: string;
     rating: number;
@@ -453,8 +459,14 @@ export async function getVendorProducts(): Promise<Product[]> {
     return fetchApi<Product[]>('/api/v1/vendor/products');
 }
 
-export async function getVendorOrders(): Promise<unknown[]> {
-    return fetchApi<unknown[]>('/api/v1/vendor/orders');
+export async function getVendorOrders(
+    limit: number = 50,
+    skip: number = 0,
+    includeArchived: boolean = false
+): Promise<unknown[]> {
+    return fetchApi<unknown[]>(
+        `/api/v1/vendor/orders?limit=${limit}&skip=${skip}&include_archived=${includeArchived}`
+    );
 }
 
 export async function getVendorReports(): Promise<unknown> {
@@ -821,24 +833,18 @@ export async function searchProducts(filters: SearchFilters): Promise<SearchResu
 // ============================================================================
 
 /**
- * Get review summary for a product
+ * Get review summary plus one page of reviews for a product.
+ * Pass the returned nextCursor to load the following page.
  */
-export async function getProductReviews(productId: string): Promise<ReviewSummary> {
-    return fetchApi<ReviewSummary>(`/api/v1/products/${productId}/reviews`);
-}
-
-/**
- * Get paginated list of reviews for a product
- */
-export async function getProductReviewsList(
+export async function getProductReviews(
     productId: string,
-    page: number = 1,
+    cursor?: string | null,
     limit: number = 10,
     sort: "recent" | "helpful" = "recent"
-): Promise<ReviewWithUser[]> {
-    return fetchApi<ReviewWithUser[]>(
-        `/api/v1/products/${productId}/reviews/list?page=${page}&limit=${limit}&sort=${sort}`
-    );
+): Promise<ReviewPage> {
+    const params = new URLSearchParams({ limit: String(limit), sort });
+    if (cursor) params.append("cursor", cursor);
+    return fetchApi<ReviewPage>(`/api/v1/products/${productId}/reviews?${params.toString()}`);
 }
 
 /**